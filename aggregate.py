@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+from collections import Counter
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+import argparse
+import os
+import pickle
+import chunks
+
+
+'''
+One pass aggregation for the historical rarity reports.
+
+An Aggregator counts every distinct combination of a key (a process name,
+dir, parent/child pair or user) and its dimension values (user, system,
+tenant) as events stream past. The per key counts and per dimension value
+counts of each report are all derived from those combinations afterwards,
+which replaces a groupby, nunique, value_counts and merge per dimension.
+
+The combinations are also the whole state of a report, so they are saved
+as snapshots that can be merged: a report over a new day of events merges
+in the snapshot of the previous days rather than parsing them again, and
+snapshots of different days or shards are merged with
+
+    ./aggregate.py --output merged.state day1.state day2.state ...
+'''
+
+
+# The dimensions broken down in the historical reports, as the column holding
+# the list of value:count entries and the column holding the distinct count.
+DIMENSIONS = [('user.name', 'uniq_usernames'), ('system.computer', 'uniq_systems'), ('tenant', 'uniq_tenants')]
+
+
+class Aggregator:
+
+    def __init__(self, dimensions: int = len(DIMENSIONS)) -> None:
+        self.dimensions: int = dimensions
+        self.combinations: Counter = Counter()
+
+    def add(self, key: Hashable, values: Tuple[Any, ...] = (), n: int = 1) -> None:
+        self.combinations[(key, values)] += n
+
+    def merge(self, other: 'Aggregator') -> None:
+        self.combinations.update(other.combinations)
+
+    # Number of events per key, in the order keys were first seen
+    def counts(self) -> Counter:
+        counts: Counter = Counter()
+        for (key, _), n in self.combinations.items():
+            if key is not None:
+                counts[key] += n
+        return counts
+
+    # Value counts of each dimension per key
+    def breakdowns(self) -> Dict[Hashable, List[Counter]]:
+        result: Dict[Hashable, List[Counter]] = {}
+        for (key, values), n in self.combinations.items():
+            counters = result.get(key)
+            if counters is None:
+                counters = [Counter() for _ in range(self.dimensions)]
+                result[key] = counters
+            for counter, value in zip(counters, values):
+                if value is not None:
+                    counter[value] += n
+        return result
+
+
+# Partial result of a report over (part of) its input: events, skipped lines
+# and the aggregator.
+Result = Tuple[int, int, Aggregator]
+
+
+# Merge the results of a report over consecutive parts of its input, in
+# input order so keys keep their first seen order.
+def combine(results: Iterable[Result]) -> Result:
+    total = 0
+    skipped = 0
+    aggregator: Optional[Aggregator] = None
+    for part_total, part_skipped, part in results:
+        total = total + part_total
+        skipped = skipped + part_skipped
+        if aggregator is None:
+            aggregator = part
+        else:
+            aggregator.merge(part)
+    return (total, skipped, aggregator if aggregator is not None else Aggregator())
+
+
+# Run function(input, *args) for a report, over parts of the input in worker
+# processes when there are several workers and the input is a file.
+def collect(function: Callable[..., Result], input: Any, workers: int, *args: Any) -> Result:
+    path = chunks.path_of(input)
+    if workers > 1 and path is not None:
+        return combine(chunks.imap(function, path, workers, *args))
+    return function(input, *args)
+
+
+# Snapshots record the report they belong to, merging snapshots of
+# different reports (or format versions) is refused.
+SNAPSHOT_VERSION = 1
+
+
+def save(path: str, result: Result, report: str) -> None:
+    total, skipped, aggregator = result
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'report': report,
+        'events': total,
+        'skipped': skipped,
+        'dimensions': aggregator.dimensions,
+        'combinations': dict(aggregator.combinations),
+    }
+    # Write next to the snapshot and move into place, so an interrupted run
+    # leaves the previous snapshot intact
+    partial = path + '.partial'
+    with open(partial, 'wb') as output:
+        pickle.dump(snapshot, output, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(partial, path)
+
+
+def load(path: str, report: Optional[str] = None) -> Tuple[str, Result]:
+    with open(path, 'rb') as input:
+        snapshot = pickle.load(input)
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        raise ValueError('not a report snapshot: ' + path)
+    if report is not None and snapshot['report'] != report:
+        raise ValueError(path + ' is a snapshot of ' + snapshot['report'] + ', not ' + report)
+    aggregator = Aggregator(snapshot['dimensions'])
+    aggregator.combinations.update(snapshot['combinations'])
+    return (snapshot['report'], (snapshot['events'], snapshot['skipped'], aggregator))
+
+
+# Merge a result into the snapshot at path (created if missing) and return
+# the merged result
+def accumulate(path: str, result: Result, report: str) -> Result:
+    if os.path.exists(path):
+        _, previous = load(path, report)
+        result = combine([previous, result])
+    save(path, result, report)
+    return result
+
+
+# Merge snapshots of the same report, in the order given
+def merge(paths: Sequence[str]) -> Tuple[str, Result]:
+    report, result = load(paths[0])
+    return (report, combine([result] + [load(path, report)[1] for path in paths[1:]]))
+
+
+# Summarize the value counts of one dimension as value:count entries, most
+# frequent first, along with the number of distinct values.
+def summarize(counter: Counter) -> Tuple[List[str], int]:
+    entries = sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+    return ([str(value) + ':' + str(n) for value, n in entries], len(counter))
+
+
+# Add the list and distinct count of each dimension to a record
+def describe(record: Dict[str, Any], counters: List[Counter]) -> Dict[str, Any]:
+    for (list_column, distinct_column), counter in zip(DIMENSIONS, counters):
+        record[list_column], record[distinct_column] = summarize(counter)
+    return record
+
+
+# Build report records with the key columns and count, followed by the list
+# and distinct count of each dimension, rarest keys first.
+def records(aggregator: Aggregator, key_columns: Sequence[str], count_column: str = 'count') -> List[Dict[str, Any]]:
+    breakdowns = aggregator.breakdowns()
+    result = []
+    for key, count in sorted(aggregator.counts().items(), key=lambda item: item[1]):
+        record: Dict[str, Any] = dict(zip(key_columns, key if len(key_columns) > 1 else (key,)))
+        record[count_column] = count
+        result.append(describe(record, breakdowns[key]))
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge snapshots of a historical report')
+    parser.add_argument('snapshots', nargs='+', metavar='SNAPSHOT', help='Snapshot written with --state')
+    parser.add_argument('--output', required=True, help='File to write the merged snapshot to')
+    args = parser.parse_args()
+
+    report, result = merge(args.snapshots)
+    save(args.output, result, report)
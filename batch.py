@@ -0,0 +1,76 @@
+from typing import Hashable, List, Optional
+import numpy as np
+import pandas as pd
+import expiry
+
+
+'''
+Vectorized checks of micro-batches of events for the rare_* models
+(--batch-size).
+
+A batch is checked against the model as it stood before the batch, with
+the events of the batch itself accounted for by array operations: the
+previous sighting of each event's key is the last earlier event in the
+batch with the same key, or else the model's entry for the key. The model
+is then updated once per distinct key, with its last sighting, in the
+order updating it event by event would have left it.
+
+This gives the same verdicts as checking the events one by one as long as
+no event is later than the model's lateness allowance (behind the latest
+event so far), as only then could keys expiring within the batch change a
+verdict. Batches with such events, and models capped with --max-keys whose
+evictions depend on every single update, are checked one by one instead.
+'''
+
+
+# Time of a key never seen, NAT >= t - size never holds
+NAT = np.iinfo(np.int64).min
+
+
+# Whether each event's key was unseen within the window before it, as
+# ExpiringDict based Model.check would say, updating the model. None if the
+# batch has to be checked one by one.
+def rare(seen: expiry.ExpiringDict, size: int, keys: List[Hashable], times: np.ndarray) -> Optional[np.ndarray]:
+    n = len(keys)
+    if n == 0:
+        return np.zeros(0, dtype=bool)
+    if seen.max_keys is not None:
+        return None
+
+    # Watermark as each event arrives
+    before = np.empty(n, dtype=np.int64)
+    before[0] = times[0] if seen.watermark is None else seen.watermark
+    before[1:] = np.maximum(np.maximum.accumulate(times)[:-1], before[0])
+    if (times < before - seen.lateness).any():
+        return None
+
+    # Group the events by key, keeping their order within each key
+    codes, uniques = pd.factorize(pd.Series(keys, dtype=object))
+    order = np.argsort(codes, kind='stable')
+    ordered_codes = codes[order]
+    ordered_times = times[order]
+    repeat = np.zeros(n, dtype=bool)
+    repeat[1:] = ordered_codes[1:] == ordered_codes[:-1]
+
+    # Previous sighting: the previous event of the key in the batch, else
+    # the model's
+    initial = np.array([seen.get(key, NAT) for key in uniques], dtype=np.int64)
+    previous = np.empty(n, dtype=np.int64)
+    previous[0] = NAT
+    previous[1:] = ordered_times[:-1]
+    previous[~repeat] = initial[ordered_codes[~repeat]]
+    result = np.empty(n, dtype=bool)
+    result[order] = previous < ordered_times - size
+
+    # Record the last sighting of each key, in order of last sighting
+    last = np.ones(n, dtype=bool)
+    last[:-1] = ~repeat[1:]
+    for i in np.sort(order[last]).tolist():
+        seen[keys[i]] = int(times[i])
+
+    # The latest event need not be the last sighting of its key
+    latest = max(int(before[-1]), int(times[-1]))
+    if seen.watermark is None or latest > seen.watermark:
+        seen.watermark = latest
+        seen.expire()
+    return result
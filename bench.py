@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import blake2b
+from time import perf_counter, perf_counter_ns
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+import engine
+import sink
+import synth
+
+
+'''
+Throughput benchmarks of the detectors over synthetic events.
+
+Every detector entry point, streaming and historical, is run over synthetic
+streams from synth.py of each size (10k, 1M and 10M events by default),
+4624 events for the user detectors and 4688 events for the process
+detectors. Each run gets a fresh process, so its peak RSS is its own.
+Streaming detectors are fed the events one at a time through an Engine,
+timing every event for the p50/p99 latencies, and count their alerts
+rather than logging them. Historical scripts run their main() on the whole
+input and serialize the report as their CLI does, so only their overall
+throughput is measured.
+
+Results are written as JSON, one entry per run:
+
+    {"entry": "rare_users", "events": 1000000, "seconds": ..., "events_per_second": ...,
+     "p50_us": ..., "p99_us": ..., "peak_rss_mb": ..., "alerts": ..., "setup_seconds": ...}
+
+along with the settings and the environment. Compare with an earlier
+result file with --baseline:
+
+    ./bench.py --events 10000 --events 1000000 --output bench.json --baseline previous.json
+'''
+
+
+SIZES = [10000, 1000000, 10000000]
+
+SKIP = pd.Timedelta('1 day')
+WINDOW = pd.Timedelta('3 days')
+
+# Training events for rare_process_pairs, at most
+TRAINING = 1000000
+
+
+# Alert sink counting alerts instead of keeping them
+class Tally(sink.Collector):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.count: int = 0
+
+    def emit(self, detector: str, message: str, kv: Dict[str, Any]) -> None:
+        self.count = self.count + 1
+
+
+def logon_times(training: Optional[str]) -> List[Any]:
+    import logon_times
+    return [logon_times.Detector(WINDOW)]
+
+
+def rare_users(training: Optional[str]) -> List[Any]:
+    import rare_users
+    return [rare_users.Detector(SKIP, WINDOW)]
+
+
+def rare_process_name(training: Optional[str]) -> List[Any]:
+    import rare_process_name
+    return [rare_process_name.Detector(SKIP, WINDOW)]
+
+
+def rare_process_dir(training: Optional[str]) -> List[Any]:
+    import rare_process_dir
+    return [rare_process_dir.Detector(SKIP, WINDOW)]
+
+
+def rare_process_pairs(training: Optional[str]) -> List[Any]:
+    import rare_process_pairs
+    with open(training) as input:
+        return [rare_process_pairs.Detector(rare_process_pairs.train(input))]
+
+
+def rare_parents(training: Optional[str]) -> List[Any]:
+    import rare_parents
+    return [rare_parents.Detector()]
+
+
+def rare_users_historical(path: str) -> Any:
+    import rare_users_historical
+    with open(path) as input:
+        return rare_users_historical.main(input)
+
+
+def rare_process_name_historical(path: str) -> Any:
+    import rare_process_name_historical
+    with open(path) as input:
+        return rare_process_name_historical.main(input, None)
+
+
+def rare_process_dir_historical(path: str) -> Any:
+    import rare_process_dir_historical
+    with open(path) as input:
+        return rare_process_dir_historical.main(input, None)
+
+
+def rare_process_pairs_historical(path: str) -> Any:
+    import rare_process_pairs_historical
+    with open(path) as input:
+        return rare_process_pairs_historical.main(input, None, None)
+
+
+# Streaming entry points build their detectors (from training data if they
+# need any), historical ones report on an input. By name, with the kind of
+# events they take.
+STREAMING: Dict[str, Tuple[str, Callable[[Optional[str]], List[Any]]]] = {
+    'logon_times': ('4624', logon_times),
+    'rare_users': ('4624', rare_users),
+    'rare_process_name': ('4688', rare_process_name),
+    'rare_process_dir': ('4688', rare_process_dir),
+    'rare_process_pairs': ('4688', rare_process_pairs),
+    'rare_parents': ('4688', rare_parents),
+}
+HISTORICAL: Dict[str, Tuple[str, Callable[[str], Any]]] = {
+    'rare_users_historical': ('4624', rare_users_historical),
+    'rare_process_name_historical': ('4688', rare_process_name_historical),
+    'rare_process_dir_historical': ('4688', rare_process_dir_historical),
+    'rare_process_pairs_historical': ('4688', rare_process_pairs_historical),
+}
+ENTRIES = list(STREAMING) + list(HISTORICAL)
+
+
+def peak_rss() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Feed the events of a file to a streaming entry point one at a time
+def stream(entry: str, path: str, events: int, training: Optional[str]) -> Dict[str, Any]:
+    started = perf_counter()
+    detectors = STREAMING[entry][1](training)
+    setup = perf_counter() - started
+
+    tally = Tally()
+    e = engine.Engine(detectors, tally)
+    latencies = np.zeros(events, dtype=np.int64)
+    started = perf_counter()
+    with open(path, 'rb') as input:
+        for i, line in enumerate(input):
+            t = perf_counter_ns()
+            e.feed(line)
+            latencies[i] = perf_counter_ns() - t
+    e.finish()
+    seconds = perf_counter() - started
+
+    p50, p99 = np.percentile(latencies[:e.events], [50, 99]) / 1000
+    return {'seconds': seconds, 'events_per_second': e.events / seconds, 'p50_us': float(p50), 'p99_us': float(p99), 'alerts': tally.count, 'setup_seconds': setup}
+
+
+def report(entry: str, path: str) -> Dict[str, Any]:
+    started = perf_counter()
+    result = HISTORICAL[entry][1](path)
+    json.dumps(result)
+    seconds = perf_counter() - started
+    events = result['meta']['events']
+    return {'seconds': seconds, 'events_per_second': events / seconds, 'p50_us': None, 'p99_us': None, 'alerts': None, 'setup_seconds': 0.0}
+
+
+# One run, in a process of its own
+def measure(entry: str, path: str, events: int, training: Optional[str]) -> Dict[str, Any]:
+    if entry in STREAMING:
+        result = stream(entry, path, events, training)
+    else:
+        result = report(entry, path)
+    result['peak_rss_mb'] = peak_rss()
+    return result
+
+
+# Synthetic input of a kind and size, generated unless already there
+def prepare(directory: str, kind: str, settings: synth.Settings) -> str:
+    digest = blake2b(repr(settings[1:]).encode('utf-8'), digest_size=4).hexdigest()
+    path = os.path.join(directory, '{}-{}-{}.json'.format(kind, settings.events, digest))
+    if not os.path.exists(path):
+        partial = path + '.partial'
+        synth.write(partial, kind, settings)
+        os.replace(partial, path)
+    return path
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(), 'numpy': np.__version__, 'pandas': pd.__version__, 'commit': commit}
+
+
+def run(entries: List[str], sizes: List[int], settings: synth.Settings, directory: str) -> List[Dict[str, Any]]:
+    results = []
+    for events in sizes:
+        generated = settings._replace(events=events)
+        training = None
+        if 'rare_process_pairs' in entries:
+            training = prepare(directory, '4688', settings._replace(events=min(events, TRAINING), seed=settings.seed + 1, rare=0.0))
+        for entry in entries:
+            kind = (STREAMING.get(entry) or HISTORICAL[entry])[0]
+            path = prepare(directory, kind, generated)
+            with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                result = pool.submit(measure, entry, path, events, training).result()
+            results.append({'entry': entry, 'events': events, **result})
+            print(json.dumps(results[-1]), flush=True)
+    return results
+
+
+# Throughput against an earlier result file
+def compare(results: List[Dict[str, Any]], baseline: str) -> pd.DataFrame:
+    with open(baseline) as input:
+        before = pd.DataFrame(json.load(input)['results'])
+    after = pd.DataFrame(results)
+    merged = after.merge(before, on=['entry', 'events'], suffixes=('', '_baseline'))
+    merged['ratio'] = merged['events_per_second'] / merged['events_per_second_baseline']
+    return merged[['entry', 'events', 'events_per_second_baseline', 'events_per_second', 'ratio']]
+
+
+def main(args: argparse.Namespace) -> None:
+    settings = synth.settings(args, 0)
+    entries = list(dict.fromkeys(args.entry or ENTRIES))
+    sizes = args.events or SIZES
+    if args.data is not None:
+        os.makedirs(args.data, exist_ok=True)
+        results = run(entries, sizes, settings, args.data)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run(entries, sizes, settings, directory)
+
+    generated = {name: value for name, value in settings._asdict().items() if name != 'events'}
+    output = {'settings': generated, 'environment': environment(), 'results': results}
+    with open(args.output, 'w') as file:
+        json.dump(output, file, indent=1)
+
+    table = pd.DataFrame(results)[['entry', 'events', 'events_per_second', 'p50_us', 'p99_us', 'peak_rss_mb']]
+    print(table.to_string(index=False))
+    if args.baseline is not None:
+        print(compare(results, args.baseline).to_string(index=False))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the detectors over synthetic events')
+    parser.add_argument('--entry', action='append', choices=ENTRIES, help='Entry point to benchmark, may be repeated (default all)')
+    parser.add_argument('--events', type=int, action='append', metavar='N', help='Number of events to benchmark with, may be repeated (default 10k, 1M and 10M)')
+    parser.add_argument('--output', required=True, help='File to write the results to, as JSON')
+    parser.add_argument('--baseline', metavar='PATH', help='Compare throughput with the results in PATH')
+    parser.add_argument('--data', metavar='DIR', help='Keep the synthetic inputs in DIR and reuse them across runs')
+    synth.add_arguments(parser)
+    args = parser.parse_args()
+
+    main(args)
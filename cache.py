@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+from io import TextIOWrapper
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import fields
+import timestamps
+
+
+'''
+Columnar cache of an NDJSON event export for the historical reports.
+
+Ingesting an export parses every line once and stores the fields the
+reports use as columns of a NumPy .npz archive: timestamps as int64 epoch
+nanoseconds and strings dictionary-encoded, as an int32 code per row and
+the distinct values in first seen order. Each line of the export is a row,
+missing (or non-string) fields are stored as code -1 and timestamp NAT, so
+the reports count events and skipped lines exactly as they would from the
+export itself. Columns are loaded lazily, only when a report asks for them.
+
+The archive records the size and modification time of the export it was
+built from, `load` rebuilds it when the export has changed.
+'''
+
+
+COLUMNS = {
+    'timestamp': fields.TIMESTAMP,
+    'user': fields.USER,
+    'computer': fields.COMPUTER,
+    'tenant': fields.TENANT,
+    'process': fields.PROCESS,
+    'parent': fields.PARENT,
+}
+
+# Codes and timestamps of missing fields, NAT is the int64 value of pd.NaT
+MISSING = -1
+NAT = np.iinfo(np.int64).min
+
+
+decoder = fields.Decoder(*COLUMNS.values())
+
+
+# Dictionary encoding of one string column
+class Dictionary:
+
+    def __init__(self) -> None:
+        self.index: Dict[str, int] = {}
+        self.codes: List[int] = []
+
+    def add(self, value: Any) -> None:
+        if not isinstance(value, str):
+            self.codes.append(MISSING)
+            return
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.index)
+            self.index[value] = code
+        self.codes.append(code)
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return (np.array(self.codes, dtype=np.int32), np.array(list(self.index), dtype=str))
+
+
+# Parse an export into the arrays of its columns
+def ingest(input: Iterable[Union[str, bytes]]) -> Dict[str, np.ndarray]:
+    times: List[int] = []
+    strings = {column: Dictionary() for column in COLUMNS if column != 'timestamp'}
+    for line in input:
+        try:
+            decoded = decoder.project(line)
+        except ValueError:
+            decoded = {}
+        try:
+            times.append(timestamps.parse(decoded[fields.TIMESTAMP]))
+        except (KeyError, TypeError, ValueError):
+            times.append(NAT)
+        for column, dictionary in strings.items():
+            dictionary.add(decoded.get(COLUMNS[column]))
+
+    arrays = {'timestamp': np.array(times, dtype=np.int64), 'lines': np.array(len(times))}
+    for column, dictionary in strings.items():
+        arrays[column + '.codes'], arrays[column + '.values'] = dictionary.arrays()
+    return arrays
+
+
+# Size and modification time of an export, to tell when a cache is stale
+def stamp(source: Union[str, Path]) -> np.ndarray:
+    stat = os.stat(source)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+# Write a cache, replacing any previous one at path only once complete
+def save(path: Union[str, Path], arrays: Dict[str, np.ndarray]) -> None:
+    path = Path(path)
+    partial = path.with_name(path.name + '.partial')
+    with partial.open('wb') as output:
+        np.savez(output, **arrays)
+    os.replace(partial, path)
+
+
+def write(input: TextIOWrapper, path: Union[str, Path]) -> None:
+    arrays = ingest(input)
+    name = getattr(input, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        arrays['source'] = stamp(name)
+    save(path, arrays)
+
+
+class Cache:
+
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path: Path = Path(path)
+        self.archive = np.load(self.path)
+        self.lines: int = int(self.archive['lines'])
+
+    # Whether the cache was built from the export at source as it is now
+    def fresh(self, source: Union[str, Path]) -> bool:
+        return 'source' in self.archive.files and bool((self.archive['source'] == stamp(source)).all())
+
+    def timestamps(self) -> np.ndarray:
+        return self.archive['timestamp']
+
+    def codes(self, column: str) -> np.ndarray:
+        return self.archive[column + '.codes']
+
+    def values(self, column: str) -> List[str]:
+        return self.archive[column + '.values'].tolist()
+
+    # Distinct combinations of values of the given string columns, in first
+    # seen order, with the number of rows holding each. Rows missing any of
+    # the columns or the timestamp are left out.
+    def rows(self, columns: Sequence[str]) -> Iterator[Tuple[Tuple[str, ...], int]]:
+        codes = np.stack([self.codes(column) for column in columns], axis=1)
+        present = (codes != MISSING).all(axis=1) & (self.timestamps() != NAT)
+        combinations, first, counts = np.unique(codes[present], axis=0, return_index=True, return_counts=True)
+        values = [self.values(column) for column in columns]
+        for i in np.argsort(first, kind='stable').tolist():
+            yield (tuple(lookup[code] for lookup, code in zip(values, combinations[i].tolist())), int(counts[i]))
+
+    # Load columns into a DataFrame, string columns as categoricals
+    def frame(self, columns: Sequence[str]) -> pd.DataFrame:
+        data = {}
+        for column in columns:
+            if column == 'timestamp':
+                data[column] = pd.to_datetime(self.timestamps(), utc=True)
+            else:
+                data[column] = pd.Categorical.from_codes(self.codes(column), categories=self.archive[column + '.values'])
+        return pd.DataFrame(data)
+
+
+# Open the cache at path, building it first from input when it does not
+# exist yet or input has changed since it was built.
+def load(path: Union[str, Path], input: Optional[TextIOWrapper] = None) -> Cache:
+    if os.path.exists(path):
+        cache = Cache(path)
+        name = getattr(input, 'name', None)
+        if input is None or not isinstance(name, str) or not os.path.isfile(name) or cache.fresh(name):
+            return cache
+    if input is None:
+        raise FileNotFoundError(path)
+    write(input, path)
+    return Cache(path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a columnar cache of an event export for the historical reports')
+    parser.add_argument('--input', type=open, required=True, help='File containing event data')
+    parser.add_argument('--output', required=True, help='Cache file to write, e.g. events.npz')
+    args = parser.parse_args()
+
+    write(args.input, args.output)
@@ -0,0 +1,128 @@
+from typing import Any, Dict, List, Optional, Tuple
+import hashlib
+import os
+import pickle
+import time
+
+
+'''
+Checkpoints of streaming detector state.
+
+A checkpoint is a pickle of an engine's detectors, models and windows and
+all, along with how far into the input they got: the number of lines and,
+for a file input, the file and byte offset past the last line. A restarted
+engine restores its detectors from the checkpoint rather than replaying a
+warm-up period, and resumes a file input where it left off. Other inputs,
+e.g. a live stream on stdin, carry on with whatever comes next.
+
+A checkpoint is only restored into the same detectors, by name, with the
+same settings (each detector's `settings`, e.g. --window, --skip or the
+pair index), so that a restart with other flags doesn't carry on with the
+models of the old ones.
+
+A file input is only resumed if it is still the file the checkpoint was
+taken of: the same device and inode, with the same FINGERPRINT bytes before
+the offset. A file that was rotated, truncated or rewritten in place is
+read from the start.
+
+Checkpoints are written every `interval` seconds and once the detectors
+have finished at the end of the input, next to the checkpoint and then
+moved into place so that a crash mid-write leaves the previous checkpoint
+intact.
+'''
+
+
+VERSION = 4
+
+# Seconds between checkpoints
+INTERVAL = 60.0
+
+# Lines between looking at the clock
+TICK = 1024
+
+# Bytes before the offset hashed to recognise a file input on restore
+FINGERPRINT = 1 << 16
+
+
+# Settings of each of the engine's detectors, None for detectors without
+def settings(engine: Any) -> List[Optional[Dict[str, Any]]]:
+    return [getattr(detector, 'settings', None) for detector in engine.detectors]
+
+
+class Checkpoint:
+
+    def __init__(self, path: str, source: Optional[str] = None, interval: float = INTERVAL) -> None:
+        self.path: str = path
+        self.source: Optional[str] = os.path.abspath(source) if source is not None else None
+        self.interval: float = interval
+        self.due: float = time.monotonic() + interval
+        self.checked: int = 0
+
+    # Restore the engine's detectors and counters from the checkpoint, if
+    # there is one, and return the offset to resume the input at
+    def restore(self, engine: Any) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, 'rb') as input:
+            state = pickle.load(input)
+        if not isinstance(state, dict) or state.get('version') != VERSION:
+            raise ValueError('not a detector checkpoint: ' + self.path)
+        names = [detector.name for detector in engine.detectors]
+        if state['names'] != names:
+            raise ValueError(self.path + ' is a checkpoint of ' + ', '.join(state['names']) + ', not ' + ', '.join(names))
+        for name, saved, current in zip(names, state['settings'], settings(engine)):
+            if saved != current:
+                raise ValueError(self.path + ' is a checkpoint of ' + name + ' with ' + repr(saved) + ', not ' + repr(current))
+
+        engine.detectors = state['detectors']
+        engine.events = state['events']
+        engine.skipped = state['skipped']
+        engine.failed = state['failed']
+
+        # Resume the same file, unless it has been truncated or replaced
+        if self.source is not None and state['source'] == self.source and state['fingerprint'] is not None and self.fingerprint(state['offset']) == state['fingerprint']:
+            return state['offset']
+        return 0
+
+    # Device and inode of the input file, and a hash of the bytes before
+    # offset, or None if they can't be read
+    def fingerprint(self, offset: int) -> Optional[Tuple[int, int, str]]:
+        if self.source is None:
+            return None
+        start = max(0, offset - FINGERPRINT)
+        try:
+            with open(self.source, 'rb') as input:
+                status = os.fstat(input.fileno())
+                input.seek(start)
+                data = input.read(offset - start)
+        except OSError:
+            return None
+        if len(data) != offset - start:
+            return None
+        return (status.st_dev, status.st_ino, hashlib.sha256(data).hexdigest())
+
+    def tick(self, engine: Any, offset: int) -> None:
+        if engine.events - self.checked < TICK:
+            return
+        self.checked = engine.events
+        if time.monotonic() >= self.due:
+            self.save(engine, offset)
+
+    def save(self, engine: Any, offset: int) -> None:
+        state = {
+            'version': VERSION,
+            'names': [detector.name for detector in engine.detectors],
+            'settings': settings(engine),
+            'detectors': engine.detectors,
+            'events': engine.events,
+            'skipped': engine.skipped,
+            'failed': engine.failed,
+            'source': self.source,
+            'offset': offset,
+            'fingerprint': self.fingerprint(offset),
+        }
+        partial = self.path + '.partial'
+        with open(partial, 'wb') as output:
+            pickle.dump(state, output, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial, self.path)
+        self.due = time.monotonic() + self.interval
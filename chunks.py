@@ -0,0 +1,78 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Deque, Iterator, List, Optional, Tuple
+import mmap
+import os
+
+
+'''
+Parallel parsing of large inputs.
+
+An input file is memory-mapped and split into byte ranges that end on a
+newline, and each range is handed to a function in a pool of worker
+processes as an iterable of its lines. Results come back in input order,
+so partial aggregates can be merged in order (keeping first seen order
+intact) and parsed events can be fed to streaming detectors in order.
+'''
+
+
+# Ranges are at most this many bytes, so workers are kept busy and results
+# held in memory stay small however large the input.
+CHUNK = 64 * 1024 * 1024
+
+
+Range = Tuple[int, int]
+
+
+# Path of the regular file behind an opened input, None for pipes and the like
+def path_of(input: Any) -> Optional[str]:
+    name = getattr(input, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return name
+    return None
+
+
+# Split a file from a byte offset into about `parts` byte ranges, each
+# ending after a newline (or at the end of the file)
+def ranges(path: str, parts: int, start: int = 0) -> List[Range]:
+    size = os.path.getsize(path)
+    if size <= start:
+        return []
+    step = -(-(size - start) // max(parts, 1))
+    result = []
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        while start < size:
+            newline = data.find(b'\n', max(start + step - 1, start))
+            end = size if newline < 0 else newline + 1
+            result.append((start, end))
+            start = end
+    return result
+
+
+# Lines of a byte range of a file, newlines included as when iterating a file
+def lines(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        while start < end:
+            newline = data.find(b'\n', start, end)
+            stop = end if newline < 0 else newline + 1
+            yield data[start:stop]
+            start = stop
+
+
+def apply(function: Callable[..., Any], path: str, start: int, end: int, args: Tuple[Any, ...]) -> Any:
+    return function(lines(path, start, end), *args)
+
+
+# Call function(lines, *args) on every range of a file (from a byte offset)
+# in a pool of worker processes, yielding the results in input order. Only a
+# couple of ranges per worker are in flight at any time.
+def imap(function: Callable[..., Any], path: str, workers: int, *args: Any, start: int = 0) -> Iterator[Any]:
+    parts = max(workers, -(-(os.path.getsize(path) - start) // CHUNK))
+    with ProcessPoolExecutor(workers) as pool:
+        pending: Deque[Any] = deque()
+        for start, end in ranges(path, parts, start):
+            pending.append(pool.submit(apply, function, path, start, end, args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+from collections import Counter
+from functools import partial
+from importlib import import_module
+from io import TextIOWrapper
+from itertools import islice
+from time import perf_counter_ns
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import argparse
+import pandas as pd
+import structlog
+import checkpoint
+import chunks
+import fields
+import sink
+import sketch
+import stats
+
+
+# Record is a log message along with its fields, as emitted by a detector.
+Record = Tuple[str, Dict[str, Any]]
+
+
+# Streaming detectors by module. Each module provides a Detector class with
+# the field `paths` it needs, `observe(values, line)` and `finish()` both
+# returning Records, and a `detector(args)` factory. Detectors may also
+# provide `observe_batch(values, lines)` to check a batch of events at once,
+# with the same Records as observing them one by one.
+DETECTORS = ['logon_times', 'rare_parents', 'rare_process_dir', 'rare_process_name', 'rare_process_pairs', 'rare_users']
+
+
+class Engine:
+
+    def __init__(self, detectors: List[Any], alerts: Optional[sink.Alerts] = None, stats: Optional[stats.Stats] = None) -> None:
+        self.detectors: List[Any] = detectors
+        self.logs = [structlog.get_logger(detector=detector.name) for detector in detectors]
+        self.alerts: Optional[sink.Alerts] = alerts
+        self.stats: Optional[stats.Stats] = stats
+
+        # Decode the union of the fields every detector needs, once per line
+        paths = [path for detector in detectors for path in detector.paths]
+        self.decoder = fields.Decoder(*dict.fromkeys(paths))
+
+        # Lines read, lines that could not be decoded, and events each
+        # detector failed on
+        self.events: int = 0
+        self.skipped: int = 0
+        self.failed: Counter = Counter()
+
+    def decode(self, line: Union[str, bytes]) -> Optional[Dict[str, Any]]:
+        start = perf_counter_ns() if self.stats is not None else 0
+        try:
+            decoded: Optional[Dict[str, Any]] = self.decoder.project(line)
+        except ValueError:
+            decoded = None
+        if self.stats is not None:
+            self.stats.time('parse', start)
+        return decoded
+
+    def feed(self, line: Union[str, bytes]) -> None:
+        self.dispatch(self.decode(line), line)
+
+    # Hand a line decoded by the engine's decoder (None if it could not be)
+    # to the detectors
+    def dispatch(self, decoded: Optional[Dict[str, Any]], line: Union[str, bytes]) -> None:
+        self.events = self.events + 1
+        if decoded is None:
+            self.skipped = self.skipped + 1
+            return
+
+        # Fan the event out to each detector that has all of its fields
+        for detector, log in zip(self.detectors, self.logs):
+            try:
+                values = tuple(decoded[path] for path in detector.paths)
+            except KeyError:
+                continue
+            self.check(detector, log, values, line)
+
+    # Hand a batch of decoded lines to the detectors, each detector gets the
+    # events it has all the fields of in one call
+    def dispatch_batch(self, decoded: List[Optional[Dict[str, Any]]], lines: List[Union[str, bytes]]) -> None:
+        self.events = self.events + len(lines)
+        self.skipped = self.skipped + decoded.count(None)
+
+        for detector, log in zip(self.detectors, self.logs):
+            values = []
+            inputs = []
+            for document, line in zip(decoded, lines):
+                if document is None:
+                    continue
+                try:
+                    values.append(tuple(document[path] for path in detector.paths))
+                except KeyError:
+                    continue
+                inputs.append(line)
+            if values:
+                self.check_batch(detector, log, values, inputs)
+
+    def finish(self) -> None:
+        for detector, log in zip(self.detectors, self.logs):
+            self.report(detector, log, self.call(detector, detector.finish))
+
+    # Call a detector, timing it with stats
+    def call(self, detector: Any, observe: Any, *args: Any) -> List[Record]:
+        if self.stats is None:
+            return observe(*args)
+        start = perf_counter_ns()
+        try:
+            return observe(*args)
+        finally:
+            self.stats.time_detector(detector.name, start)
+
+    # Check an event with a detector and report its Records. An event the
+    # detector fails on, e.g. one with a malformed timestamp, is logged and
+    # skipped rather than ending the run.
+    def check(self, detector: Any, log: Any, values: Tuple[Any, ...], line: Union[str, bytes]) -> None:
+        try:
+            records = self.call(detector, detector.observe, values, line)
+        except Exception as e:
+            self.fail(detector, log, e)
+            return
+        self.report(detector, log, records)
+
+    # Check a batch of events with a detector and report its Records. Batch
+    # checks parse every event before updating the model, so a batch the
+    # detector fails on is checked again event by event to skip just the
+    # events it fails on. When observe_each fails part way the events before
+    # the failing one have been observed and are not checked again.
+    def check_batch(self, detector: Any, log: Any, values: List[Tuple[Any, ...]], inputs: List[Union[str, bytes]]) -> None:
+        observe_batch = getattr(detector, 'observe_batch', None)
+        if observe_batch is None:
+            observe_batch = partial(observe_each, detector)
+        try:
+            records = self.call(detector, observe_batch, values, inputs)
+        except BatchError as e:
+            self.report(detector, log, e.records)
+            self.fail(detector, log, e.error)
+            for v, input in zip(values[e.index + 1:], inputs[e.index + 1:]):
+                self.check(detector, log, v, input)
+            return
+        except Exception:
+            for v, input in zip(values, inputs):
+                self.check(detector, log, v, input)
+            return
+        self.report(detector, log, records)
+
+    # Count an event a detector failed on
+    def fail(self, detector: Any, log: Any, error: Exception) -> None:
+        self.failed[detector.name] += 1
+        log.warning('checking event failed, skipping it', error=repr(error))
+
+    # Hand a detector's Records to the alert sink, or log them
+    def report(self, detector: Any, log: Any, records: List[Record]) -> None:
+        start = perf_counter_ns() if self.stats is not None else 0
+        for message, kv in records:
+            if self.alerts is not None:
+                self.alerts.emit(detector.name, message, kv)
+            else:
+                log.info(message, **sink.expand(kv))
+        if self.stats is not None:
+            self.stats.time('emit', start)
+            self.stats.alerts[detector.name] += len(records)
+
+
+# Raised by observe_each when a detector fails on an event of a batch, with
+# the Records of the events before it
+class BatchError(Exception):
+
+    def __init__(self, records: List[Record], index: int, error: Exception) -> None:
+        super().__init__(error)
+        self.records: List[Record] = records
+        self.index: int = index
+        self.error: Exception = error
+
+
+# Observe a batch of events one by one
+def observe_each(detector: Any, values: List[Tuple[Any, ...]], inputs: List[Union[str, bytes]]) -> List[Record]:
+    records: List[Record] = []
+    for i, (v, input) in enumerate(zip(values, inputs)):
+        try:
+            records.extend(detector.observe(v, input))
+        except Exception as e:
+            raise BatchError(records, i, e)
+    return records
+
+
+# Decode lines in a worker process, for Engine.dispatch
+def parse(lines: Iterable[bytes], paths: Tuple[str, ...]) -> List[Tuple[Optional[Dict[str, Any]], bytes]]:
+    decoder = fields.Decoder(*paths)
+    result = []
+    for line in lines:
+        try:
+            result.append((decoder.project(line), line))
+        except ValueError:
+            result.append((None, line))
+    return result
+
+
+# Decoded lines of an input from a byte offset when the input is a file,
+# along with the offset past each line (0 for other inputs). With several
+# workers and a file as input, lines are decoded in worker processes and
+# come back in input order.
+def stream(engine: Engine, input: Iterable[Union[str, bytes]], workers: int = 1, offset: int = 0) -> Iterator[Tuple[Optional[Dict[str, Any]], Union[str, bytes], int]]:
+    path = chunks.path_of(input)
+    if path is None:
+        for line in input:
+            yield (engine.decode(line), line, 0)
+    elif workers > 1:
+        for lines in chunks.imap(parse, path, workers, engine.decoder.paths, start=offset):
+            for values, line in lines:
+                offset = offset + len(line)
+                yield (values, line, offset)
+    else:
+        with open(path, 'rb') as file:
+            file.seek(offset)
+            for line in file:
+                offset = offset + len(line)
+                yield (engine.decode(line), line, offset)
+
+
+# Feed an input to the engine, yielding the input offset after each line,
+# or after each batch of `batch_size` lines.
+def read(engine: Engine, input: Iterable[Union[str, bytes]], workers: int = 1, offset: int = 0, batch_size: int = 1) -> Iterator[int]:
+    lines = stream(engine, input, workers, offset)
+    if engine.stats is not None:
+        lines = engine.stats.timed('input', lines)
+    if batch_size <= 1:
+        for values, line, offset in lines:
+            engine.dispatch(values, line)
+            yield offset
+        return
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not batch:
+            return
+        engine.dispatch_batch([values for values, _, _ in batch], [line for _, line, _ in batch])
+        yield batch[-1][2]
+
+
+# Run detectors over an input. With a state file the detectors and input
+# position are restored from it first, and checkpointed to it every
+# `interval` seconds and once the detectors have finished. With a batch
+# size events are handed to the detectors in batches. Alerts go to the sink
+# if given, which is closed at the end, and are logged otherwise. With
+# stats the run is timed and reported on as it goes and at the end.
+def run(input: Iterable[Union[str, bytes]], detectors: List[Any], workers: int = 1, state: Optional[str] = None, interval: float = checkpoint.INTERVAL, batch_size: int = 1, alerts: Optional[sink.Alerts] = None, stats: Optional[stats.Stats] = None) -> Engine:
+    engine = Engine(detectors, alerts, stats)
+    saved = None
+    offset = 0
+    if state is not None:
+        saved = checkpoint.Checkpoint(state, chunks.path_of(input), interval)
+        offset = saved.restore(engine)
+    for offset in read(engine, input, workers, offset, batch_size):
+        if saved is not None:
+            start = perf_counter_ns()
+            saved.tick(engine, offset)
+            if stats is not None:
+                stats.time('checkpoint', start)
+        if stats is not None:
+            stats.tick(engine)
+    engine.finish()
+    if saved is not None:
+        saved.save(engine, offset)
+    if alerts is not None:
+        alerts.close()
+    if stats is not None:
+        stats.report(engine)
+    return engine
+
+
+def create(names: List[str], args: argparse.Namespace) -> List[Any]:
+    return [import_module(name).detector(args) for name in names]
+
+
+def duration(value: str) -> pd.Timedelta:
+    return pd.to_timedelta(value)
+
+
+def main(input: TextIOWrapper, names: List[str], args: argparse.Namespace) -> None:
+    run(input, create(list(dict.fromkeys(names)), args), args.workers, args.state, args.checkpoint_interval, args.batch_size, sink.create(args), stats.create(args))
+
+
+# Flags choosing and configuring the detectors, shared with server.py
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--detector', action='append', choices=DETECTORS, required=True, help='Detector to run, may be repeated')
+    parser.add_argument('--skip', type=duration, metavar='WINDOW', default='30 days', help='Skip detection for events in initial WINDOW')
+    parser.add_argument('--window', type=duration, default='30 days', help='Model window for every detector')
+    parser.add_argument('--max-keys', type=int, metavar='N', help='Remember at most N keys per rare_* detector, evicting the least recently seen')
+    parser.add_argument('--approx', action='store_true', help='Remember keys of rare_process_name, rare_process_dir and rare_process_pairs in Bloom filters (Count-Min sketches with --min-count), see sketch.py')
+    parser.add_argument('--error', type=float, default=sketch.ERROR, help='False positive rate of --approx')
+    parser.add_argument('--capacity', type=int, default=sketch.CAPACITY, metavar='N', help='Distinct keys per --approx partition, an eighth of the window')
+    parser.add_argument('--min-count', type=int, default=1, metavar='N', help='With --approx, flag names and dirs seen fewer than N times within the window')
+    parser.add_argument('--training', type=open, help='File containing training data for rare_process_pairs')
+    parser.add_argument('--index', metavar='PATH', help='Pair index for rare_process_pairs, instead of --training')
+    parser.add_argument('--tolerance', type=float, default=1.0, metavar='PERCENT', help='Flag rare_parents parents launching less than PERCENT of a process\'s launches')
+    parser.add_argument('--half-life', type=duration, metavar='DURATION', help='Decay rare_parents launch counts by half every DURATION')
+    parser.add_argument('--refit-events', type=int, default=100, metavar='N', help='Refit a logon_times user model after N events in the same hour')
+    parser.add_argument('--hourly', action='store_true', help='Score logon_times once per closed hour')
+    parser.add_argument('--max-outliers', type=int, metavar='N', help='Limit the logon_times ESD test to N outliers per user in hourly mode')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N', help='Check events in batches of N, for throughput over latency')
+    parser.add_argument('--state', metavar='PATH', help='Restore detector state from PATH at startup and checkpoint it there')
+    parser.add_argument('--checkpoint-interval', type=float, default=checkpoint.INTERVAL, metavar='SECONDS', help='Seconds between checkpoints of detector state')
+    sink.add_arguments(parser)
+    stats.add_arguments(parser)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run several detectors over one event stream, parsing each event once')
+    add_arguments(parser)
+    parser.add_argument('--input', type=open, help='File containing event stream')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Decode the input in N worker processes')
+    args = parser.parse_args()
+
+    with stats.profile(args.profile):
+        main(args.input, args.detector, args)
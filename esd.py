@@ -0,0 +1,99 @@
+from typing import Optional, Tuple
+import numpy as np
+from scipy.stats import t
+
+
+'''
+Generalized ESD test over a matrix of series, one series per row.
+
+Mirrors adtk's GeneralizedESDTestAD: training runs the generalized ESD test
+over the valid (non NaN) values of each row and keeps the sum, squared sum
+and count of the values that were not found anomalous. A value is then
+checked with a single Grubbs test against those normal values plus itself.
+
+Rows are processed together, so scoring thousands of series costs a handful
+of array operations per ESD iteration instead of a pandas fit per series.
+'''
+
+
+# Normal holds the sum, squared sum and count of the non anomalous training
+# values of each row.
+Normal = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def fit(values: np.ndarray, alpha: float = 0.05, max_outliers: Optional[int] = None) -> Normal:
+    values = np.asarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    x = np.where(valid, values, 0.0)
+
+    total = x.sum(axis=1)
+    squares = (x ** 2).sum(axis=1)
+    n = valid.sum(axis=1)
+
+    # Upper bound on outliers, adtk tests every value
+    r = int(n.max()) if len(n) else 0
+    if max_outliers is not None:
+        r = min(r, max_outliers)
+
+    # Iteratively remove the value furthest from the mean while its test
+    # statistic exceeds the critical value. As in adtk a row stops at the
+    # first value that does not (rather than testing every value and taking
+    # the last one that does, as Rosner's test would), the values removed
+    # before it are the anomalies. A critical value that can't be computed,
+    # for the last value or two of a row, is exceeded.
+    s, ss, c = total.copy(), squares.copy(), n.copy()
+    active = np.flatnonzero(n > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(1, r + 1):
+            if len(active) == 0:
+                break
+            mean = s[active] / c[active]
+            std = np.sqrt((ss[active] - s[active] * mean) / (c[active] - 1))
+            deviation = np.where(valid[active], np.abs(x[active] - mean[:, None]), -np.inf)
+            j = deviation.argmax(axis=1)
+            statistic = np.where(std > 0, deviation[np.arange(len(active)), j] / std, 0.0)
+
+            m = n[active]
+            df = m - i - 1
+            tv = t.ppf(1 - alpha / (2 * (m - i + 1)), np.where(df > 0, df, np.nan))
+            lambdas = (m - i) * tv / np.sqrt((df + tv ** 2) * (m - i + 1))
+            exceeds = ~(statistic <= lambdas)
+
+            active, j = active[exceeds], j[exceeds]
+            value = x[active, j]
+            valid[active, j] = False
+            s[active] -= value
+            ss[active] -= value ** 2
+            c[active] -= 1
+            active = active[c[active] > 0]
+
+    return (s, ss, c)
+
+
+# Critical value of the Grubbs test checking a value against normal_count
+# normal values
+def critical(normal_count: np.ndarray, alpha: float = 0.05) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        new_count = normal_count + 1
+        df = new_count - 2
+        tv = t.ppf(1 - alpha / (2 * new_count), np.where(df > 0, df, np.nan))
+        return (new_count - 1) / np.sqrt(new_count) * np.sqrt(tv ** 2 / (new_count - 2 + tv ** 2))
+
+
+# Check values against the normal values, with the critical values of the
+# normal counts if already computed
+def detect(normal: Normal, values: np.ndarray, alpha: float = 0.05, critical_values: Optional[np.ndarray] = None) -> np.ndarray:
+    normal_sum, normal_squares, normal_count = normal
+    values = np.asarray(values, dtype=np.float64)
+    if critical_values is None:
+        critical_values = critical(normal_count, alpha)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        new_sum = values + normal_sum
+        new_count = normal_count + 1
+        new_mean = new_sum / new_count
+        new_squares = values ** 2 + normal_squares
+        new_std = np.sqrt((new_squares - 2 * new_mean * new_sum + new_count * new_mean ** 2) / (new_count - 1))
+        anomalous = np.abs(values - new_mean) / new_std > critical_values
+
+    return anomalous & ~np.isnan(values)
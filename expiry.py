@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from typing import Hashable, Iterator, Optional
+
+
+'''
+Bounded memory for the rare_* models.
+
+ExpiringDict maps keys to the time (epoch nanoseconds) they were last seen,
+kept in the order they were last seen. Whenever the latest time seen (the
+watermark) moves forward, keys from the front that fell out of the window
+are evicted, so the dict only holds the keys seen within the window. Keys
+are kept for an extra `lateness` past the window so that events arriving up
+to that late still find them. An optional cap on the number of keys evicts
+the least recently seen key.
+'''
+
+
+# Keys are kept an hour past the window, events in the exports arrive out of
+# order by up to a minute or so.
+LATENESS = 3600 * 10 ** 9
+
+
+class ExpiringDict:
+
+    def __init__(self, size: int, max_keys: Optional[int] = None, lateness: int = LATENESS) -> None:
+        self.size: int = size
+        self.lateness: int = lateness
+        self.max_keys: Optional[int] = max_keys
+        self.times: 'OrderedDict[Hashable, int]' = OrderedDict()
+        self.watermark: Optional[int] = None
+        self.evicted: int = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.times
+
+    def __getitem__(self, key: Hashable) -> int:
+        return self.times[key]
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def __iter__(self) -> Iterator[Hashable]:
+        return iter(self.times)
+
+    def get(self, key: Hashable, default: Optional[int] = None) -> Optional[int]:
+        return self.times.get(key, default)
+
+    def __setitem__(self, key: Hashable, timestamp: int) -> None:
+        times = self.times
+        times[key] = timestamp
+        times.move_to_end(key)
+
+        if self.watermark is None or timestamp > self.watermark:
+            self.watermark = timestamp
+            self.expire()
+
+        if self.max_keys is not None and len(times) > self.max_keys:
+            times.popitem(last=False)
+            self.evicted = self.evicted + 1
+
+    # Evict keys last seen before the window ending at the watermark
+    def expire(self) -> int:
+        if self.watermark is None:
+            return 0
+        cutoff = self.watermark - self.size - self.lateness
+        times = self.times
+        evicted = 0
+        while times:
+            key = next(iter(times))
+            if times[key] >= cutoff:
+                break
+            del times[key]
+            evicted = evicted + 1
+        self.evicted = self.evicted + evicted
+        return evicted
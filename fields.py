@@ -0,0 +1,56 @@
+import json
+from typing import Any, Dict, List, Tuple, Union
+
+
+'''
+Declared fields of Elasticsearch hits.
+
+Each detector declares the field paths it reads, e.g. `_source.@timestamp`
+or `_source.data.win.eventdata.newProcessName`, and a Decoder pulls them
+out of a line in declaration order. The line is decoded with a single
+json.loads: its C scanner decodes a whole hit in less time than locating
+even one field in the line from Python, so the fields are read from the
+decoded document rather than decoded one by one.
+
+Missing fields raise KeyError, as indexing the decoded document would.
+'''
+
+
+TIMESTAMP = '_source.@timestamp'
+USER = '_source.user.target.name'
+PROCESS = '_source.data.win.eventdata.newProcessName'
+PARENT = '_source.data.win.eventdata.parentProcessName'
+COMPUTER = '_source.data.win.system.computer'
+TENANT = '_source.tenant'
+
+
+Line = Union[str, bytes]
+
+
+def walk(value: Any, segments: Tuple[str, ...]) -> Any:
+    for segment in segments:
+        value = value[segment]
+    return value
+
+
+class Decoder:
+
+    def __init__(self, *paths: str) -> None:
+        self.paths: Tuple[str, ...] = paths
+        self.segments: List[Tuple[str, ...]] = [tuple(path.split('.')) for path in paths]
+
+    # Decode the declared fields of a line, in declaration order
+    def decode(self, line: Line) -> Tuple[Any, ...]:
+        document = json.loads(line)
+        return tuple(walk(document, segments) for segments in self.segments)
+
+    # Decode the declared fields of a line that are present, by path
+    def project(self, line: Line) -> Dict[str, Any]:
+        document = json.loads(line)
+        result = {}
+        for path, segments in zip(self.paths, self.segments):
+            try:
+                result[path] = walk(document, segments)
+            except (KeyError, TypeError):
+                pass
+        return result
@@ -1,130 +1,377 @@
 #!/usr/bin/env python3
 
-import json
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import numpy as np
 import pandas as pd
-from adtk.data import validate_series
-from adtk.detector import GeneralizedESDTestAD
 from io import TextIOWrapper
-import structlog
 import argparse
+import checkpoint
+import engine
+import esd
+import fields
+import sink
+import stats
+import timestamps
 
 
 # Event represents an logon event for a user at a
-# particular timestamp.
-Event = Tuple[pd.Timestamp, str]
+# particular timestamp (epoch nanoseconds).
+Event = Tuple[int, str]
 
 
 # Anomaly represents an hour, user pair for which a
-# anomalous number of login events occurred.
-Anomaly = Tuple[pd.Timestamp, str, int]
+# anomalous number of login events occurred. The hour is
+# given by its start in epoch nanoseconds.
+Anomaly = Tuple[int, str, int]
 
 
-# Parse a JSON encoded line into an Event
+decoder = fields.Decoder(fields.TIMESTAMP, fields.USER)
+
+
+# Parse a JSON encoded line into an Event, along with the raw line which is
+# only decoded in full for alerts.
 def event(input: Union[str, bytes]) -> Tuple[Event, Any]:
-    e = json.loads(input)
-    timestamp = pd.to_datetime(e['_source']['@timestamp'])
-    user = e['_source']['user']['target']['name']
-    return ((timestamp, user), e)
+    return make_event(decoder.decode(input), input)
+
+
+# Build an Event from the decoded fields of a line
+def make_event(values: Tuple[Any, ...], input: Union[str, bytes]) -> Tuple[Event, Any]:
+    timestamp, user = values
+    return ((timestamps.parse(timestamp), user), input)
+
+
+# Ring holds the hourly logon counts for a single user in a fixed size
+# circular array. Slot `hour % len(counts)` holds the count for `hour`, for
+# the hours in (head - len(counts), head]. Hours are whole hours since the
+# epoch.
+class Ring:
+
+    def __init__(self, buckets: int, head: int) -> None:
+        self.counts: np.ndarray = np.zeros(buckets, dtype=np.int64)
+        self.head: int = head
+
+    def advance(self, hour: int) -> int:
+        gap = hour - self.head
+        if gap <= 0:
+            return 0
+        self.head = hour
+
+        # Clear the slots of the hours that fell out of the ring
+        n = len(self.counts)
+        if gap >= n:
+            dropped = int(np.count_nonzero(self.counts))
+            self.counts[:] = 0
+            return dropped
+        start = (hour - gap + 1) % n
+        end = start + gap
+        if end <= n:
+            expired = self.counts[start:end]
+        else:
+            expired = np.concatenate((self.counts[start:], self.counts[:end - n]))
+            self.counts[:end - n] = 0
+        dropped = int(np.count_nonzero(expired))
+        self.counts[start:min(end, n)] = 0
+        return dropped
+
+    def increment(self, hour: int) -> None:
+        if self.head - len(self.counts) < hour <= self.head:
+            self.counts[hour % len(self.counts)] += 1
+
+    def count(self, hour: int) -> int:
+        if self.head - len(self.counts) < hour <= self.head:
+            return int(self.counts[hour % len(self.counts)])
+        return 0
+
+    def hours(self) -> np.ndarray:
+        n = len(self.counts)
+        return self.head - (self.head - np.arange(n)) % n
+
+    def empty(self) -> bool:
+        return not self.counts.any()
+
+    # Checkpoints keep only the nonzero buckets, most hours of most users
+    # are empty
+    def __getstate__(self) -> Tuple[int, int, np.ndarray, np.ndarray]:
+        slots = np.flatnonzero(self.counts)
+        return (len(self.counts), self.head, slots.astype(np.int32), self.counts[slots])
+
+    def __setstate__(self, state: Tuple[int, int, np.ndarray, np.ndarray]) -> None:
+        buckets, self.head, slots, counts = state
+        self.counts = np.zeros(buckets, dtype=np.int64)
+        self.counts[slots] = counts
+
+
+HOUR = timestamps.HOUR
+
+
+def hour_of(timestamp: int) -> int:
+    return timestamp // HOUR
+
+
+# Fit caches the ESD model fitted for a user in an hour: the sum, squared
+# sum and count of the user's normal hourly counts and the critical value
+# of a count checked against them. Every event of the hour checks the
+# hour's count so far against the cached model, so a burst building up
+# within the hour is caught as it crosses the bound.
+class Fit:
+
+    def __init__(self, hour: int, normal: esd.Normal) -> None:
+        self.hour: int = hour
+        self.normal: esd.Normal = normal
+        self.critical: np.ndarray = esd.critical(normal[2])
+        self.events: int = 0
+
+    def stale(self, hour: int, refit_events: int) -> bool:
+        return hour != self.hour or self.events >= refit_events
+
+    def anomalous(self, count: int) -> bool:
+        return bool(esd.detect(self.normal, np.array([count]), critical_values=self.critical)[0])
+
+
+# Refit a user's model after this many events within the same hour.
+REFIT_EVENTS = 100
 
 
 class Window:
 
-    def __init__(self, size: pd.Timedelta) -> None:
-        self.size: pd.Timedelta = size
-        self.latest: Optional[pd.Timestamp] = None
-        self.earliest: Optional[pd.Timestamp] = None
-        self.data: Dict[str, pd.Series] = dict()
+    def __init__(self, size: pd.Timedelta, refit_events: int = REFIT_EVENTS) -> None:
+        self.size: int = size.value
+        self.latest: Optional[int] = None
+        self.earliest: Optional[int] = None
+        self.data: Dict[str, Ring] = dict()
+
+        # Buckets kept per user: the hours in (floor(latest - size), latest]
+        self.buckets: int = -(-self.size // HOUR)
+        self.pruned: Optional[int] = None
+
+        # Fitted models by user
+        self.refit_events: int = refit_events
+        self.fits: Dict[str, Fit] = dict()
 
     def add(self, event: Event) -> None:
         timestamp, user = event
         if self.earliest == None or timestamp < self.earliest:
-            self.earliest = timestamp.floor('H')
+            self.earliest = timestamps.floor(timestamp, HOUR)
         if self.latest == None or timestamp > self.latest:
-            self.latest = timestamp.floor('H')
-        
-        # Increment the count for the current user for the current hour
-        hour = timestamp.floor('H')
-        new_series = pd.Series(data={hour: 1})
-        if user not in self.data:
-            self.data[user] = new_series
+            self.latest = timestamps.floor(timestamp, HOUR)
+
+        # Advance the user's ring to the latest hour, which drops the buckets
+        # that fell out of the window, then increment the current hour
+        latest = hour_of(self.latest)
+        ring = self.data.get(user)
+        if ring is None:
+            ring = Ring(self.buckets, latest)
+            self.data[user] = ring
         else:
-            self.data[user] = self.data[user].add(new_series, fill_value=0)
-        
-        # Prune old buckets
-        cutoff: pd.Timestamp = self.latest - self.size
-        cutoff = cutoff.floor('H')
-        self.data[user] = self.data[user][cutoff < self.data[user].index]
+            ring.advance(latest)
+        ring.increment(hour_of(timestamp))
 
     def prune(self) -> int:
-        return 0
+        if self.latest is None:
+            return 0
+
+        # Only sweep the idle users once per hour
+        latest = hour_of(self.latest)
+        if self.pruned == latest:
+            return 0
+        self.pruned = latest
+
+        pruned = 0
+        for user in list(self.data):
+            ring = self.data[user]
+            pruned += ring.advance(latest)
+            if ring.empty():
+                del self.data[user]
+
+        # Cached models are only reused within the hour they were fitted in
+        for user in list(self.fits):
+            if self.fits[user].hour != latest or user not in self.data:
+                del self.fits[user]
+        return pruned
 
     def saturated(self) -> bool:
         if self.earliest is None or self.latest is None:
             return False
         return self.latest - self.earliest > self.size
-    
+
+    def view(self, user: str) -> Optional[np.ndarray]:
+        ring = self.data.get(user)
+        if ring is None:
+            return None
+        view = ring.counts.view()
+        view.flags.writeable = False
+        return view
+
+    def series(self, user: str) -> Optional[pd.Series]:
+        ring = self.data.get(user)
+        if ring is None:
+            return None
+
+        # Only hours with logons make up the series, oldest first
+        hours = ring.hours()
+        order = np.argsort(hours)
+        counts = ring.counts[order]
+        present = counts > 0
+        index = pd.to_datetime(hours[order][present] * HOUR, utc=True)
+        return pd.Series(counts[present], index=index)
+
+    def fit(self, user: str, hour: int) -> Optional[Fit]:
+        ring = self.data.get(user)
+        if ring is None:
+            return None
+
+        # The counts of the user's series, without building it
+        counts = ring.counts[np.argsort(ring.hours())]
+        counts = counts[counts > 0]
+        if len(counts) == 0:
+            return None
+        return Fit(hour, esd.fit(counts.astype(np.float64)[None, :]))
+
     def check(self, event: Event) -> List[Anomaly]:
         timestamp, user = event
+        hour = hour_of(timestamp)
+
+        ring = self.data.get(user)
+        if ring is None:
+            return []
 
-        # Get series for user
-        series = self.data.get(user)
-        if series is None:
+        # Refit on hour rollover or once enough new events arrived, otherwise
+        # check the hour's count against the model cached for this user-hour
+        fit = self.fits.get(user)
+        if fit is None or fit.stale(hour, self.refit_events):
+            fit = self.fit(user, hour)
+            if fit is None:
+                return []
+            self.fits[user] = fit
+        fit.events += 1
+
+        # An event older than the window has no count to check
+        count = ring.count(hour)
+        if count == 0 or not fit.anomalous(count):
             return []
+        return [(hour * HOUR, user, count)]
 
-        # Setup model
-        training = validate_series(series)
-        esd_ad = GeneralizedESDTestAD()
-        try:
-            esd_ad.fit(training)
-        except RuntimeError:
+    def score(self, hour: int, users: Iterable[str], max_outliers: Optional[int] = None) -> List[Anomaly]:
+        rings = [(user, self.data[user]) for user in users if user in self.data]
+        if not rings or self.buckets == 0:
             return []
 
-        # Check if the hour/bucket of our current event is anomalous
-        hour = timestamp.floor('H')
-        check = training[training.index == hour]
-        anomalies = esd_ad.detect(check)
+        # Line the rings up on the scored hour so every row shares the same
+        # slot order, then lay the buckets out oldest first with empty hours
+        # missing, as in the per user series.
+        for _, ring in rings:
+            ring.advance(hour)
+        order = np.argsort(rings[0][1].hours())
+        values = np.stack([ring.counts for _, ring in rings])[:, order].astype(np.float64)
+        values[values == 0] = np.nan
+
+        normal = esd.fit(values, max_outliers=max_outliers)
+        anomalous = esd.detect(normal, values[:, -1])
+        return [(hour * HOUR, user, ring.count(hour)) for (user, ring), flagged in zip(rings, anomalous) if flagged]
 
-        # Reduce to only positive findings
-        anomalies = check[anomalies == True]
 
-        # Convert to list of anomalies
-        result = list(map(lambda a: (a[0], user, a[1]), anomalies.items()))
+# Hourly scores every user that logged on in an hour once that hour has
+# closed, in one batched ESD pass, instead of checking each event.
+class Hourly:
 
-        return result
+    def __init__(self, window: Window, max_outliers: Optional[int] = None) -> None:
+        self.window: Window = window
+        self.max_outliers: Optional[int] = max_outliers
+        self.open: Optional[int] = None
 
+        # Last hour scored, events of it arriving later (after the end of
+        # the stream and a restart) are counted but not scored again
+        self.scored: Optional[int] = None
 
-def main(input: TextIOWrapper, window_size: pd.Timedelta) -> None:
+        # Last raw event of each user active in the open hour
+        self.active: Dict[str, Any] = dict()
 
-    log = structlog.get_logger(detector='logon_times')
+    def add(self, event: Event, raw: Any) -> List[Tuple[Anomaly, Any]]:
+        timestamp, user = event
+        hour = hour_of(timestamp)
 
-    # Init sliding window of events to use as model.
-    window = Window(window_size)
-    count: int = 0
-    logged_saturation = False
+        results: List[Tuple[Anomaly, Any]] = []
+        if self.open is not None and hour > self.open:
+            results = self.close()
+        if (self.open is None or hour >= self.open) and (self.scored is None or hour > self.scored):
+            self.open = hour
+            self.active[user] = raw
 
-    # For each input event we update the window, and then test the event against
-    # the model.
-    for line in input:
-        count = count + 1
-        e, raw = event(line)
-        window.add(e)
+        self.window.add(event)
+        return results
+
+    def close(self) -> List[Tuple[Anomaly, Any]]:
+        active, self.active = self.active, dict()
+        if self.open is None or not self.window.saturated():
+            return []
+        self.scored = self.open
+        anomalies = self.window.score(self.open, active, self.max_outliers)
+        return [(anomaly, active[anomaly[1]]) for anomaly in anomalies]
+
+
+def report(anomaly: Anomaly, raw: Any) -> engine.Record:
+    hour, user, logons = anomaly
+    ts = timestamps.isoformat(hour)
+    return ('anomalous logon for user', {'user': user, 'hour': ts, 'logons': logons, 'raw_event': sink.Raw(raw)})
+
+
+class Detector:
+    name = 'logon_times'
+    paths = decoder.paths
+
+    def __init__(self, window_size: pd.Timedelta, refit_events: int = REFIT_EVENTS, hourly: bool = False, max_outliers: Optional[int] = None) -> None:
+        # Settings a checkpoint of the detector must have been taken with
+        self.settings: Dict[str, Any] = {'window': window_size.value, 'refit_events': refit_events, 'hourly': hourly, 'max_outliers': max_outliers}
+
+        # Init sliding window of events to use as model.
+        self.window = Window(window_size, refit_events)
+        self.schedule = Hourly(self.window, max_outliers) if hourly else None
+        self.count: int = 0
+        self.logged_saturation = False
+
+    # Each input event updates the window, and then the event is tested against
+    # the model. In hourly mode the model is only tested as each hour closes.
+    def observe(self, values: Tuple[Any, ...], input: Union[str, bytes]) -> List[engine.Record]:
+        self.count = self.count + 1
+        e, raw = make_event(values, input)
+        if self.schedule is not None:
+            results = self.schedule.add(e, raw)
+        else:
+            self.window.add(e)
 
         # Skip checking the event until the window is saturated.
-        if not window.saturated():
-            continue
+        if not self.window.saturated():
+            return []
+
+        records: List[engine.Record] = []
+        if not self.logged_saturation:
+            self.logged_saturation = True
+            records.append(('model reached saturation', {'events': self.count}))
+
+        self.window.prune()
+        if self.schedule is None:
+            results = [(anomaly, raw) for anomaly in self.window.check(e)]
+
+        records.extend(report(anomaly, raw_event) for anomaly, raw_event in results)
+        return records
+
+    # Users with logons in the window, for stats
+    def keys(self) -> int:
+        return len(self.window.data)
+
+    # The last hour closes with the end of the stream
+    def finish(self) -> List[engine.Record]:
+        if self.schedule is None:
+            return []
+        return [report(anomaly, raw_event) for anomaly, raw_event in self.schedule.close()]
+
 
-        if not logged_saturation:
-            logged_saturation = True
-            log.info('model reached saturation', events=count)
+def detector(args: argparse.Namespace) -> Detector:
+    return Detector(args.window, args.refit_events, args.hourly, args.max_outliers)
 
-        window.prune()
-        results = window.check(e)
 
-        for anomaly in results:
-            hour, user, logons = anomaly
-            ts = hour.to_pydatetime().isoformat()
-            log.info('anomalous logon for user', user=user, hour=ts, logons=logons, raw_event=raw)
+def main(input: TextIOWrapper, window_size: pd.Timedelta, refit_events: int = REFIT_EVENTS, hourly: bool = False, max_outliers: Optional[int] = None, workers: int = 1, state: Optional[str] = None, interval: float = checkpoint.INTERVAL, batch_size: int = 1, alerts: Optional[sink.Sink] = None, stats: Optional[stats.Stats] = None) -> None:
+    engine.run(input, [Detector(window_size, refit_events, hourly, max_outliers)], workers, state, interval, batch_size, alerts, stats)
 
 
 def duration(value: str) -> pd.Timedelta:
@@ -134,7 +381,17 @@ def duration(value: str) -> pd.Timedelta:
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Flag anomalous logon time for user')
     parser.add_argument('--window', type=duration, default='30 days', help='Model sample size')
+    parser.add_argument('--refit-events', type=int, default=REFIT_EVENTS, metavar='N', help='Refit a user model after N events in the same hour (1 refits on every event)')
+    parser.add_argument('--hourly', action='store_true', help='Score all users once per closed hour in a batch instead of on every event')
+    parser.add_argument('--max-outliers', type=int, metavar='N', help='Limit the ESD test to N outliers per user in hourly mode')
     parser.add_argument('--input', type=open, help='File containing event stream')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Decode the input in N worker processes')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N', help='Check events in batches of N, for throughput over latency')
+    parser.add_argument('--state', metavar='PATH', help='Restore detector state from PATH at startup and checkpoint it there')
+    parser.add_argument('--checkpoint-interval', type=float, default=checkpoint.INTERVAL, metavar='SECONDS', help='Seconds between checkpoints of detector state')
+    sink.add_arguments(parser)
+    stats.add_arguments(parser)
     args = parser.parse_args()
 
-    main(args.input, args.window)
\ No newline at end of file
+    with stats.profile(args.profile):
+        main(args.input, args.window, args.refit_events, args.hourly, args.max_outliers, args.workers, args.state, args.checkpoint_interval, args.batch_size, sink.create(args), stats.create(args))
\ No newline at end of file
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+from hashlib import blake2b
+from io import TextIOWrapper
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+import argparse
+import os
+import numpy as np
+import chunks
+import fields
+import sketch
+
+
+'''
+Index of the (process, parent) pairs seen in training data.
+
+Each pair is stored as a 64-bit blake2b hash of its two paths, and the
+index is the sorted array of distinct hashes, saved as a .npy file. The
+detector memory-maps the index and looks pairs up by binary search, so
+neither the training strings nor one Python object per pair are held in
+memory, and startup does not grow with the training data. With 64-bit
+hashes a false match is vanishingly unlikely for any realistic number of
+pairs.
+
+Build an index once from the training exports with
+
+    ./pair_index.py --training train.json --output pairs.npy
+'''
+
+
+decoder = fields.Decoder(fields.PROCESS, fields.PARENT)
+
+
+def key(process: str, parent: str) -> int:
+    digest = blake2b(process.encode('utf-8') + b'\0' + parent.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+# Hashes are deduplicated in batches of this many lines while building
+BATCH = 1 << 20
+
+
+# Distinct hashes of the pairs in some lines, sorted
+def keys(lines: Iterable[Union[str, bytes]]) -> np.ndarray:
+    parts: List[np.ndarray] = []
+    batch: List[int] = []
+    for line in lines:
+        try:
+            process, parent = decoder.decode(line)
+        except (KeyError, TypeError, ValueError):
+            continue
+        batch.append(key(process, parent))
+        if len(batch) >= BATCH:
+            parts.append(np.unique(np.array(batch, dtype=np.uint64)))
+            batch = []
+    parts.append(np.array(batch, dtype=np.uint64))
+    return np.unique(np.concatenate(parts))
+
+
+class PairIndex:
+
+    def __init__(self, keys: np.ndarray, path: Optional[str] = None) -> None:
+        self.keys: np.ndarray = keys
+        self.path: Optional[str] = path
+
+    def __contains__(self, pair: Tuple[str, str]) -> bool:
+        k = np.uint64(key(*pair))
+        i = int(np.searchsorted(self.keys, k))
+        return i < len(self.keys) and self.keys[i] == k
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    # Membership of many pairs, looking each distinct pair up once
+    def contains(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        distinct = list(dict.fromkeys(pairs))
+        k = np.array([key(*pair) for pair in distinct], dtype=np.uint64)
+        i = np.minimum(np.searchsorted(self.keys, k), max(len(self.keys) - 1, 0))
+        found = self.keys[i] == k if len(self.keys) else np.zeros(len(k), dtype=bool)
+        lookup = dict(zip(distinct, found.tolist()))
+        return np.array([lookup[pair] for pair in pairs], dtype=bool)
+
+    # The index is read-only, copies of a detector (e.g. one per shard) share it
+    def __deepcopy__(self, memo: Dict[int, Any]) -> 'PairIndex':
+        return self
+
+    # Checkpoints of a detector refer to a saved index by path rather than
+    # holding a copy of it
+    def __getstate__(self) -> Dict[str, Any]:
+        if self.path is not None:
+            return {'path': self.path}
+        return {'keys': self.keys}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        if 'path' in state:
+            self.keys = np.load(state['path'], mmap_mode='r')
+            self.path = state['path']
+        else:
+            self.keys = state['keys']
+            self.path = None
+
+
+# Bloom filter of the pairs of an index, for --approx
+class PairFilter:
+
+    def __init__(self, index: PairIndex, error: float = sketch.ERROR) -> None:
+        self.pairs: int = len(index)
+        self.path: Optional[str] = index.path
+        self.error: float = error
+        self.bloom: sketch.BloomFilter = sketch.BloomFilter(max(self.pairs, 1), error)
+        self.bloom.update(index.keys)
+
+    def __contains__(self, pair: Tuple[str, str]) -> bool:
+        return key(*pair) in self.bloom
+
+    def __len__(self) -> int:
+        return self.pairs
+
+    def contains(self, pairs: List[Tuple[str, str]]) -> np.ndarray:
+        lookup = {pair: pair in self for pair in dict.fromkeys(pairs)}
+        return np.array([lookup[pair] for pair in pairs], dtype=bool)
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> 'PairFilter':
+        return self
+
+
+def build(inputs: List[TextIOWrapper], workers: int = 1) -> PairIndex:
+    parts = []
+    for input in inputs:
+        path = chunks.path_of(input)
+        if workers > 1 and path is not None:
+            parts.extend(chunks.imap(keys, path, workers))
+        else:
+            parts.append(keys(input))
+    return PairIndex(np.unique(np.concatenate(parts)) if parts else np.array([], dtype=np.uint64))
+
+
+def save(path: str, index: PairIndex) -> None:
+    partial = path + '.partial'
+    with open(partial, 'wb') as output:
+        np.save(output, index.keys)
+    os.replace(partial, path)
+
+
+def load(path: str) -> PairIndex:
+    return PairIndex(np.load(path, mmap_mode='r'), path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the index of process pairs seen in training data for rare_process_pairs')
+    parser.add_argument('--training', type=open, action='append', required=True, help='File containing training data, may be repeated')
+    parser.add_argument('--output', required=True, help='Index file to write, e.g. pairs.npy')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Parse the training data in N worker processes')
+    args = parser.parse_args()
+
+    save(args.output, build(args.training, args.workers))
@@ -1,3 +1,7 @@
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import io
+from itertools import islice
 import json
 from pathlib import Path
 import pandas as pd
@@ -5,6 +9,9 @@ from adtk.data import validate_series
 from adtk.visualization import plot
 from adtk.detector import GeneralizedESDTestAD
 import matplotlib.pyplot as plt
+from joblib import Parallel, delayed
+import cache
+import chunks
 
 '''
 Functions to recreate the anomaly detection + frequency tables of the 'Anomaly Detection Exploration' HTML file. 
@@ -25,59 +32,154 @@ def clean_up_keys(dictionary):
     return new_dictionary
 
 
-def parse_to_csv(file_object):
+# Columns of the flat CSVs, in order
+FLAT_COLUMNS = ['timestamp', 'process', 'event_code', 'event_module', 'event_action', 'key', 'count', 'user', 'tenant',
+                'agent_name', 'agent_os', 'computer', 'logon_type', 'new_process', 'parent_process', 'index', 'type', 'id',
+                'score', 'hour']
+
+# Rows handed to the csv writer at once, and bytes buffered before writing to disk
+ROWS = 10000
+BUFFER = 1 << 20
+
+
+def flat_row(hit):
+    '''
+    :param hit: parsed json line
+    :return: list of the values of FLAT_COLUMNS, None for missing ones (written as empty fields)
+
+    Every field has a column of its own, so a missing field leaves its column empty rather than shifting the rest of the
+    row
     '''
-    :param file_object:
-    :return:
+    source = hit.get('_source') or {}
+    process = source.get('process') or {}
+    event = source.get('event') or {}
+    user = (source.get('user') or {}).get('target') or {}
+    agent = source.get('agent') or {}
+    win = (source.get('data') or {}).get('win') or {}
+    event_data = win.get('eventdata') or {}
+    return [source.get('@timestamp'), process.get('name'), event.get('code'), event.get('module'), event.get('action'),
+            source.get('key'), source.get('count'), user.get('name'), source.get('tenant'), agent.get('name'),
+            agent.get('os_full'), (win.get('system') or {}).get('computer'), event_data.get('logonType'),
+            event_data.get('newProcessName'), event_data.get('parentProcessName'), hit.get('_index'), hit.get('_type'),
+            hit.get('_id'), hit.get('_score'), source.get('hour')]
+
+
+def flat_csv(lines):
+    '''
+    :param lines: json lines, as str or bytes
+    :return: csv text of their rows, without a header
+
+    Function converting one range of an export in a worker process, see parse_to_csv
+    '''
+    output = io.StringIO()
+    csv.writer(output, lineterminator='\n').writerows(flat_row(json.loads(line)) for line in lines if line.strip())
+    return output.getvalue()
+
+
+def parse_to_csv(file_object, columnar=False, workers=1):
+    '''
+    :param file_object: path of a json export
+    :param columnar: write the event cache read by read_events (flat_<name>.npz) instead of a csv
+    :param workers: number of processes parsing ranges of the export into csv at once
+    :return: path of the file written, next to the export
 
     Function to parse provided jsons into same-format CSVs, originally for ease of use in R Markdown
+
+    Rows are written through csv.writer, which quotes fields holding commas, quotes or line breaks, ROWS at a time or a
+    range of the export at a time with workers. Characters that cannot be encoded are written backslash escaped rather
+    than dropping the row
+    '''
+    file_object = Path(file_object)
+    if columnar:
+        path = file_object.with_name(f'flat_{file_object.stem}.npz')
+        with file_object.open('r', encoding='utf-8-sig') as lines:
+            cache.write(lines, path)
+        return path
+
+    path = file_object.with_name(f'flat_{file_object.stem}.csv')
+    with path.open('w', encoding='utf-8', errors='backslashreplace', newline='', buffering=BUFFER) as output:
+        output.write(','.join(FLAT_COLUMNS) + '\n')
+        if workers > 1:
+            for text in chunks.imap(flat_csv, str(file_object), workers):
+                output.write(text)
+            return path
+        with file_object.open('r', encoding='utf-8-sig') as lines:
+            while True:
+                batch = list(islice(lines, ROWS))
+                if not batch:
+                    break
+                output.write(flat_csv(batch))
+    return path
+
+
+def convert_all(directory='data', columnar=False, workers=None):
+    '''
+    :param directory: folder of json exports
+    :param columnar: write event caches instead of csvs, see parse_to_csv
+    :param workers: number of processes, one per cpu if None
+    :return: paths of the files written
+
+    Function to convert every json in a folder, several files at once in worker processes
     '''
-    with Path(f'data/flat_{file_object.stem}.csv').open('wb') as csv_writer:
-        row = []
-        csv_writer.write(
-            'timestamp,process,event_code,event_module,event_action,key,count,user,tenant,agent_name,agent_os,'
-            'computer,logon_type,new_process,parent_process,index,type,id,score,hour\n'.encode()
-        )
-        for line in file_object.open('r', encoding='utf-8-sig'):
-            log_entry = clean_up_keys(json.loads(line))
-            source = log_entry.get('source', '')
-            if source != '':
-                row.append(source["@timestamp"])
-                process = source.get('process', '')
-                if process != '':
-                    row.append(process.get('name', ''))
-                event = source.get('event', '')
-                if event != '':
-                    row.append(event.get('code'))
-                    row.append(event.get('module'))
-                    row.append(event.get('action'))
-                row.append(source.get('key'))
-                row.append(source.get('count'))
-                row.append(source['user']['target'].get('name', ''))
-                row.append(source.get('tenant', ''))
-                agent = source.get('agent', '')
-                if agent != '':
-                    row.append(agent.get('name', ''))
-                    row.append(agent.get('os_full', ''))
-                data = source.get('data', '')
-                if data != '':
-                    row.append(data['win']['system']['computer'])
-                    event_data = data['win'].get('eventdata', '')
-                    if event_data != '':
-                        row.append(event_data.get('logonType'))
-                        row.append(event_data.get('newProcessName', ''))
-                        row.append(event_data.get('parentProcessName', ''))
-            row.append(log_entry.get('index', ''))
-            row.append(log_entry.get('type', ''))
-            row.append(log_entry.get('id', ''))
-            row.append(log_entry.get('score', ''))
-            row.append(log_entry.get('hour', ''))
-            csv_row = str(row)[1:-1].replace("'", "") + '\n'
-            try:
-                csv_writer.write(csv_row.replace(', ', ',').encode())
-            except UnicodeEncodeError:
-                pass
-            row = []
+    files = sorted(Path(directory).glob('*.json'))
+    with ProcessPoolExecutor(workers) as pool:
+        return list(pool.map(parse_to_csv, files, [columnar] * len(files)))
+
+
+# Cache column holding each flat CSV column
+CACHED_COLUMNS = {'timestamp': 'timestamp', 'user': 'user', 'new_process': 'process', 'parent_process': 'parent'}
+
+
+def cached_events(csv_file):
+    '''
+    :param csv_file: location of csv file
+    :return: the event cache next to the csv file (same name, .npz), None if there is none or it is stale
+
+    The cache is stale when the json export the csv file was converted from (<name>.json for flat_<name>.csv) has
+    changed since the cache was built from it, or, without the export, when the csv file is newer than the cache
+    '''
+    csv_file = Path(csv_file)
+    path = csv_file.with_suffix('.npz')
+    if not path.exists():
+        return None
+    events = cache.Cache(path)
+    export = csv_file.with_name(csv_file.stem[len('flat_'):] + '.json')
+    if csv_file.stem.startswith('flat_') and export.exists():
+        return events if events.fresh(export) else None
+    if csv_file.exists() and csv_file.stat().st_mtime_ns > path.stat().st_mtime_ns:
+        return None
+    return events
+
+
+def read_events(csv_file, columns=None):
+    '''
+    :param csv_file: location of csv file, or of an event cache (.npz)
+    :param columns: csv columns to load, all of them if None
+    :return: dataframe of the columns, timestamps parsed as UTC datetimes and missing values as NaN
+
+    Function to load events, from the event cache next to the csv file when it holds every column asked for and is not
+    stale (see cached_events) as it only loads the columns asked for and skips parsing text, otherwise from the csv
+    file itself. Either way the same dataframe is returned
+    '''
+    if Path(csv_file).suffix == '.npz':
+        columns = list(CACHED_COLUMNS) if columns is None else columns
+        events = cache.Cache(csv_file)
+    elif columns is not None and set(columns) <= set(CACHED_COLUMNS):
+        events = cached_events(csv_file)
+    else:
+        events = None
+    if events is not None:
+        df = events.frame([CACHED_COLUMNS[column] for column in columns]).set_axis(columns, axis=1)
+        for column in columns:
+            if column != 'timestamp':
+                df[column] = df[column].astype(object)
+        return df
+    df = pd.read_csv(csv_file, usecols=columns, dtype={column: object for column in CACHED_COLUMNS if column != 'timestamp'})
+    if columns is not None:
+        df = df[columns]
+    if 'timestamp' in df:
+        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True).astype('datetime64[ns, UTC]')
+    return df
 
 
 def detect_individual_timeseries_anomalies(csv_file, type="user", name='SYSTEM'):
@@ -100,10 +202,10 @@ def detect_individual_timeseries_anomalies(csv_file, type="user", name='SYSTEM')
     Or alternative time series Python packages (such as fbprophet) are available
     '''
 
-    df = pd.read_csv(csv_file)
+    df = read_events(csv_file, [type, 'timestamp'])
     df[type] = df[type].str.replace("\\", "")
     df = df[df[type] == name]
-    df['time'] = pd.to_datetime(df.timestamp).dt.round("H")
+    df['time'] = pd.to_datetime(df.timestamp).dt.round("h")
     s = validate_series(df.groupby('time').timestamp.count())
     esd_ad = GeneralizedESDTestAD()
     anomalies = esd_ad.fit_detect(s)
@@ -113,11 +215,34 @@ def detect_individual_timeseries_anomalies(csv_file, type="user", name='SYSTEM')
     plt.show()
 
 
-def detect_all_timeseries_anomalies(csv_file, verbose=False, type="new_process"):
+def hourly_series(df, type):
+    '''
+    :param df: dataframe of type and timestamp columns
+    :param type: string of user, new_process, or parent_process
+    :return: dict of each individual to its number of events per hour, as a time series
+
+    Function to build the time series of every individual in one pass, hours without events are left out
+    '''
+    time = pd.to_datetime(df.timestamp).dt.round("h")
+    counts = df.timestamp.groupby([df[type], time.rename('time')]).count()
+    return {individual: s.droplevel(0) for individual, s in counts.groupby(level=0, sort=False)}
+
+
+def count_anomalies(s):
+    '''
+    :param s: time series of an individual
+    :return: number of anomalies detected in it
+    '''
+    esd_ad = GeneralizedESDTestAD()
+    return sum(esd_ad.fit_detect(validate_series(s)))
+
+
+def detect_all_timeseries_anomalies(csv_file, verbose=False, type="new_process", workers=-1):
     '''
     :param csv_file: location of csv files containing user or process data
     :param verbose: boolean, print line by line?
     :param type: string of user, new_process, or parent_process
+    :param workers: number of processes fitting the time series, as joblib's n_jobs (-1 for one per cpu)
     :return: dataframe of type and count of anomalies detected
 
     Function to count number of anomalies for all time series in data
@@ -135,19 +260,22 @@ def detect_all_timeseries_anomalies(csv_file, verbose=False, type="new_process")
     https://adtk.readthedocs.io/en/stable/notebooks/demo.html
 
     Or alternative time series Python packages (such as fbprophet) are available
+
+    The hourly time series of every individual are built in a single groupby over the data, and fitted in a pool of
+    worker processes
     '''
-    df = pd.read_csv(csv_file)
+    df = read_events(csv_file, [type, 'timestamp'])
     df_out = []
     df[type] = df[type].str.replace("\\", "")
-    for individual in df[type].unique():
-        tmp = df[df[type] == individual].copy()
-        tmp['time'] = pd.to_datetime(tmp.timestamp).dt.round("H")
-        s = validate_series(tmp.groupby('time').timestamp.count())
-        esd_ad = GeneralizedESDTestAD()
-        anomalies = esd_ad.fit_detect(s)
+    individuals = df[type].unique()
+    series = hourly_series(df, type)
+    # individuals without timestamped events get an empty series, which the ESD test rejects as it always has
+    empty = pd.Series([], index=pd.DatetimeIndex([], name='time'), name='timestamp', dtype='int64')
+    counts = Parallel(n_jobs=workers)(delayed(count_anomalies)(series.get(individual, empty)) for individual in individuals)
+    for individual, count in zip(individuals, counts):
         if verbose:
-            print("Anomalies detected for {} {}: {}".format(type, individual, sum(anomalies)))
-        df_out.append((individual,sum(anomalies)))
+            print("Anomalies detected for {} {}: {}".format(type, individual, count))
+        df_out.append((individual, count))
     cols = [type, 'anomalies_detected']
     result = pd.DataFrame(df_out, columns=cols)
     return result
@@ -161,7 +289,7 @@ def rare_pairs(csv_file):
     Function aggregates parent+child processes and sorts them by rarity, and returns for human examination of outliers
     '''
 
-    df = pd.read_csv(csv_file)
+    df = read_events(csv_file, ['new_process', 'parent_process'])
     df['new_process'] = df['new_process'].str.replace("\\", "")
     df['parent_process'] = df['parent_process'].str.replace("\\", "")
     return df.groupby(['new_process','parent_process']).size().sort_values(ascending=True).reset_index(name='pair frequency')
@@ -180,7 +308,7 @@ def rare_parents(csv_file, tolerance=1):
     'C:/Users/admin147/AppData/Local/Temp/svchost.exe > C:/Windows/System32/cmd.exe'
     example
     '''
-    df = pd.read_csv(csv_file)
+    df = read_events(csv_file)
     df['new_process'] = df['new_process'].str.replace("\\", "")
     df['parent_process'] = df['parent_process'].str.replace("\\", "")
     gb = df\
@@ -193,9 +321,9 @@ def rare_parents(csv_file, tolerance=1):
 
 if __name__ == '__main__':
 
-    # parse jsons in data folder into csvs
-    for file in Path('./data').glob('*.json'):
-        parse_to_csv(file)
+    # parse jsons in data folder into csvs, and event caches read in their place
+    convert_all('./data')
+    convert_all('./data', columnar=True)
 
     # detect potential anomalies in user / child / parent processes
     tmp1 = detect_all_timeseries_anomalies('data/flat_4688.csv', type="new_process") #can also examine parent_process
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+from io import TextIOWrapper
+from typing import Any, Dict, List, Optional, Tuple, Union
+import argparse
+import pandas as pd
+import checkpoint
+import engine
+import fields
+import sink
+import sketch
+import stats
+import timestamps
+
+
+'''
+Processes launched by a parent they are rarely launched by, in real time.
+
+The streaming counterpart of poc.rare_parents. Every process event counts
+a launch of the child (the new process) and of the (child, parent) pair,
+and is flagged when the pair makes up less than --tolerance percent of the
+child's launches, this one included. A child takes more than
+100 / tolerance launches before any of its parents can be rare, e.g.
+cmd.exe launched by a svchost.exe under a user's Temp directory among
+thousands of launches of cmd.exe by explorer.exe.
+
+Counts are kept in dicts keyed by the 64-bit hash of the child and of the
+pair rather than by their paths. With --half-life they decay
+exponentially, a launch counting half as much after every half-life, so
+the shares follow recent behaviour as a sliding window would. Counts are
+kept scaled to a reference time (forward decay), so an event updates and
+compares two counts in O(1) without touching the others. Once a half-life
+has passed the counts are rescaled to the current time and those worth
+less than FLOOR launches are dropped, which bounds memory to the children
+and pairs seen within the last few half-lives.
+'''
+
+
+Event = Tuple[int, str, str]
+
+
+decoder = fields.Decoder(fields.TIMESTAMP, fields.PROCESS, fields.PARENT)
+
+
+# Percent of a child's launches below which its parent is rare, as in
+# poc.rare_parents
+TOLERANCE = 1.0
+
+# Decayed counts worth fewer launches are dropped when rescaling, a launch
+# is worth that little after about seven half-lives
+FLOOR = 0.01
+
+
+def event(input: Union[str, bytes]) -> Event:
+    return make_event(decoder.decode(input))
+
+
+# Build an Event from the decoded fields of a line
+def make_event(values: Tuple[Any, ...]) -> Event:
+    timestamp, process, parent = values
+    return (timestamps.parse(timestamp), process, parent)
+
+
+def pair_key(process: str, parent: str) -> int:
+    return sketch.hash64(process + '\0' + parent)
+
+
+# Launches of each child and (child, parent) pair, decayed with a half-life
+class Counts:
+
+    def __init__(self, half_life: Optional[pd.Timedelta] = None) -> None:
+        self.half_life: Optional[int] = half_life.value if half_life is not None else None
+        self.children: Dict[int, float] = {}
+        self.pairs: Dict[int, float] = {}
+
+        # Time the counts are scaled to, a launch at this time counts as one
+        self.origin: Optional[int] = None
+
+    # Weight of a launch at timestamp, relative to the origin
+    def weight(self, timestamp: int) -> float:
+        if self.half_life is None:
+            return 1.0
+        if self.origin is None:
+            self.origin = timestamp
+        elif timestamp - self.origin >= self.half_life:
+            self.rescale(timestamp)
+        return 2.0 ** ((timestamp - self.origin) / self.half_life)
+
+    # Scale the counts to a later origin, dropping those worth too little
+    def rescale(self, origin: int) -> None:
+        factor = 2.0 ** (-(origin - self.origin) / self.half_life)
+        self.children = {key: count * factor for key, count in self.children.items() if count * factor >= FLOOR}
+        self.pairs = {key: count * factor for key, count in self.pairs.items() if count * factor >= FLOOR}
+        self.origin = origin
+
+    # Count a launch, and return the pair's share of the child's launches in
+    # percent and the child's (decayed) launches, this one included
+    def add(self, timestamp: int, process: str, parent: str) -> Tuple[float, float]:
+        weight = self.weight(timestamp)
+        child = sketch.hash64(process)
+        pair = pair_key(process, parent)
+        launches = self.children.get(child, 0.0) + weight
+        pairs = self.pairs.get(pair, 0.0) + weight
+        self.children[child] = launches
+        self.pairs[pair] = pairs
+        return (100.0 * pairs / launches, launches / weight)
+
+
+class Detector:
+    name = 'rare_parents'
+    paths = decoder.paths
+
+    def __init__(self, tolerance: float = TOLERANCE, half_life: Optional[pd.Timedelta] = None) -> None:
+        self.tolerance: float = tolerance
+        self.counts: Counts = Counts(half_life)
+
+        # Settings a checkpoint of the detector must have been taken with
+        self.settings: Dict[str, Any] = {'tolerance': tolerance, 'half_life': self.counts.half_life}
+
+    # Check the share of the child's launches by this parent
+    def observe(self, values: Tuple[Any, ...], input: Union[str, bytes]) -> List[engine.Record]:
+        timestamp, process, parent = make_event(values)
+        percentage, launches = self.counts.add(timestamp, process, parent)
+        if percentage < self.tolerance:
+            ts = timestamps.isoformat(timestamp)
+            return [('rare parent process detected', {'time': ts, 'process': process, 'parent': parent, 'percentage': round(percentage, 3), 'launches': round(launches, 1), 'full_event': sink.Raw(input)})]
+        return []
+
+    # Pairs counted, for stats
+    def keys(self) -> int:
+        return len(self.counts.pairs)
+
+    def finish(self) -> List[engine.Record]:
+        return []
+
+
+def detector(args: argparse.Namespace) -> Detector:
+    return Detector(args.tolerance, args.half_life)
+
+
+def duration(value: str) -> pd.Timedelta:
+    return pd.to_timedelta(value)
+
+
+def main(input: TextIOWrapper, tolerance: float = TOLERANCE, half_life: Optional[pd.Timedelta] = None, workers: int = 1, state: Optional[str] = None, interval: float = checkpoint.INTERVAL, batch_size: int = 1, alerts: Optional[sink.Sink] = None, stats: Optional[stats.Stats] = None) -> None:
+    engine.run(input, [Detector(tolerance, half_life)], workers, state, interval, batch_size, alerts, stats)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flag processes launched by a parent they are rarely launched by')
+    parser.add_argument('--input', type=open, help='File containing event stream')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, metavar='PERCENT', help='Flag parents launching less than PERCENT of a process\'s launches')
+    parser.add_argument('--half-life', type=duration, metavar='DURATION', help='Decay launch counts by half every DURATION, instead of counting every launch ever seen')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Decode the input in N worker processes')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N', help='Check events in batches of N, for throughput over latency')
+    parser.add_argument('--state', metavar='PATH', help='Restore detector state from PATH at startup and checkpoint it there')
+    parser.add_argument('--checkpoint-interval', type=float, default=checkpoint.INTERVAL, metavar='SECONDS', help='Seconds between checkpoints of detector state')
+    sink.add_arguments(parser)
+    stats.add_arguments(parser)
+    args = parser.parse_args()
+
+    with stats.profile(args.profile):
+        main(args.input, args.tolerance, args.half_life, args.workers, args.state, args.checkpoint_interval, args.batch_size, sink.create(args), stats.create(args))
@@ -3,29 +3,46 @@
 from io import TextIOWrapper
 from typing import Any, Dict, List, Optional, Tuple, Union
 import argparse
-import json
+import numpy as np
 import pandas as pd
-import structlog
+import batch
+import checkpoint
+import engine
+import expiry
+import fields
+import sink
+import stats
+import sketch
+import timestamps
 
 
-Event = Tuple[pd.Timestamp, str, Any]
+Event = Tuple[int, str, Any]
 
 
-# Parse a JSON encoded line into an Event
+decoder = fields.Decoder(fields.TIMESTAMP, fields.PROCESS)
+
+
+# Parse a JSON encoded line into an Event, the raw line is kept so the full
+# event is only decoded for alerts.
 def event(input: Union[str, bytes]) -> Event:
-    e = json.loads(input)
-    timestamp = pd.to_datetime(e['_source']['@timestamp'])
-    data = e['_source']['data']['win']['eventdata']
-    process_path = data['newProcessName']
+    return make_event(decoder.decode(input), input)
+
+
+# Build an Event from the decoded fields of a line
+def make_event(values: Tuple[Any, ...], input: Union[str, bytes]) -> Event:
+    timestamp, process_path = values
+    return (timestamps.parse(timestamp), dir_of(process_path), input)
+
+
+def dir_of(process_path: str) -> str:
     segments = process_path.split("\\")
-    dir = "\\".join(segments[:-1])
-    return (timestamp, dir, e)
+    return "\\".join(segments[:-1])
 
 
 class Model:
-    def __init__(self, size: pd.Timedelta):
-        self.seen: Dict[str, pd.Timestamp] = {}
-        self.size: pd.Timedelta = size
+    def __init__(self, size: pd.Timedelta, max_keys: Optional[int] = None):
+        self.seen: expiry.ExpiringDict = expiry.ExpiringDict(size.value, max_keys)
+        self.size: int = size.value
 
     def check(self, event: Event) -> bool:
 
@@ -42,53 +59,110 @@ class Model:
 
         return not seen
 
+    # Check a batch of events at once, None if it has to be checked one by one
+    def check_batch(self, times: np.ndarray, dirs: List[str]) -> Optional[np.ndarray]:
+        return batch.rare(self.seen, self.size, dirs, times)
+
+
+# Model kept in time-partitioned sketches rather than a dict, for --approx
+class ApproxModel:
+    def __init__(self, size: pd.Timedelta, approx: sketch.Approx):
+        self.seen: sketch.Windowed = sketch.Windowed(size.value, approx)
+
+    def check(self, event: Event) -> bool:
+        timestamp, dir, _ = event
+        return self.seen.rare(dir, timestamp)
+
 
 def duration(value: str) -> pd.Timedelta:
     return pd.to_timedelta(value)
 
 
-def main(skip: pd.Timedelta, window: pd.Timedelta, input: TextIOWrapper):
-
-    log = structlog.get_logger(detector='rare_process_dir')
+class Detector:
+    name = 'rare_process_dir'
+    paths = decoder.paths
 
-    # Track process dirs seen in window
-    model = Model(window)
+    def __init__(self, skip: pd.Timedelta, window: pd.Timedelta, max_keys: Optional[int] = None, approx: Optional[sketch.Approx] = None) -> None:
+        self.skip: int = skip.value
+        self.start: Optional[int] = None
 
-    n = 0
-    start: Optional[pd.Timestamp] = None
+        # Settings a checkpoint of the detector must have been taken with
+        self.settings: Dict[str, Any] = {'skip': skip.value, 'window': window.value, 'max_keys': max_keys, 'approx': approx}
 
-    # Loop over input
-    for line in input:
-        n = n + 1
+        # Track process dirs seen in window
+        self.model = Model(window, max_keys) if approx is None else ApproxModel(window, approx)
 
-        # Parse event
-        e = event(line)
-        timestamp, dir, full_event = e
+    def observe(self, values: Tuple[Any, ...], input: Union[str, bytes]) -> List[engine.Record]:
+        e = make_event(values, input)
+        timestamp, dir, raw = e
 
-        if start == None:
-            start = timestamp + skip
+        if self.start == None:
+            self.start = timestamp + self.skip
 
         # Check against model
-        anomaly = model.check(e)
-        
+        anomaly = self.model.check(e)
+
         # Alert if necessary
-        if timestamp >= start:
-            if anomaly:
-                ts = timestamp.to_pydatetime().isoformat()
-                log.info('rare process dir detected', launch_time=ts, dir=dir, full_event=full_event)
+        if timestamp >= self.start and anomaly:
+            ts = timestamps.isoformat(timestamp)
+            return [('rare process dir detected', {'launch_time': ts, 'dir': dir, 'full_event': sink.Raw(raw)})]
+        return []
+
+    # Check a batch of events at once, with the same alerts as observing them
+    # one by one (see batch.py)
+    def observe_batch(self, values: List[Tuple[Any, ...]], inputs: List[Union[str, bytes]]) -> List[engine.Record]:
+        if not isinstance(self.model, Model):
+            return engine.observe_each(self, values, inputs)
+        times = timestamps.parse_many([timestamp for timestamp, _ in values]).view(np.int64)
+        dirs = [dir_of(process_path) for _, process_path in values]
+        anomalies = self.model.check_batch(times, dirs)
+        if anomalies is None:
+            return engine.observe_each(self, values, inputs)
+
+        if self.start == None:
+            self.start = int(times[0]) + self.skip
+
+        records: List[engine.Record] = []
+        for i in np.flatnonzero(anomalies & (times >= self.start)).tolist():
+            ts = timestamps.isoformat(int(times[i]))
+            records.append(('rare process dir detected', {'launch_time': ts, 'dir': dirs[i], 'full_event': sink.Raw(inputs[i])}))
+        return records
+
+    # Dirs remembered, for stats (not counted with --approx)
+    def keys(self) -> Optional[int]:
+        return len(self.model.seen) if isinstance(self.model, Model) else None
+
+    def finish(self) -> List[engine.Record]:
+        return []
 
 
+def detector(args: argparse.Namespace) -> Detector:
+    return Detector(args.skip, args.window, args.max_keys, sketch.settings(args))
 
 
+def main(skip: pd.Timedelta, window: pd.Timedelta, input: TextIOWrapper, max_keys: Optional[int] = None, workers: int = 1, state: Optional[str] = None, interval: float = checkpoint.INTERVAL, approx: Optional[sketch.Approx] = None, batch_size: int = 1, alerts: Optional[sink.Sink] = None, stats: Optional[stats.Stats] = None):
+    engine.run(input, [Detector(skip, window, max_keys, approx)], workers, state, interval, batch_size, alerts, stats)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Flag rare process directories in event stream')
     parser.add_argument('--skip', type=duration, metavar='WINDOW', default='30 days', help='Skip detection for events in initial WINDOW')
     parser.add_argument('--window', type=duration, default='30 days', help='Remember directories seen within the given window')
+    parser.add_argument('--max-keys', type=int, metavar='N', help='Remember at most N keys, evicting the least recently seen')
+    parser.add_argument('--approx', action='store_true', help='Remember keys in Bloom filters (Count-Min sketches with --min-count) of bounded size, see sketch.py')
+    parser.add_argument('--error', type=float, default=sketch.ERROR, help='False positive rate of --approx')
+    parser.add_argument('--capacity', type=int, default=sketch.CAPACITY, metavar='N', help='Distinct keys per --approx partition, an eighth of the window')
+    parser.add_argument('--min-count', type=int, default=1, metavar='N', help='With --approx, flag keys seen fewer than N times within the window')
     parser.add_argument('--input', type=open, help='File containing event stream')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Decode the input in N worker processes')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N', help='Check events in batches of N, for throughput over latency')
+    parser.add_argument('--state', metavar='PATH', help='Restore detector state from PATH at startup and checkpoint it there')
+    parser.add_argument('--checkpoint-interval', type=float, default=checkpoint.INTERVAL, metavar='SECONDS', help='Seconds between checkpoints of detector state')
+    sink.add_arguments(parser)
+    stats.add_arguments(parser)
     args = parser.parse_args()
 
-    main(args.skip, args.window, args.input)
+    with stats.profile(args.profile):
+        main(args.skip, args.window, args.input, args.max_keys, args.workers, args.state, args.checkpoint_interval, sketch.settings(args), args.batch_size, sink.create(args), stats.create(args))
 
 
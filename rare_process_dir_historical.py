@@ -1,111 +1,114 @@
 #!/usr/bin/env python3
 
 from io import TextIOWrapper
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple, Union
 import argparse
 import json
-import pandas as pd
+import aggregate
+import cache
+import fields
+import stats
+import whitelist
 
 
-Event = Tuple[pd.Timestamp, str]
+Event = Tuple[str, str]
+
+
+decoder = fields.Decoder(fields.TIMESTAMP, fields.PROCESS, fields.USER, fields.COMPUTER, fields.TENANT)
 
 
 # Parse a JSON encoded line into an Event
 def event(input: Union[str, bytes]) -> Event:
-    e = json.loads(input)
-    timestamp = pd.to_datetime(e['_source']['@timestamp'])
-    data = e['_source']['data']['win']['eventdata']
-    process_path = data['newProcessName']
+    return make_event(decoder.decode(input))
+
+def make_event(values: Tuple[Any, ...]) -> Event:
+    timestamp, process_path, user_target_name, system_computer, tenant = values
     segments = process_path.split("\\")
     dir = "\\".join(segments[:-1]).replace('\\\\', '\\')
-    user_target_name = e['_source']['user']['target']['name']
-    system_computer = e['_source']['data']['win']['system']['computer']
-    tenant = e['_source']['tenant']
     return (timestamp, dir, user_target_name, system_computer, tenant)
 
-def get_whitelisted(input: TextIOWrapper, dwl: TextIOWrapper) -> Dict[str, Any]:
-    events: List[Event] = []
+# Add an event to the report
+def add(aggregator: aggregate.Aggregator, e: Event, n: int = 1) -> None:
+    _, dir, user_target_name, system_computer, tenant = e
+    aggregator.add(dir, (user_target_name, system_computer, tenant), n)
+
+# Keep only the events whose dir is in the whitelist, in one pass
+def get_whitelisted(input: TextIOWrapper, dwl: FrozenSet[str]) -> Tuple[int, int, aggregate.Aggregator]:
+    aggregator = aggregate.Aggregator()
 
     total = 0
     skipped = 0
-    for dir_wl in dwl:
-        print(dir_wl)
-        for line in input:
-            try:
-                if event(line)[1] == dir_wl:
-                    events.append(event(line))
-                    total += 1
-                else:
-                    skipped = skipped + 1
-            except:
-                skipped = skipped + 1
-    return(total, skipped, events)
-
-def get_all_dirs(input: TextIOWrapper) -> Dict[str, Any]:
-    events: List[Event] = []
+    for line in input:
+        try:
+            e = event(line)
+        except:
+            skipped = skipped + 1
+            continue
+        if whitelist.normalize(e[1]) in dwl:
+            add(aggregator, e)
+            total += 1
+        else:
+            skipped = skipped + 1
+    return(total, skipped, aggregator)
+
+def get_all_dirs(input: TextIOWrapper) -> Tuple[int, int, aggregate.Aggregator]:
+    aggregator = aggregate.Aggregator()
     total = 0
     skipped = 0
     for line in input:
         total = total + 1
         try:
-            events.append(event(line))
+            add(aggregator, event(line))
         except:
             skipped = skipped + 1
-    return(total, skipped, events)
-
-def main(input: TextIOWrapper, dwl: TextIOWrapper) -> Dict[str, Any]:
+    return(total, skipped, aggregator)
+
+# Read the events from a cache, one add per distinct combination of values
+def get_cached(events: cache.Cache, dwl: Optional[FrozenSet[str]]) -> Tuple[int, int, aggregate.Aggregator]:
+    aggregator = aggregate.Aggregator()
+
+    added = 0
+    for values, n in events.rows(['process', 'user', 'computer', 'tenant']):
+        e = make_event((None,) + values)
+        if dwl is None or whitelist.normalize(e[1]) in dwl:
+            add(aggregator, e, n)
+            added += n
+    if dwl is None:
+        return(events.lines, events.lines - added, aggregator)
+    return(added, events.lines - added, aggregator)
+
+def main(input: TextIOWrapper, dwl: TextIOWrapper, cache_path: Optional[str] = None, workers: int = 1, state_path: Optional[str] = None) -> Dict[str, Any]:
     
-    if (input is not None) & (dwl is not None):
-        total, skipped, events = get_whitelisted(input, dwl)
+    dwl = whitelist.load(dwl)
+    if cache_path is not None:
+        total, skipped, aggregator = get_cached(cache.load(cache_path, input), dwl)
+    elif input is None:
+        total, skipped, aggregator = 0, 0, aggregate.Aggregator()
+    elif (input is not None) & (dwl is not None):
+        total, skipped, aggregator = aggregate.collect(get_whitelisted, input, workers, dwl)
     else:
-        total, skipped, events = get_all_dirs(input)
-
-    df = pd.DataFrame(data=events, columns=['timestamp', 'dir', 'user.name', 'system.computer', 'tenant'])
-    grouped = df.groupby(['dir'])
-    '''user.name processing'''
-    username_distinct_freq = df.groupby(['dir'])['user.name'].nunique().reset_index(name="uniq_usernames")[['dir', 'uniq_usernames']]
-    username_freq = grouped['user.name'].value_counts().reset_index(name="username_freq")
-    username_freq.loc[:, 'user.name'] = username_freq['user.name'] + ":" + username_freq['username_freq'].astype(str)
-    username_freq.drop(columns=['username_freq'])
-    username_list = username_freq.groupby(['dir'])['user.name'].agg(lambda x: list(x)).reset_index()
-    
-    usernames = pd.merge(username_list, username_distinct_freq, on=['dir'])
-
-    '''system.computer processing'''
-    system_distinct_freq = df.groupby(['dir'])['system.computer'].nunique().reset_index(name="uniq_systems")[['dir', 'uniq_systems']]
-    system_freq = grouped['system.computer'].value_counts().reset_index(name="system_freq")
-    system_freq.loc[:, 'system.computer'] = system_freq['system.computer'] + ":" + system_freq['system_freq'].astype(str)
-    system_freq.drop(columns=['system_freq'])
-    system_list = system_freq.groupby(['dir'])['system.computer'].agg(lambda x: list(x)).reset_index()
-    
-    systems = pd.merge(system_list, system_distinct_freq, on=['dir'])
-
-    '''tenant processing'''
-    tenant_distinct_freq = df.groupby(['dir'])['tenant'].nunique().reset_index(name="uniq_tenants")[['dir', 'uniq_tenants']]
-    tenant_freq = grouped['tenant'].value_counts().reset_index(name="tenant_freq")
-    tenant_freq.loc[:, 'tenant'] = tenant_freq['tenant'] + ":" + tenant_freq['tenant_freq'].astype(str)
-    tenant_freq.drop(columns=['tenant_freq'])
-    tenant_list = tenant_freq.groupby(['dir'])['tenant'].agg(lambda x: list(x)).reset_index()
-    
-    tenants = pd.merge(tenant_list, tenant_distinct_freq, on=['dir'])
-    
-    freq = df['dir'].value_counts(sort=True, ascending=True).reset_index().rename({'index': 'dir', 'dir': 'count'}, axis='columns')
-    freq = pd.merge(freq, usernames, on=['dir'], how='left')
-    freq = pd.merge(freq, systems, on=['dir'], how='left')
-    freq = pd.merge(freq, tenants, on=['dir'], how='left')
-    dirs = freq.to_dict(orient='records')
-    return {'meta': {'events': total, 'skipped': skipped}, 'process_dir_rarity': dirs}
+        total, skipped, aggregator = aggregate.collect(get_all_dirs, input, workers)
 
+    if state_path is not None:
+        total, skipped, aggregator = aggregate.accumulate(state_path, (total, skipped, aggregator), 'rare_process_dir_historical')
 
+    # Count, user.name, system.computer and tenant breakdowns of every dir
+    dirs = aggregate.records(aggregator, ['dir'])
+    return {'meta': {'events': total, 'skipped': skipped}, 'process_dir_rarity': dirs}
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='List process directories by rarity')
     parser.add_argument('--input', type=open, help='File containing event data')
     parser.add_argument('--dwl', type=open, help='File containing directory whitelist data')
+    parser.add_argument('--cache', metavar='PATH', help='Read events from the cache at PATH, building it from --input first if missing or stale')
+    parser.add_argument('--state', metavar='PATH', help='Merge the events into the report snapshot at PATH (created if missing) and report on the merged snapshot')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Parse the input in N worker processes')
+    stats.add_profile_argument(parser)
     args = parser.parse_args()
     
-    output =main(args.input, args.dwl)
-    print(json.dumps(output))
+    with stats.profile(args.profile):
+        output =main(args.input, args.dwl, args.cache, args.workers, args.state)
+        print(json.dumps(output))
 
 
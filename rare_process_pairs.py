@@ -1,56 +1,122 @@
 #!/usr/bin/env python3
 
 from io import TextIOWrapper
-import json
-from typing import Any, List, NewType, Optional, Tuple, Union
+from typing import Any, Dict, List, NewType, Optional, Tuple, Union
 import structlog
 import argparse
-import pandas as pd
+import numpy as np
+import checkpoint
+import engine
+import fields
+import pair_index
+import sink
+import stats
+import sketch
+import timestamps
 
 
 Process = NewType('Process', str)
 Parent = NewType('Parent', str)
 
 
-Event = Tuple[pd.Timestamp, Process, Parent]
+Event = Tuple[int, Process, Parent]
+
+
+decoder = fields.Decoder(fields.TIMESTAMP, fields.PROCESS, fields.PARENT)
 
 
 def event(input: Union[str, bytes]) -> Event:
-    e = json.loads(input)
-    data = e['_source']['data']['win']['eventdata']
-    process_name = data['newProcessName']
-    parent_name = data['parentProcessName']
-    timestamp = pd.to_datetime(e['_source']['@timestamp'])
-    return (timestamp, process_name, parent_name)
-    
+    return make_event(decoder.decode(input))
 
-def main(training_input: TextIOWrapper, input: TextIOWrapper) -> None:
 
-    log = structlog.get_logger(detector='rare_process_pairs')
+# Build an Event from the decoded fields of a line
+def make_event(values: Tuple[Any, ...]) -> Event:
+    timestamp, process_name, parent_name = values
+    return (timestamps.parse(timestamp), process_name, parent_name)
 
-    # Make set of all (process, parent) pairs seen in training data
-    seen = set()
 
-    # Load training data into model.
-    for line in training_input:
-        seen.add(event(line))
-    
+# Index the (process, parent) pairs seen in training data
+def train(training_input: TextIOWrapper) -> pair_index.PairIndex:
+    seen = pair_index.build([training_input])
+    log = structlog.get_logger(detector='rare_process_pairs')
     log.info('training data loaded', known_pairs=len(seen))
-   
-    # Check for unseen (process, parent) pairs in main input
-    for line in input:
-      
-        e = event(line)
-        if not seen.__contains__(e):
-            timestamp, process, parent = e
-            ts = timestamp.to_pydatetime().isoformat()
-            log.info('rare process pair detected', time=ts, process=process, parent=parent)
+    return seen
+
+
+# Known pairs from a prebuilt index, else from the training data, in a
+# Bloom filter with --approx
+def known(index: Optional[str], training_input: Optional[TextIOWrapper], approx: Optional[sketch.Approx] = None) -> Union[pair_index.PairIndex, pair_index.PairFilter]:
+    if index is not None:
+        seen = pair_index.load(index)
+        log = structlog.get_logger(detector='rare_process_pairs')
+        log.info('pair index loaded', known_pairs=len(seen))
+    else:
+        seen = train(training_input)
+    if approx is not None:
+        return pair_index.PairFilter(seen, approx.error)
+    return seen
+
+
+class Detector:
+    name = 'rare_process_pairs'
+    paths = decoder.paths
+
+    def __init__(self, seen: Union[pair_index.PairIndex, pair_index.PairFilter]) -> None:
+        self.seen: Union[pair_index.PairIndex, pair_index.PairFilter] = seen
+
+        # Settings a checkpoint of the detector must have been taken with:
+        # the saved index, or the number of pairs of an index built from
+        # training data
+        self.settings: Dict[str, Any] = {'index': getattr(seen, 'path', None), 'pairs': len(seen), 'approx': getattr(seen, 'error', None)}
+
+    # Check for unseen (process, parent) pairs
+    def observe(self, values: Tuple[Any, ...], input: Union[str, bytes]) -> List[engine.Record]:
+        timestamp, process, parent = make_event(values)
+        if (process, parent) not in self.seen:
+            ts = timestamps.isoformat(timestamp)
+            return [('rare process pair detected', {'time': ts, 'process': process, 'parent': parent})]
+        return []
+
+    # Check a batch of events at once, looking the pairs up together
+    def observe_batch(self, values: List[Tuple[Any, ...]], inputs: List[Union[str, bytes]]) -> List[engine.Record]:
+        known = self.seen.contains([(process, parent) for _, process, parent in values])
+        records: List[engine.Record] = []
+        for i in np.flatnonzero(~known).tolist():
+            timestamp, process, parent = make_event(values[i])
+            ts = timestamps.isoformat(timestamp)
+            records.append(('rare process pair detected', {'time': ts, 'process': process, 'parent': parent}))
+        return records
+
+    # Known pairs, for stats
+    def keys(self) -> int:
+        return len(self.seen)
+
+    def finish(self) -> List[engine.Record]:
+        return []
+
+
+def detector(args: argparse.Namespace) -> Detector:
+    return Detector(known(args.index, args.training, sketch.settings(args)))
+
+
+def main(training_input: Optional[TextIOWrapper], input: TextIOWrapper, workers: int = 1, state: Optional[str] = None, interval: float = checkpoint.INTERVAL, index: Optional[str] = None, approx: Optional[sketch.Approx] = None, batch_size: int = 1, alerts: Optional[sink.Sink] = None, stats: Optional[stats.Stats] = None) -> None:
+    engine.run(input, [Detector(known(index, training_input, approx))], workers, state, interval, batch_size, alerts, stats)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Flag unknown process pairs in event stream')
     parser.add_argument('--input', type=open, help='File containing event stream')
     parser.add_argument('--training', type=open, help='File containing training data')
+    parser.add_argument('--index', metavar='PATH', help='Pair index built from training data with pair_index.py, instead of --training')
+    parser.add_argument('--approx', action='store_true', help='Hold the known pairs in a Bloom filter, see sketch.py')
+    parser.add_argument('--error', type=float, default=sketch.ERROR, help='False positive rate of --approx')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Decode the input in N worker processes')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N', help='Check events in batches of N, for throughput over latency')
+    parser.add_argument('--state', metavar='PATH', help='Restore detector state from PATH at startup and checkpoint it there')
+    parser.add_argument('--checkpoint-interval', type=float, default=checkpoint.INTERVAL, metavar='SECONDS', help='Seconds between checkpoints of detector state')
+    sink.add_arguments(parser)
+    stats.add_arguments(parser)
     args = parser.parse_args()
 
-    main(args.training, args.input)
\ No newline at end of file
+    with stats.profile(args.profile):
+        main(args.training, args.input, args.workers, args.state, args.checkpoint_interval, args.index, sketch.settings(args), args.batch_size, sink.create(args), stats.create(args))
\ No newline at end of file
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
-from collections import defaultdict
+from collections import Counter
 from io import TextIOWrapper
 import json
-from typing import Any, Dict, List, NewType, Text, Tuple, Union
+from typing import Any, Dict, FrozenSet, NewType, Optional, Tuple, Union
 import argparse
 import pandas as pd
-import numpy as np
-from pandas.core.reshape.merge import merge
+import aggregate
+import cache
+import fields
+import stats
+import whitelist
 
 
 Process = NewType('Process', str)
@@ -15,157 +18,115 @@ Parent = NewType('Parent', str)
 UserTargetName = NewType('UserTargetName', str)
 SystemComputer = NewType('SystemComputer', str)
 Tenant = NewType('Tenant', str)
-ParentDir = NewType('ParentDir', str)
-ParentExe = NewType('ParentExe', str)
-ChildDir = NewType('ChildDir', str)
-ChildExe = NewType('ChildExe', str)
 
-Event = Tuple[pd.Timestamp, Process, Parent, UserTargetName, SystemComputer, Tenant, ParentDir, ParentExe, ChildDir, ChildExe]
+Event = Tuple[str, Process, Parent, UserTargetName, SystemComputer, Tenant]
+
+decoder = fields.Decoder(fields.TIMESTAMP, fields.PROCESS, fields.PARENT, fields.USER, fields.COMPUTER, fields.TENANT)
 
-def lists_to_dict(df):
-    df.loc[:, 'user.name'] = df[['user.name']] + df[['username_freq']]
-    return(df)
 
 def event(input: Union[str, bytes]) -> Event:
-    e = json.loads(input)
-    data = e['_source']['data']['win']['eventdata']
-    process_name = data['newProcessName'].replace("\\\\", "\\")
-    parent_name = data['parentProcessName'].replace("\\\\", "\\")
-    timestamp = pd.to_datetime(e['_source']['@timestamp'])
-    user_target_name = e['_source']['user']['target']['name']
-    system_computer = e['_source']['data']['win']['system']['computer']
-    tenant = e['_source']['tenant']
-    segments = data['parentProcessName'].split("\\")
-    parent_dir = "\\".join(segments[:-1]).replace("\\\\", "\\")
-    parent_exe = parent_name.split("\\")[-1]
-    segments = data['newProcessName'].split("\\")
-    child_dir = "\\".join(segments[:-1]).replace("\\\\", "\\")
-    child_exe = process_name.split("\\")[-1]
-    return (timestamp, process_name, parent_name, user_target_name, system_computer, tenant, parent_dir, parent_exe, child_dir, child_exe)
-
-def get_whitelisted(input: TextIOWrapper, pwl: TextIOWrapper, cwl: TextIOWrapper) -> Dict[str, Any]:
-    events: List[Event] = []
+    return make_event(decoder.decode(input))
 
-    count = 0
-    skipped = 0
-    for parent_wl in pwl:
-        for child_wl in cwl:
-            for line in input:
-                try:
-                    if (event(line)[1] == child_wl) | (event(line)[2] == parent_wl):
-                        events.append(event(line))
-                        count += 1
-                    else:
-                        skipped = skipped + 1
-                except:
-                    skipped = skipped + 1
-    return(count, skipped, events)
-
-def get_whitelisted_pw(input: TextIOWrapper, pwl: TextIOWrapper) -> Dict[str, Any]:
-    events: List[Event] = []
+def make_event(values: Tuple[Any, ...]) -> Event:
+    timestamp, new_process_name, parent_process_name, user_target_name, system_computer, tenant = values
+    process_name = new_process_name.replace("\\\\", "\\")
+    parent_name = parent_process_name.replace("\\\\", "\\")
+    return (timestamp, process_name, parent_name, user_target_name, system_computer, tenant)
 
-    count = 0
-    skipped = 0
-    for parent_wl in pwl:
-        for line in input:
-            try:
-                if event(line)[2] == parent_wl:
-                    events.append(event(line))
-                    count += 1
-                else:
-                    skipped = skipped + 1
-            except:
-                skipped = skipped + 1
-    return(count, skipped, events)
-
-def get_whitelisted_cw(input: TextIOWrapper, cwl: TextIOWrapper) -> Dict[str, Any]:
-    events: List[Event] = []
+# Directory and executable of a process path
+def split_path(name: str) -> Tuple[str, str]:
+    i = name.rfind("\\")
+    return (name[:i] if i >= 0 else '', name[i + 1:])
+
+def add(aggregator: aggregate.Aggregator, e: Event, n: int = 1) -> None:
+    _, process_name, parent_name, user_target_name, system_computer, tenant = e
+    aggregator.add((parent_name, process_name), (user_target_name, system_computer, tenant), n)
+
+# Keep only the events whose child is in the child whitelist or whose parent
+# is in the parent whitelist, in one pass
+def get_whitelisted(input: TextIOWrapper, pwl: Optional[FrozenSet[str]], cwl: Optional[FrozenSet[str]]) -> Tuple[int, int, aggregate.Aggregator]:
+    aggregator = aggregate.Aggregator()
 
     count = 0
     skipped = 0
-    for child_wl in cwl:
-        for line in input:
-            try:
-                if event(line)[1] == child_wl:
-                    events.append(event(line))
-                    count += 1
-                else:
-                    skipped = skipped + 1
-            except:
-                skipped = skipped + 1
-    return(count, skipped, events)
-
-def get_all_events(input: TextIOWrapper) -> Dict[str, Any]:
-    events: List[Event] = []
+    for line in input:
+        try:
+            e = event(line)
+        except:
+            skipped = skipped + 1
+            continue
+        if (cwl is not None and whitelist.normalize(e[1]) in cwl) or (pwl is not None and whitelist.normalize(e[2]) in pwl):
+            add(aggregator, e)
+            count += 1
+        else:
+            skipped = skipped + 1
+    return(count, skipped, aggregator)
+
+def get_all_events(input: TextIOWrapper) -> Tuple[int, int, aggregate.Aggregator]:
+    aggregator = aggregate.Aggregator()
 
     count = 0
     skipped = 0
     for line in input:
         try:
-            events.append(event(line))
+            add(aggregator, event(line))
             count += 1
         except:
             skipped = skipped + 1
-    return(count, skipped, events)
+    return(count, skipped, aggregator)
 
-def main(input: TextIOWrapper, pwl: TextIOWrapper, cwl: TextIOWrapper) -> Dict[str, Any]:
+# Read the events from a cache, one add per distinct combination of values
+def get_cached(events: cache.Cache, pwl: Optional[FrozenSet[str]], cwl: Optional[FrozenSet[str]]) -> Tuple[int, int, aggregate.Aggregator]:
+    aggregator = aggregate.Aggregator()
 
-    if (input is not None) & (pwl is not None) & (cwl is not None):
-        count, skipped, events = get_whitelisted(input, pwl, cwl)
-    elif (input is not None) & (pwl is not None):
-        count, skipped, events = get_whitelisted_pw(input, pwl)
-    elif (input is not None) & (cwl is not None):
-        count, skipped, events = get_whitelisted_cw(input, cwl)
+    count = 0
+    for values, n in events.rows(['process', 'parent', 'user', 'computer', 'tenant']):
+        e = make_event((None,) + values)
+        if (pwl is None and cwl is None) or (cwl is not None and whitelist.normalize(e[1]) in cwl) or (pwl is not None and whitelist.normalize(e[2]) in pwl):
+            add(aggregator, e, n)
+            count += n
+    return(count, events.lines - count, aggregator)
+
+def main(input: TextIOWrapper, pwl: TextIOWrapper, cwl: TextIOWrapper, result: Optional[str] = None, cache_path: Optional[str] = None, workers: int = 1, state_path: Optional[str] = None) -> Dict[str, Any]:
+
+    pwl = whitelist.load(pwl)
+    cwl = whitelist.load(cwl)
+    if cache_path is not None:
+        count, skipped, aggregator = get_cached(cache.load(cache_path, input), pwl, cwl)
+    elif input is None:
+        count, skipped, aggregator = 0, 0, aggregate.Aggregator()
+    elif (input is not None) & ((pwl is not None) | (cwl is not None)):
+        count, skipped, aggregator = aggregate.collect(get_whitelisted, input, workers, pwl, cwl)
     else:
-        count, skipped, events = get_all_events(input)
-
-    df = pd.DataFrame(data=events, columns=['timestamp', 'child', 'parent', 'user.name', 'system.computer', 'tenant', 'parent.dir', 'parent.exe', 'child.dir', 'child.exe'])
-    grouped = df.groupby(['parent', 'child'])
-    '''user.name processing'''
-    username_distinct_freq = df.groupby(['parent', 'child'])['user.name'].nunique().reset_index(name="uniq_usernames")[['parent', 'child', 'uniq_usernames']]
-    username_freq = grouped['user.name'].value_counts().reset_index(name="username_freq")
-    username_freq.loc[:, 'user.name'] = username_freq['user.name'] + ":" + username_freq['username_freq'].astype(str)
-    username_freq.drop(columns=['username_freq'])
-    username_list = username_freq.groupby(['parent', 'child'])['user.name'].agg(lambda x: list(x)).reset_index()
-    
-    usernames = pd.merge(username_list, username_distinct_freq, on=['parent', 'child'])
-
-    '''system.computer processing'''
-    system_distinct_freq = df.groupby(['parent', 'child'])['system.computer'].nunique().reset_index(name="uniq_systems")[['parent', 'child', 'uniq_systems']]
-    system_freq = grouped['system.computer'].value_counts().reset_index(name="system_freq")
-    system_freq.loc[:, 'system.computer'] = system_freq['system.computer'] + ":" + system_freq['system_freq'].astype(str)
-    system_freq.drop(columns=['system_freq'])
-    system_list = system_freq.groupby(['parent', 'child'])['system.computer'].agg(lambda x: list(x)).reset_index()
-    
-    systems = pd.merge(system_list, system_distinct_freq, on=['parent', 'child'])
-
-    '''tenant processing'''
-    tenant_distinct_freq = df.groupby(['parent', 'child'])['tenant'].nunique().reset_index(name="uniq_tenants")[['parent', 'child', 'uniq_tenants']]
-    tenant_freq = grouped['tenant'].value_counts().reset_index(name="tenant_freq")
-    tenant_freq.loc[:, 'tenant'] = tenant_freq['tenant'] + ":" + tenant_freq['tenant_freq'].astype(str)
-    tenant_freq.drop(columns=['tenant_freq'])
-    tenant_list = tenant_freq.groupby(['parent', 'child'])['tenant'].agg(lambda x: list(x)).reset_index()
-    
-    tenants = pd.merge(tenant_list, tenant_distinct_freq, on=['parent', 'child'])
-    
-    parent_freq = df['parent'].value_counts(sort=True).reset_index().rename({'index': 'parent', 'parent': 'parent_freq'}, axis='columns')
-    child_freq = df['child'].value_counts(sort=True).reset_index().rename({'index': 'child', 'child': 'child_freq'}, axis='columns')
-    pair_freq = df[['parent', 'child']].value_counts(sort=True).reset_index().rename({0: 'pair_freq'}, axis='columns')
-
-
-    freq = pd.merge(pair_freq, child_freq, on='child', how='left')
-    freq = pd.merge(freq, parent_freq, on='parent', how='left')
-    freq = pd.merge(freq, usernames, on=['parent', 'child'], how='left')
-    freq = pd.merge(freq, systems, on=['parent', 'child'], how='left')
-    freq = pd.merge(freq, tenants, on=['parent', 'child'], how='left')
-    freq = pd.merge(freq, df[['parent','child','parent.dir', 'parent.exe', 'child.dir', 'child.exe']], on=['parent', 'child'], how='left')
-    freq = freq.sort_values(['pair_freq', 'child_freq', 'parent_freq'])
-    
-    result = freq.to_dict(orient='records')
-    freq.to_json('result1.json')
-    return {'meta': {'events': count, 'skipped': skipped}, 'process_pair_rarity': result}
-
-
+        count, skipped, aggregator = aggregate.collect(get_all_events, input, workers)
+
+    if state_path is not None:
+        count, skipped, aggregator = aggregate.accumulate(state_path, (count, skipped, aggregator), 'rare_process_pairs_historical')
+
+    # Pair, child and parent frequencies
+    pair_freq = aggregator.counts()
+    child_freq: Counter = Counter()
+    parent_freq: Counter = Counter()
+    for (parent, child), n in pair_freq.items():
+        child_freq[child] += n
+        parent_freq[parent] += n
+
+    # One record per pair, with the user.name, system.computer and tenant
+    # breakdowns of the pair
+    breakdowns = aggregator.breakdowns()
+    records = []
+    for (parent, child), n in pair_freq.items():
+        parent_dir, parent_exe = split_path(parent)
+        child_dir, child_exe = split_path(child)
+        record = {'parent': parent, 'child': child, 'pair_freq': n, 'child_freq': child_freq[child], 'parent_freq': parent_freq[parent]}
+        aggregate.describe(record, breakdowns[(parent, child)])
+        record.update({'parent.dir': parent_dir, 'parent.exe': parent_exe, 'child.dir': child_dir, 'child.exe': child_exe})
+        records.append(record)
+    records.sort(key=lambda record: (record['pair_freq'], record['child_freq'], record['parent_freq']))
+
+    if result is not None:
+        pd.DataFrame(records).to_json(result)
+    return {'meta': {'events': count, 'skipped': skipped}, 'process_pair_rarity': records}
 
 
 if __name__ == '__main__':
@@ -173,7 +134,13 @@ if __name__ == '__main__':
     parser.add_argument('--input', type=open, help='File containing process event data')
     parser.add_argument('--pwl', type=open, help='File containing text file for whitelisting parent terms')
     parser.add_argument('--cwl', type=open, help='File containing text file for whitelisting child terms')
+    parser.add_argument('--result', metavar='PATH', help='Also write the ranked pairs to PATH as a pandas JSON table')
+    parser.add_argument('--cache', metavar='PATH', help='Read events from the cache at PATH, building it from --input first if missing or stale')
+    parser.add_argument('--state', metavar='PATH', help='Merge the events into the report snapshot at PATH (created if missing) and report on the merged snapshot')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Parse the input in N worker processes')
+    stats.add_profile_argument(parser)
     args = parser.parse_args()
 
-    output = main(args.input, args.pwl, args.cwl)
-    print(json.dumps(output))#.replace('\\\\', '\\') --removes extra slash however would invoke a json 
\ No newline at end of file
+    with stats.profile(args.profile):
+        output = main(args.input, args.pwl, args.cwl, args.result, args.cache, args.workers, args.state)
+        print(json.dumps(output))#.replace('\\\\', '\\') --removes extra slash however would invoke a json 
\ No newline at end of file
@@ -1,28 +1,41 @@
 #!/usr/bin/env python3
 
 from io import TextIOWrapper
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 import argparse
-import json
+import numpy as np
 import pandas as pd
-import structlog
+import batch
+import checkpoint
+import engine
+import expiry
+import fields
+import sink
+import stats
+import timestamps
 
 
-Event = Tuple[pd.Timestamp, str]
+Event = Tuple[int, str]
+
+
+decoder = fields.Decoder(fields.TIMESTAMP, fields.USER)
 
 
 # Parse a JSON encoded line into an Event
 def event(input: Union[str, bytes]) -> Event:
-    e = json.loads(input)
-    timestamp = pd.to_datetime(e['_source']['@timestamp'])
-    user = e['_source']['user']['target']['name']
-    return (timestamp, user)
+    return make_event(decoder.decode(input), input)
+
+
+# Build an Event from the decoded fields of a line
+def make_event(values: Tuple[Any, ...], input: Union[str, bytes]) -> Event:
+    timestamp, user = values
+    return (timestamps.parse(timestamp), user)
 
 
 class Model:
-    def __init__(self, size: pd.Timedelta):
-        self.seen: Dict[str, pd.Timestamp] = {}
-        self.size: pd.Timedelta = size
+    def __init__(self, size: pd.Timedelta, max_keys: Optional[int] = None):
+        self.seen: expiry.ExpiringDict = expiry.ExpiringDict(size.value, max_keys)
+        self.size: int = size.value
 
     def check(self, event: Event) -> bool:
 
@@ -39,55 +52,94 @@ class Model:
 
         return not seen
 
+    # Check a batch of events at once, None if it has to be checked one by one
+    def check_batch(self, times: np.ndarray, users: List[str]) -> Optional[np.ndarray]:
+        return batch.rare(self.seen, self.size, users, times)
+
 
 def duration(value: str) -> pd.Timedelta:
     return pd.to_timedelta(value)
 
 
-def main(skip: pd.Timedelta, window: pd.Timedelta, input: TextIOWrapper):
-
-    log = structlog.get_logger(detector='rare_users')
+class Detector:
+    name = 'rare_users'
+    paths = decoder.paths
 
-    # Track known users (seen within window)
-    model = Model(window)
+    def __init__(self, skip: pd.Timedelta, window: pd.Timedelta, max_keys: Optional[int] = None) -> None:
+        self.skip: int = skip.value
+        self.start: Optional[int] = None
 
-    n = 0
-    start: Optional[pd.Timestamp] = None
+        # Settings a checkpoint of the detector must have been taken with
+        self.settings: Dict[str, Any] = {'skip': skip.value, 'window': window.value, 'max_keys': max_keys}
 
-    # Loop over input
-    for line in input:
-        n = n + 1
+        # Track known users (seen within window)
+        self.model = Model(window, max_keys)
 
-        # Parse event
-        e = event(line)
+    def observe(self, values: Tuple[Any, ...], input: Union[str, bytes]) -> List[engine.Record]:
+        e = make_event(values, input)
         timestamp, user = e
 
-        if start == None:
-            start = timestamp + skip
+        if self.start == None:
+            self.start = timestamp + self.skip
 
         # Check against model
-        anomaly = model.check(e)
+        anomaly = self.model.check(e)
 
-        #log.debug('read event', logon_time=timestamp, user=user)
-        
         # Alert if necessary
-        if timestamp >= start:
-            if anomaly:
-                ts = timestamp.to_pydatetime().isoformat()
-                log.info('rare user detected', logon_time=ts, user=user)
+        if timestamp >= self.start and anomaly:
+            ts = timestamps.isoformat(timestamp)
+            return [('rare user detected', {'logon_time': ts, 'user': user})]
+        return []
+
+    # Check a batch of events at once, with the same alerts as observing them
+    # one by one (see batch.py)
+    def observe_batch(self, values: List[Tuple[Any, ...]], inputs: List[Union[str, bytes]]) -> List[engine.Record]:
+        times = timestamps.parse_many([timestamp for timestamp, _ in values]).view(np.int64)
+        users = [user for _, user in values]
+        anomalies = self.model.check_batch(times, users)
+        if anomalies is None:
+            return engine.observe_each(self, values, inputs)
+
+        if self.start == None:
+            self.start = int(times[0]) + self.skip
+
+        records: List[engine.Record] = []
+        for i in np.flatnonzero(anomalies & (times >= self.start)).tolist():
+            ts = timestamps.isoformat(int(times[i]))
+            records.append(('rare user detected', {'logon_time': ts, 'user': users[i]}))
+        return records
+
+    # Users remembered, for stats
+    def keys(self) -> int:
+        return len(self.model.seen)
+
+    def finish(self) -> List[engine.Record]:
+        return []
 
 
+def detector(args: argparse.Namespace) -> Detector:
+    return Detector(args.skip, args.window, args.max_keys)
 
 
+def main(skip: pd.Timedelta, window: pd.Timedelta, input: TextIOWrapper, max_keys: Optional[int] = None, workers: int = 1, state: Optional[str] = None, interval: float = checkpoint.INTERVAL, batch_size: int = 1, alerts: Optional[sink.Sink] = None, stats: Optional[stats.Stats] = None):
+    engine.run(input, [Detector(skip, window, max_keys)], workers, state, interval, batch_size, alerts, stats)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Flag rare users in event stream')
     parser.add_argument('--skip', type=duration, metavar='WINDOW', default='30 days', help='Skip detection for events in initial WINDOW')
     parser.add_argument('--window', type=duration, default='30 days', help='Remember users in the given window')
+    parser.add_argument('--max-keys', type=int, metavar='N', help='Remember at most N keys, evicting the least recently seen')
     parser.add_argument('--input', type=open, help='File containing event stream')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Decode the input in N worker processes')
+    parser.add_argument('--batch-size', type=int, default=1, metavar='N', help='Check events in batches of N, for throughput over latency')
+    parser.add_argument('--state', metavar='PATH', help='Restore detector state from PATH at startup and checkpoint it there')
+    parser.add_argument('--checkpoint-interval', type=float, default=checkpoint.INTERVAL, metavar='SECONDS', help='Seconds between checkpoints of detector state')
+    sink.add_arguments(parser)
+    stats.add_arguments(parser)
     args = parser.parse_args()
 
-    main(args.skip, args.window, args.input)
+    with stats.profile(args.profile):
+        main(args.skip, args.window, args.input, args.max_keys, args.workers, args.state, args.checkpoint_interval, args.batch_size, sink.create(args), stats.create(args))
 
 
@@ -1,42 +1,65 @@
 #!/usr/bin/env python3
 
 from io import TextIOWrapper
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, Dict, Optional, Tuple, Union
 import argparse
 import json
-import pandas as pd
-import os
+import aggregate
+import cache
+import fields
+import stats
 
 
-Event = Tuple[pd.Timestamp, str]
+Event = Tuple[str, str]
+
+
+decoder = fields.Decoder(fields.TIMESTAMP, fields.USER)
 
 
 # Parse a JSON encoded line into an Event
 def event(input: Union[str, bytes]) -> Event:
-    e = json.loads(input)
-    timestamp = pd.to_datetime(e['_source']['@timestamp'])
-    user = e['_source']['user']['target']['name']
-    return (timestamp, user)
+    return decoder.decode(input)
+
+
 
 
 
 
 
+# Read the events from a cache, one add per distinct user
+def get_cached(events: cache.Cache) -> Tuple[int, int, aggregate.Aggregator]:
+    aggregator = aggregate.Aggregator(dimensions=0)
+    added = 0
+    for (user,), n in events.rows(['user']):
+        aggregator.add(user, (), n)
+        added += n
+    return(events.lines, events.lines - added, aggregator)
 
 
-def main(input: TextIOWrapper) -> Dict[str, Any]:
-    events: List[Event] = []
+def get_all_users(input: TextIOWrapper) -> Tuple[int, int, aggregate.Aggregator]:
+    aggregator = aggregate.Aggregator(dimensions=0)
     total = 0
     skipped = 0
     for line in input:
         total = total + 1
         try:
-            events.append(event(line))
+            _, user = event(line)
+            aggregator.add(user)
         except:
             skipped = skipped + 1
-    df = pd.DataFrame(data=events, columns=['timestamp', 'user'])
-    freq = df['user'].value_counts(sort=True, ascending=True).reset_index().rename({'index': 'user', 'user': 'count'}, axis='columns')
-    users = freq.to_dict(orient='records')
+    return(total, skipped, aggregator)
+
+
+def main(input: TextIOWrapper, cache_path: Optional[str] = None, workers: int = 1, state_path: Optional[str] = None) -> Dict[str, Any]:
+    if cache_path is not None:
+        total, skipped, aggregator = get_cached(cache.load(cache_path, input))
+    elif input is None:
+        total, skipped, aggregator = 0, 0, aggregate.Aggregator(dimensions=0)
+    else:
+        total, skipped, aggregator = aggregate.collect(get_all_users, input, workers)
+    if state_path is not None:
+        total, skipped, aggregator = aggregate.accumulate(state_path, (total, skipped, aggregator), 'rare_users_historical')
+    users = aggregate.records(aggregator, ['user'])
     return {'meta': {'events': total, 'skipped': skipped}, 'user_rarity': users}
 
 
@@ -46,8 +69,13 @@ def main(input: TextIOWrapper) -> Dict[str, Any]:
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='List users in dataset by rarity')
     parser.add_argument('--input', type=open, help='File containing dataset')
+    parser.add_argument('--cache', metavar='PATH', help='Read events from the cache at PATH, building it from --input first if missing or stale')
+    parser.add_argument('--state', metavar='PATH', help='Merge the events into the report snapshot at PATH (created if missing) and report on the merged snapshot')
+    parser.add_argument('--workers', type=int, default=1, metavar='N', help='Parse the input in N worker processes')
+    stats.add_profile_argument(parser)
     args = parser.parse_args()
 
-    print(json.dumps(main(args.input)))
+    with stats.profile(args.profile):
+        print(json.dumps(main(args.input, args.cache, args.workers, args.state)))
 
 
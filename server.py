@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+from typing import Optional, Set, Tuple
+import argparse
+import asyncio
+import os
+import signal
+import structlog
+import checkpoint
+import engine
+import sink
+import stats
+
+
+'''
+Live ingestion for the streaming detectors.
+
+The server listens on a TCP port or a Unix socket for producers, e.g. a log
+shipper, writing events as newline delimited JSON in the same format as an
+--input file. Any number of producers may be connected at once, the lines
+of each are checked in the order it sent them, interleaved with those of
+the others as they arrive.
+
+Lines are put on a bounded queue, from which a single task feeds them to
+the detectors. When the detectors fall behind and the queue fills up,
+producers are no longer read from until there is room again, so they are
+held back by TCP flow control instead of the server buffering without
+bound. With --batch-size the detectors are handed whatever is queued, up
+to a batch, rather than waiting for a batch to fill.
+
+On SIGINT or SIGTERM the server stops accepting producers, hangs up on
+those still connected, checks what is already queued and writes a final
+checkpoint with --state. Checkpoints of a server carry no input offset, a
+restarted server restores the detectors and carries on with whatever
+producers send next.
+
+    ./server.py --detector rare_users --listen 127.0.0.1:5170
+'''
+
+
+log = structlog.get_logger()
+
+# Lines held in the queue before producers are held back
+QUEUE = 10000
+
+# Longest line accepted, a producer sending a longer one is hung up on
+LINE = 1024 * 1024
+
+
+class Server:
+
+    def __init__(self, engine: engine.Engine, queue_size: int = QUEUE, batch_size: int = 1, saved: Optional[checkpoint.Checkpoint] = None, max_line: int = LINE) -> None:
+        self.engine: engine.Engine = engine
+        self.queue_size: int = queue_size
+        self.batch_size: int = batch_size
+        self.saved: Optional[checkpoint.Checkpoint] = saved
+        self.max_line: int = max_line
+        self.producers: Set[asyncio.Task] = set()
+        self.path: Optional[str] = None
+
+    # Start listening on host and port, or on the Unix socket at path
+    async def listen(self, host: Optional[str] = None, port: Optional[int] = None, path: Optional[str] = None) -> asyncio.AbstractServer:
+        self.queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self.consumer: asyncio.Task = asyncio.ensure_future(self.consume())
+        if path is not None:
+            self.path = path
+            self.server = await asyncio.start_unix_server(self.receive, path, limit=self.max_line)
+        else:
+            self.server = await asyncio.start_server(self.receive, host, port, limit=self.max_line)
+        return self.server
+
+    # Queue the lines of a producer until it hangs up
+    async def receive(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self.producers.add(task)
+        peer = writer.get_extra_info('peername')
+        log.info('producer connected', peer=peer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self.queue.put(line)
+        except ValueError:
+            log.warning('line too long, hanging up', peer=peer, max_line=self.max_line)
+        except ConnectionError as e:
+            log.warning('producer connection failed', peer=peer, error=str(e))
+        finally:
+            self.producers.discard(task)
+            writer.close()
+            log.info('producer disconnected', peer=peer)
+
+    # Feed queued lines to the detectors, in batches of what is queued
+    async def consume(self) -> None:
+        while True:
+            lines = [await self.queue.get()]
+            while len(lines) < self.batch_size and not self.queue.empty():
+                lines.append(self.queue.get_nowait())
+
+            # Lines are marked done whatever happens to them, or close()
+            # would wait for them forever
+            try:
+                if self.batch_size <= 1:
+                    self.engine.feed(lines[0])
+                else:
+                    self.engine.dispatch_batch([self.engine.decode(line) for line in lines], lines)
+                if self.saved is not None:
+                    self.saved.tick(self.engine, 0)
+                if self.engine.stats is not None:
+                    self.engine.stats.tick(self.engine)
+            except Exception as e:
+                log.error('checking lines failed', error=repr(e), lines=len(lines))
+            finally:
+                for _ in lines:
+                    self.queue.task_done()
+
+            # Let producers run between batches even while the queue is full
+            await asyncio.sleep(0)
+
+    # Stop accepting producers, hang up on the connected ones, check the
+    # lines already queued and finish the detectors
+    async def close(self) -> None:
+        self.server.close()
+        producers = list(self.producers)
+        for task in producers:
+            task.cancel()
+        await asyncio.gather(*producers, return_exceptions=True)
+        await self.server.wait_closed()
+
+        await self.queue.join()
+        self.consumer.cancel()
+        await asyncio.gather(self.consumer, return_exceptions=True)
+
+        self.engine.finish()
+        if self.engine.alerts is not None:
+            self.engine.alerts.close()
+        if self.saved is not None:
+            self.saved.save(self.engine, 0)
+        if self.engine.stats is not None:
+            self.engine.stats.report(self.engine)
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+# Serve until SIGINT or SIGTERM
+async def serve(server: Server, host: Optional[str] = None, port: Optional[int] = None, path: Optional[str] = None) -> None:
+    listening = await server.listen(host, port, path)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    log.info('listening', addresses=[str(socket.getsockname()) for socket in listening.sockets])
+    await stop.wait()
+    log.info('shutting down', queued=server.queue.qsize(), producers=len(server.producers))
+    await server.close()
+
+
+# HOST:PORT of --listen
+def address(value: str) -> Tuple[str, int]:
+    host, _, port = value.rpartition(':')
+    if not host or not port.isdigit():
+        raise argparse.ArgumentTypeError('expected HOST:PORT, not ' + value)
+    return (host.strip('[]'), int(port))
+
+
+def main(args: argparse.Namespace) -> None:
+    e = engine.Engine(engine.create(list(dict.fromkeys(args.detector)), args), sink.create(args), stats.create(args))
+    saved = None
+    if args.state is not None:
+        saved = checkpoint.Checkpoint(args.state, None, args.checkpoint_interval)
+        saved.restore(e)
+
+    server = Server(e, args.queue_size, args.batch_size, saved, args.max_line)
+    host, port = args.listen if args.listen is not None else (None, None)
+    asyncio.run(serve(server, host, port, args.socket))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run several detectors over events sent by producers over a socket')
+    engine.add_arguments(parser)
+    listen = parser.add_mutually_exclusive_group(required=True)
+    listen.add_argument('--listen', type=address, metavar='HOST:PORT', help='Accept producers on a TCP port')
+    listen.add_argument('--socket', metavar='PATH', help='Accept producers on a Unix socket')
+    parser.add_argument('--queue-size', type=int, default=QUEUE, metavar='N', help='Hold back producers while N lines are waiting to be checked')
+    parser.add_argument('--max-line', type=int, default=LINE, metavar='BYTES', help='Hang up on producers sending lines longer than BYTES')
+    args = parser.parse_args()
+
+    with stats.profile(args.profile):
+        main(args)
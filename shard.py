@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+from collections import Counter
+from copy import deepcopy
+from io import TextIOWrapper
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+from zlib import crc32
+import argparse
+import multiprocessing
+import queue
+import traceback
+import structlog
+import chunks
+import engine
+import fields
+import sink
+import stats
+
+
+'''
+Sharded execution of the streaming detectors.
+
+Events are hash-partitioned by tenant (or computer) across a pool of worker
+processes. Each worker runs its own set of detectors per tenant, so model
+state is partitioned by tenant and the alerts do not depend on how many
+workers there are or which tenants share one: a user, process or logon
+history of one tenant has no bearing on the alerts of another. This is the
+difference from engine.py, whose models are shared by every tenant in the
+stream.
+
+The main process only finds the shard key of each line and hands the lines
+to the workers in chunks, through bounded queues so a busy worker holds
+the input back rather than lines piling up in memory. Alerts come back to
+the main process to be logged or written to --alerts, in input order for
+each shard (for each tenant with --batch-size). Events without the shard
+key are checked together, as the tenant None.
+
+    ./shard.py --detector rare_users --detector rare_process_name --by tenant --workers 8 --input events.json
+'''
+
+
+# Fields events can be sharded by
+KEYS = {'tenant': fields.TENANT, 'computer': fields.COMPUTER}
+
+# Lines handed to a worker at once
+CHUNK = 4096
+
+# Chunks waiting for each worker before the input is held back
+DEPTH = 4
+
+# Seconds to wait on a worker before checking it is still alive
+WAIT = 1.0
+
+
+Shard = Tuple[Optional[str], Union[str, bytes]]
+
+
+def shard_of(key: Optional[str], workers: int) -> int:
+    if key is None:
+        return 0
+    return crc32(key.encode('utf-8')) % workers
+
+
+# Check the lines a worker is handed with a set of detectors per key, and
+# send the alerts back, until handed None
+def work(index: int, detectors: List[Any], batch_size: int, lines: Any, results: Any) -> None:
+    try:
+        alerts = sink.Collector()
+        engines: Dict[Optional[str], engine.Engine] = {}
+
+        def engine_of(key: Optional[str]) -> engine.Engine:
+            if key not in engines:
+                engines[key] = engine.Engine(deepcopy(detectors), alerts)
+            return engines[key]
+
+        while True:
+            chunk: Optional[List[Shard]] = lines.get()
+            if chunk is None:
+                break
+            if batch_size <= 1:
+                for key, line in chunk:
+                    engine_of(key).feed(line)
+            else:
+                by_key: Dict[Optional[str], List[Union[str, bytes]]] = {}
+                for key, line in chunk:
+                    by_key.setdefault(key, []).append(line)
+                for key, keyed in by_key.items():
+                    e = engine_of(key)
+                    for start in range(0, len(keyed), batch_size):
+                        batch = keyed[start:start + batch_size]
+                        e.dispatch_batch([e.decode(line) for line in batch], batch)
+            results.put((index, alerts.take(), None))
+
+        for e in engines.values():
+            e.finish()
+        failed: Counter = Counter()
+        for e in engines.values():
+            failed.update(e.failed)
+        counts = (sum(e.events for e in engines.values()), sum(e.skipped for e in engines.values()), failed, len(engines))
+        results.put((index, alerts.take(), counts))
+    except BaseException:
+        results.put((index, [], traceback.format_exc()))
+
+
+class Runner:
+
+    def __init__(self, detectors: List[Any], workers: int, path: str = fields.TENANT, batch_size: int = 1, alerts: Optional[sink.Sink] = None) -> None:
+        self.workers: int = workers
+        self.decoder = fields.Decoder(path)
+        self.alerts: Optional[sink.Sink] = alerts
+        self.logs: Dict[str, Any] = {}
+
+        self.events: int = 0
+        self.skipped: int = 0
+        self.failed: Counter = Counter()
+        self.keys: int = 0
+        self.finished: Set[int] = set()
+
+        context = multiprocessing.get_context()
+        self.lines = [context.Queue(DEPTH) for _ in range(workers)]
+        self.results = context.Queue()
+        self.processes = [context.Process(target=work, args=(i, detectors, batch_size, self.lines[i], self.results), daemon=True) for i in range(workers)]
+        for process in self.processes:
+            process.start()
+
+    def key(self, line: Union[str, bytes]) -> Optional[str]:
+        try:
+            key = self.decoder.decode(line)[0]
+        except (KeyError, TypeError, ValueError):
+            return None
+        return key if isinstance(key, str) else None
+
+    # Hand the lines of an input to the workers by key, reporting alerts as
+    # they come back
+    def feed(self, input: Iterable[Union[str, bytes]]) -> None:
+        buffers: List[List[Shard]] = [[] for _ in range(self.workers)]
+        for line in input:
+            key = self.key(line)
+            shard = shard_of(key, self.workers)
+            buffers[shard].append((key, line))
+            if len(buffers[shard]) >= CHUNK:
+                self.put(shard, buffers[shard])
+                buffers[shard] = []
+                self.collect(block=False)
+        for shard, buffer in enumerate(buffers):
+            if buffer:
+                self.put(shard, buffer)
+
+    # Hand a chunk to a worker, reporting alerts while its queue is full, as
+    # a worker that died would otherwise leave the put waiting forever
+    def put(self, shard: int, chunk: Optional[List[Shard]]) -> None:
+        while True:
+            try:
+                self.lines[shard].put(chunk, timeout=WAIT)
+                return
+            except queue.Full:
+                self.collect(block=False)
+                self.check()
+
+    # Raise if a worker exited without finishing, with its traceback if it
+    # sent one back
+    def check(self) -> None:
+        for index, process in enumerate(self.processes):
+            if index not in self.finished and not process.is_alive():
+                self.collect(block=False)
+                if index not in self.finished:
+                    self.stop()
+                    raise RuntimeError('shard ' + str(index) + ' exited with code ' + str(process.exitcode))
+
+    # Stop every worker after one failed, dropping the chunks not yet sent
+    # to them so exiting does not wait on the queues
+    def stop(self) -> None:
+        for lines in self.lines:
+            lines.cancel_join_thread()
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join()
+
+    # Finish the detectors of every worker and report their last alerts
+    def finish(self) -> None:
+        for shard in range(self.workers):
+            self.put(shard, None)
+        while len(self.finished) < self.workers:
+            self.collect(block=True, timeout=WAIT)
+            self.check()
+        for process in self.processes:
+            process.join()
+        if self.alerts is not None:
+            self.alerts.close()
+
+    # Report the alerts that came back from the workers, waiting at most
+    # timeout for one with block
+    def collect(self, block: bool, timeout: Optional[float] = None) -> None:
+        while True:
+            try:
+                index, alerts, status = self.results.get(block=block, timeout=timeout)
+            except queue.Empty:
+                return
+            self.report(alerts)
+            if isinstance(status, str):
+                self.stop()
+                raise RuntimeError('shard ' + str(index) + ' failed:\n' + status)
+            if status is not None:
+                events, skipped, failed, keys = status
+                self.events = self.events + events
+                self.skipped = self.skipped + skipped
+                self.failed.update(failed)
+                self.keys = self.keys + keys
+                self.finished.add(index)
+            if block:
+                return
+
+    def report(self, alerts: List[sink.Alert]) -> None:
+        for detector, message, kv in alerts:
+            if self.alerts is not None:
+                self.alerts.emit(detector, message, kv)
+                continue
+            if detector not in self.logs:
+                self.logs[detector] = structlog.get_logger(detector=detector)
+            self.logs[detector].info(message, **sink.expand(kv))
+
+
+# Run detectors over an input, sharded by the field at path across workers
+def run(input: Iterable[Union[str, bytes]], detectors: List[Any], workers: int, path: str = fields.TENANT, batch_size: int = 1, alerts: Optional[sink.Sink] = None) -> Runner:
+    runner = Runner(detectors, workers, path, batch_size, alerts)
+    source = chunks.path_of(input)
+    if source is not None:
+        with open(source, 'rb') as file:
+            runner.feed(file)
+    else:
+        runner.feed(input)
+    runner.finish()
+    return runner
+
+
+def main(input: TextIOWrapper, names: List[str], args: argparse.Namespace) -> None:
+    run(input, engine.create(list(dict.fromkeys(names)), args), args.workers, KEYS[args.by], args.batch_size, sink.create(args))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run several detectors over one event stream, sharded by tenant or computer across worker processes')
+    engine.add_arguments(parser)
+    parser.add_argument('--by', choices=sorted(KEYS), default='tenant', help='Field to shard events by, each value gets its own detector state')
+    parser.add_argument('--input', type=open, help='File containing event stream')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), metavar='N', help='Check events in N worker processes')
+    args = parser.parse_args()
+    if args.state is not None:
+        parser.error('--state is not supported by sharded runs')
+    if args.stats_interval is not None or args.metrics is not None:
+        parser.error('--stats-interval and --metrics are not supported by sharded runs')
+
+    with stats.profile(args.profile):
+        main(args.input, args.detector, args)
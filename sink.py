@@ -0,0 +1,220 @@
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
+import argparse
+import json
+import queue
+import socket
+import sys
+import threading
+import time
+import structlog
+import fields
+
+
+'''
+Buffered output of alerts (--alerts).
+
+By default alerts are logged with structlog as they are found, formatting
+each one, raw event and all, on the detection path. With --alerts a Sink
+takes them instead: the detection path only puts an alert on a bounded
+queue, and a background thread formats alerts as JSON lines and writes
+them in batches every --flush-interval seconds (or as soon as a batch is
+full). When the writer falls behind and the queue fills up, detection
+waits for room rather than dropping alerts.
+
+Alerts go to one of
+
+- `-` for stdout,
+- a file path, appended to,
+- `unix:PATH` for a Unix socket, or
+- `tcp:HOST:PORT` for a TCP socket.
+
+A batch that fails to be written is dropped and counted in `dropped` (run
+statistics report it as alerts_dropped), and the next batch reopens the
+output, e.g. reconnects the socket, before writing. Writing carries on
+once the output is back, a failed write never stops the writer.
+
+Raw events in alerts are carried as Raw and only decoded when written. With
+--raw-field only the given fields of the raw event are written, by path,
+e.g. `--raw-field _source.@timestamp --raw-field _source.tenant`.
+'''
+
+
+log = structlog.get_logger()
+
+# Alerts held in the queue before detection waits for the writer
+QUEUE = 10000
+
+# Alerts written at once
+BATCH = 1000
+
+# Seconds between writes of whatever alerts are queued
+INTERVAL = 1.0
+
+
+# A raw event in an alert, decoded once it is written out
+class Raw:
+
+    def __init__(self, line: Union[str, bytes]) -> None:
+        self.line: Union[str, bytes] = line
+
+    def decode(self, decoder: Optional[fields.Decoder] = None) -> Dict[str, Any]:
+        if decoder is None:
+            return json.loads(self.line)
+        return decoder.project(self.line)
+
+
+# Fields of an alert with any raw event decoded
+def expand(kv: Dict[str, Any], decoder: Optional[fields.Decoder] = None) -> Dict[str, Any]:
+    return {key: value.decode(decoder) if isinstance(value, Raw) else value for key, value in kv.items()}
+
+
+Alert = Tuple[str, str, Dict[str, Any]]
+
+
+class Sink:
+
+    def __init__(self, output: BinaryIO, queue_size: int = QUEUE, interval: float = INTERVAL, raw_fields: Optional[List[str]] = None, close_output: bool = True, reopen: Optional[Callable[[], BinaryIO]] = None) -> None:
+        self.output: BinaryIO = output
+        self.close_output: bool = close_output
+        self.reopen: Optional[Callable[[], BinaryIO]] = reopen
+        self.interval: float = interval
+        self.decoder: Optional[fields.Decoder] = fields.Decoder(*raw_fields) if raw_fields else None
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.failed: bool = False
+        self.written: int = 0
+        self.dropped: int = 0
+        self.thread = threading.Thread(target=self.run, name='alerts', daemon=True)
+        self.thread.start()
+
+    def emit(self, detector: str, message: str, kv: Dict[str, Any]) -> None:
+        self.queue.put((detector, message, kv))
+
+    # Write out the queued alerts and stop the writer
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        if self.dropped:
+            log.error('alerts were dropped', dropped=self.dropped, written=self.written)
+        if self.close_output:
+            self.output.close()
+
+    def format(self, alert: Alert) -> bytes:
+        detector, message, kv = alert
+        record = {'event': message, 'detector': detector}
+        record.update(expand(kv, self.decoder))
+        return json.dumps(record, default=str).encode('utf-8') + b'\n'
+
+    # Write a batch of alerts. Nothing is raised, the writer thread carries
+    # on taking alerts off the queue so that detection never waits on it
+    # forever: an alert that can't be formatted, e.g. for a raw event that
+    # isn't JSON, is dropped, and so is a batch that can't be written, after
+    # which the next batch reopens the output first.
+    def write(self, batch: List[Alert]) -> None:
+        if not batch:
+            return
+        lines = []
+        for alert in batch:
+            try:
+                lines.append(self.format(alert))
+            except Exception as e:
+                self.dropped = self.dropped + 1
+                log.error('formatting alert failed, discarding it', detector=alert[0], message=alert[1], error=repr(e))
+        if self.failed:
+            self.reconnect()
+        try:
+            self.output.write(b''.join(lines))
+            self.output.flush()
+        except Exception as e:
+            self.dropped = self.dropped + len(lines)
+            self.failed = True
+            log.error('writing alerts failed, discarding the batch', error=repr(e), alerts=len(lines), dropped=self.dropped)
+            return
+        self.written = self.written + len(lines)
+        if self.failed:
+            self.failed = False
+            log.info('writing alerts resumed', dropped=self.dropped)
+
+    # Replace the output after a failed write, when it can be reopened
+    def reconnect(self) -> None:
+        if self.reopen is None:
+            return
+        try:
+            output = self.reopen()
+        except Exception as e:
+            log.error('reopening alerts output failed', error=repr(e))
+            return
+        if self.close_output:
+            try:
+                self.output.close()
+            except Exception:
+                pass
+        self.output = output
+
+    def run(self) -> None:
+        batch: List[Alert] = []
+        due = time.monotonic() + self.interval
+        while True:
+            try:
+                alert = self.queue.get(timeout=max(due - time.monotonic(), 0))
+            except queue.Empty:
+                alert = False
+            if alert is None:
+                self.write(batch)
+                return
+            if alert:
+                batch.append(alert)
+            if len(batch) >= BATCH or time.monotonic() >= due:
+                self.write(batch)
+                batch = []
+                due = time.monotonic() + self.interval
+
+
+# Alerts kept in order in memory, e.g. to hand them to another process
+class Collector:
+
+    def __init__(self) -> None:
+        self.alerts: List[Alert] = []
+
+    def emit(self, detector: str, message: str, kv: Dict[str, Any]) -> None:
+        self.alerts.append((detector, message, kv))
+
+    # Take the alerts collected so far
+    def take(self) -> List[Alert]:
+        alerts, self.alerts = self.alerts, []
+        return alerts
+
+    def close(self) -> None:
+        pass
+
+
+Alerts = Union[Sink, Collector]
+
+
+# Open the output of --alerts
+def connect(target: str) -> Tuple[BinaryIO, bool]:
+    if target == '-':
+        return (sys.stdout.buffer, False)
+    if target.startswith('unix:'):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(target[len('unix:'):])
+        return (connection.makefile('wb'), True)
+    if target.startswith('tcp:'):
+        host, _, port = target[len('tcp:'):].rpartition(':')
+        connection = socket.create_connection((host.strip('[]'), int(port)))
+        return (connection.makefile('wb'), True)
+    return (open(target, 'ab'), True)
+
+
+# Sink of the --alerts flags, None to log alerts with structlog
+def create(args: argparse.Namespace) -> Optional[Sink]:
+    if args.alerts is None:
+        return None
+    output, close_output = connect(args.alerts)
+    return Sink(output, args.alerts_queue, args.flush_interval, args.raw_field, close_output, lambda: connect(args.alerts)[0])
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--alerts', metavar='TARGET', help='Write alerts as JSON lines in the background to - (stdout), a file, unix:PATH or tcp:HOST:PORT instead of logging them')
+    parser.add_argument('--alerts-queue', type=int, default=QUEUE, metavar='N', help='Hold up detection while N alerts are waiting to be written')
+    parser.add_argument('--flush-interval', type=float, default=INTERVAL, metavar='SECONDS', help='Seconds between writes of queued alerts')
+    parser.add_argument('--raw-field', action='append', metavar='PATH', help='Only write this field of raw events in alerts, may be repeated')
@@ -0,0 +1,180 @@
+from array import array
+from hashlib import blake2b
+from math import ceil, log
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
+import numpy as np
+import expiry
+
+
+'''
+Approximate memory of keys for the rare_* detectors (--approx).
+
+Keys are hashed to 64 bits and kept in fixed size sketches instead of a
+dict of every distinct key:
+
+- BloomFilter answers "seen?" and may wrongly answer yes, with probability
+  `error`, but never wrongly answers no.
+- CountMin answers "seen how many times?" and may overcount, but never
+  undercounts. Used for "seen fewer than N times" thresholds.
+
+Either way a rare key may occasionally be missed, a common key is never
+reported as rare.
+
+Windowed keeps the sliding window semantics by partitioning the window in
+time: each partition covers 1/PARTITIONS of the window and gets its own
+sketch, and partitions are dropped once they fall out of the window (plus
+the same lateness allowance as the exact models). A key counts as seen if
+it is in a partition overlapping the window, so a key seen up to one
+partition span before the window still counts as seen.
+
+Memory, per partition sized for `capacity` distinct keys at false positive
+rate `error`:
+
+- BloomFilter: capacity * -ln(error) / ln(2)^2 bits, about 1.2 bytes per
+  key at error 0.01, 1.8 bytes at 0.001 and 2.4 bytes at 0.0001.
+- CountMin: as many 32-bit counters as the Bloom filter has bits, so 32
+  times the memory: 57.6 bytes per key at 0.001.
+
+A Windowed holds PARTITIONS + 1 or 2 sketches. With the defaults (capacity
+1,000,000 and error 0.001) that is up to 18 MB as Bloom filters, and up to
+575 MB as Count-Min sketches. Past `capacity` keys in a partition the error
+rate rises quickly, so size it for the busiest partition.
+'''
+
+
+PARTITIONS = 8
+CAPACITY = 1000000
+ERROR = 0.001
+
+
+# Settings of --approx
+class Approx(NamedTuple):
+    error: float = ERROR
+    capacity: int = CAPACITY
+    min_count: int = 1
+
+
+# Settings from the --approx, --error, --capacity and --min-count flags
+def settings(args: Any) -> Optional[Approx]:
+    if not args.approx:
+        return None
+    return Approx(args.error, getattr(args, 'capacity', CAPACITY), getattr(args, 'min_count', 1))
+
+
+def hash64(key: str) -> int:
+    return int.from_bytes(blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+# Rows and row width of a sketch for capacity keys at the given false
+# positive rate, as for a partitioned Bloom filter
+def dimensions(capacity: int, error: float) -> Tuple[int, int]:
+    cells = ceil(-capacity * log(error) / log(2) ** 2)
+    depth = max(1, round(cells / capacity * log(2)))
+    return (depth, ceil(cells / depth))
+
+
+# Cell of each row for a key, by double hashing the two halves of its hash
+def positions(key: int, depth: int, width: int) -> List[int]:
+    h1 = key & 0xffffffff
+    h2 = (key >> 32) | 1
+    return [row * width + (h1 + row * h2) % width for row in range(depth)]
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int, error: float = ERROR) -> None:
+        self.depth, self.width = dimensions(capacity, error)
+        self.bits: bytearray = bytearray(-(-self.depth * self.width // 8))
+
+    def add(self, key: int) -> None:
+        bits = self.bits
+        for i in positions(key, self.depth, self.width):
+            bits[i >> 3] |= 1 << (i & 7)
+
+    # Add an array of keys at once
+    def update(self, keys: np.ndarray) -> None:
+        keys = np.asarray(keys, dtype=np.uint64)
+        h1 = keys & np.uint64(0xffffffff)
+        h2 = (keys >> np.uint64(32)) | np.uint64(1)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        for row in range(self.depth):
+            cells = np.uint64(row * self.width) + (h1 + np.uint64(row) * h2) % np.uint64(self.width)
+            np.bitwise_or.at(bits, cells >> np.uint64(3), np.left_shift(1, cells & np.uint64(7)).astype(np.uint8))
+
+    def __contains__(self, key: int) -> bool:
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in positions(key, self.depth, self.width))
+
+    def count(self, key: int) -> int:
+        return 1 if key in self else 0
+
+
+class CountMin:
+
+    def __init__(self, capacity: int, error: float = ERROR) -> None:
+        self.depth, self.width = dimensions(capacity, error)
+        self.counts: array = array('I', bytes(4 * self.depth * self.width))
+
+    def add(self, key: int) -> None:
+        counts = self.counts
+        for i in positions(key, self.depth, self.width):
+            counts[i] += 1
+
+    def count(self, key: int) -> int:
+        counts = self.counts
+        return min(counts[i] for i in positions(key, self.depth, self.width))
+
+
+Sketch = Union[BloomFilter, CountMin]
+
+
+class Windowed:
+
+    def __init__(self, size: int, approx: Approx, partitions: int = PARTITIONS, lateness: int = expiry.LATENESS) -> None:
+        self.size: int = size
+        self.approx: Approx = approx
+        self.span: int = max(1, -(-size // partitions))
+        self.lateness: int = lateness
+        self.sketches: Dict[int, Sketch] = {}
+        self.watermark: Optional[int] = None
+
+    # Number of times key was seen in the window ending at timestamp (0 or 1
+    # without counting)
+    def count(self, key: int, timestamp: int) -> int:
+        first = (timestamp - self.size) // self.span
+        return sum(sketch.count(key) for partition, sketch in self.sketches.items() if partition >= first)
+
+    def add(self, key: int, timestamp: int) -> None:
+        if self.watermark is None or timestamp > self.watermark:
+            self.watermark = timestamp
+            self.expire()
+        partition = timestamp // self.span
+        if partition < self.oldest():
+            return
+        sketch = self.sketches.get(partition)
+        if sketch is None:
+            if self.approx.min_count > 1:
+                sketch = CountMin(self.approx.capacity, self.approx.error)
+            else:
+                sketch = BloomFilter(self.approx.capacity, self.approx.error)
+            self.sketches[partition] = sketch
+        sketch.add(key)
+
+    # Whether key was seen fewer than min_count times in the window ending at
+    # timestamp, before recording it
+    def rare(self, key: str, timestamp: int) -> bool:
+        k = hash64(key)
+        rare = self.count(k, timestamp) < self.approx.min_count
+        self.add(k, timestamp)
+        return rare
+
+    def oldest(self) -> int:
+        if self.watermark is None:
+            return 0
+        return (self.watermark - self.size - self.lateness) // self.span
+
+    # Drop the partitions that fell out of the window
+    def expire(self) -> None:
+        oldest = self.oldest()
+        for partition in [partition for partition in self.sketches if partition < oldest]:
+            del self.sketches[partition]
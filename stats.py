@@ -0,0 +1,193 @@
+from collections import Counter
+from contextlib import contextmanager
+from time import monotonic, perf_counter_ns
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+import argparse
+import cProfile
+import os
+import pstats
+import sys
+import structlog
+
+
+'''
+Run statistics of the streaming detectors (--stats-interval, --metrics) and
+profiling (--profile).
+
+An engine with a Stats counts events read, parse failures (lines that
+could not be decoded), and events each detector failed on and alerts per
+detector, along with the alerts the --alerts sink dropped for failed
+writes, and times each stage of the hot path:
+
+- input: waiting for the next line, reading it and, without --workers,
+  decoding it,
+- parse: decoding lines (part of input, unless decoded by workers),
+- detect: each detector's model update and check, per detector,
+- emit: handing alerts to the log or the --alerts sink,
+- checkpoint: writing --state checkpoints.
+
+The rare_* models update and check a key in a single dict operation, so
+both are timed together as the detector's detect stage. Detectors that
+provide `keys()` also report how many keys their model holds (Model.seen,
+Window.data), the figure to size --window and --max-keys by.
+
+Every --stats-interval seconds the figures are logged as a structlog
+record, and written to --metrics in the Prometheus text format, e.g. for
+node_exporter's textfile collector. Without either flag nothing is timed.
+
+--profile runs the whole script under cProfile and writes the profile to
+the given path, to be read with pstats or snakeviz; the 20 most expensive
+functions by cumulative time are printed to stderr as well, so the output of
+the historical scripts is left alone.
+'''
+
+
+log = structlog.get_logger()
+
+# Seconds between stats records
+INTERVAL = 60.0
+
+# Events between looking at the clock
+TICK = 1024
+
+
+class Stats:
+
+    def __init__(self, interval: Optional[float] = INTERVAL, metrics: Optional[str] = None) -> None:
+        self.interval: Optional[float] = interval
+        self.metrics: Optional[str] = metrics
+        self.due: float = monotonic() + (interval or INTERVAL)
+        self.checked: int = 0
+
+        self.events: int = 0
+        self.failures: int = 0
+        self.detector_failures: Counter = Counter()
+        self.alerts: Counter = Counter()
+        self.dropped: int = 0
+        self.keys: Dict[str, int] = {}
+
+        # Nanoseconds spent per stage, and per detector in the detect stage
+        self.stages: Counter = Counter()
+        self.detect: Counter = Counter()
+
+    # Add the time since start to a stage, and return the time now
+    def time(self, stage: str, start: int) -> int:
+        now = perf_counter_ns()
+        self.stages[stage] += now - start
+        return now
+
+    def time_detector(self, name: str, start: int) -> int:
+        now = perf_counter_ns()
+        self.detect[name] += now - start
+        return now
+
+    # Items of an iterator, timing the wait for each as stage
+    def timed(self, stage: str, iterator: Iterable[Any]) -> Iterator[Any]:
+        iterator = iter(iterator)
+        while True:
+            start = perf_counter_ns()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.time(stage, start)
+            yield item
+
+    # Report every interval, looking at the clock every TICK events
+    def tick(self, engine: Any) -> None:
+        self.events = engine.events
+        if engine.events - self.checked < TICK:
+            return
+        self.checked = engine.events
+        if monotonic() >= self.due:
+            self.report(engine)
+
+    def report(self, engine: Any) -> None:
+        self.events = engine.events
+        self.failures = engine.skipped
+        self.detector_failures = Counter(engine.failed)
+        self.dropped = getattr(engine.alerts, 'dropped', 0)
+        for detector in engine.detectors:
+            keys = getattr(detector, 'keys', None)
+            count = keys() if keys is not None else None
+            if count is not None:
+                self.keys[detector.name] = count
+        if self.interval is not None:
+            log.info('stats', **self.record())
+        if self.metrics is not None:
+            self.write(self.metrics)
+        self.due = monotonic() + (self.interval or INTERVAL)
+
+    def record(self) -> Dict[str, Any]:
+        return {
+            'events': self.events,
+            'parse_failures': self.failures,
+            'detector_failures': dict(self.detector_failures),
+            'alerts': dict(self.alerts),
+            'alerts_dropped': self.dropped,
+            'keys': dict(self.keys),
+            'seconds': {stage: round(ns / 1e9, 3) for stage, ns in self.stages.items()},
+            'detect_seconds': {name: round(ns / 1e9, 3) for name, ns in self.detect.items()},
+        }
+
+    # The figures in the Prometheus text format
+    def prometheus(self) -> str:
+        lines: List[str] = []
+
+        def metric(name: str, kind: str, help: str, samples: List[Any]) -> None:
+            lines.append('# HELP ' + name + ' ' + help)
+            lines.append('# TYPE ' + name + ' ' + kind)
+            for labels, value in samples:
+                label = ','.join('{}="{}"'.format(k, v) for k, v in labels.items())
+                lines.append(name + ('{' + label + '}' if label else '') + ' ' + repr(value))
+
+        metric('detector_events_total', 'counter', 'Events read', [({}, self.events)])
+        metric('detector_parse_failures_total', 'counter', 'Lines that could not be decoded', [({}, self.failures)])
+        metric('detector_failures_total', 'counter', 'Events a detector failed on', [({'detector': name}, n) for name, n in sorted(self.detector_failures.items())])
+        metric('detector_alerts_total', 'counter', 'Alerts raised', [({'detector': name}, n) for name, n in sorted(self.alerts.items())])
+        metric('detector_alerts_dropped_total', 'counter', 'Alerts the sink failed to write', [({}, self.dropped)])
+        metric('detector_keys', 'gauge', 'Keys held by the model', [({'detector': name}, n) for name, n in sorted(self.keys.items())])
+        samples = [({'stage': stage}, ns / 1e9) for stage, ns in sorted(self.stages.items())]
+        samples.extend(({'stage': 'detect', 'detector': name}, ns / 1e9) for name, ns in sorted(self.detect.items()))
+        metric('detector_stage_seconds_total', 'counter', 'Seconds spent per stage', samples)
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path: str) -> None:
+        partial = path + '.partial'
+        with open(partial, 'w') as output:
+            output.write(self.prometheus())
+        os.replace(partial, path)
+
+
+# Stats of the --stats-interval and --metrics flags, None if neither is given
+def create(args: argparse.Namespace) -> Optional[Stats]:
+    if args.stats_interval is None and args.metrics is None:
+        return None
+    return Stats(args.stats_interval, args.metrics)
+
+
+# Run the enclosed code under cProfile if path is given, writing the profile
+# to path
+@contextmanager
+def profile(path: Optional[str]) -> Iterator[None]:
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--stats-interval', type=float, metavar='SECONDS', help='Log run statistics every SECONDS, see stats.py')
+    parser.add_argument('--metrics', metavar='PATH', help='Write run statistics to PATH in the Prometheus text format (every --stats-interval, default 60s)')
+    add_profile_argument(parser)
+
+
+def add_profile_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--profile', metavar='PATH', help='Run under cProfile and write the profile to PATH')
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+import argparse
+import json
+import numpy as np
+
+
+'''
+Seeded synthetic event streams, for benchmarks and tests.
+
+Generates Elasticsearch hits of 4624 (logon) events in the format shown in
+the README, and of 4688 (process creation) events modeled on
+test-4688-2021-v2.json, in time order. The same settings and seed always
+give the same stream.
+
+Users, hosts and process paths are drawn from fixed pools with Zipf-like
+weights, so a few are common and many are seldom seen, and each event has a
+`rare` chance of a user (4624) or process path (4688) never seen before.
+Events arrive as a Poisson stream spread over `days` days, except that a
+`burstiness` fraction of them arrive in bursts a hundred times as dense.
+
+    ./synth.py --kind 4688 --events 1000000 --tenants 20 --output events.json
+'''
+
+
+class Settings(NamedTuple):
+    events: int = 10000
+    users: int = 1000
+    hosts: int = 200
+    tenants: int = 5
+    paths: int = 500
+    days: float = 14.0
+    burstiness: float = 0.2
+    rare: float = 0.001
+    seed: int = 0
+    start: str = '2021-05-13T00:00:00'
+
+
+# Events generated at once
+BLOCK = 100000
+
+# Gaps between events in a burst, relative to the mean
+BURST = 0.01
+
+WEEKDAYS = ['Thu', 'Fri', 'Sat', 'Sun', 'Mon', 'Tue', 'Wed']
+
+DAY = 24 * 3600 * 1000000000
+
+PARENTS = ['C:\\\\Windows\\\\System32\\\\svchost.exe', 'C:\\\\Windows\\\\System32\\\\services.exe', 'C:\\\\Windows\\\\explorer.exe', 'C:\\\\Windows\\\\System32\\\\cmd.exe']
+
+DIRS = ['C:\\\\Windows\\\\System32', 'C:\\\\Windows\\\\System32\\\\wbem', 'C:\\\\Program Files\\\\App{:03d}', 'C:\\\\Program Files (x86)\\\\App{:03d}\\\\bin', 'C:\\\\Users\\\\user{:05d}\\\\AppData\\\\Local\\\\Tool{:03d}']
+
+
+def weights(n: int) -> np.ndarray:
+    w = 1.0 / np.arange(1, n + 1) ** 1.1
+    return w / w.sum()
+
+
+# Names of the users, hosts, tenants and process paths to draw from
+def pools(settings: Settings) -> Tuple[List[str], List[str], List[str], List[str]]:
+    users = ['user{:05d}'.format(i) if i % 10 else 'DTM{:05d}$'.format(i) for i in range(settings.users)]
+    hosts = ['DTM{:05d}.corp.example.com'.format(i) for i in range(settings.hosts)]
+    tenants = ['tenant{:02d}'.format(i) for i in range(settings.tenants)]
+    paths = [DIRS[i % len(DIRS)].format(i % 97, i % 13) + '\\\\proc{:04d}.exe'.format(i) for i in range(settings.paths)]
+    return (users, hosts, tenants, paths)
+
+
+# Timestamps of the events, epoch nanoseconds, in blocks
+def times(settings: Settings, rng: np.random.Generator) -> Iterator[np.ndarray]:
+    mean = settings.days * DAY / max(settings.events, 1)
+    # Scale the gaps so the stream still spans `days` on average
+    mean = mean / (1 - settings.burstiness + settings.burstiness * BURST)
+    now = float(np.datetime64(settings.start, 'ns').astype(np.int64))
+    for start in range(0, settings.events, BLOCK):
+        n = min(BLOCK, settings.events - start)
+        gaps = rng.exponential(mean, n)
+        gaps[rng.random(n) < settings.burstiness] *= BURST
+        stamps = now + np.cumsum(gaps)
+        now = float(stamps[-1])
+        yield stamps.astype(np.int64)
+
+
+# Draw n names from a pool, with a `rare` chance of a name never seen before
+def draw(rng: np.random.Generator, pool: List[str], n: int, rare: float, unseen: Iterator[str]) -> List[str]:
+    names = [pool[i] for i in rng.choice(len(pool), n, p=weights(len(pool)))]
+    for i in np.flatnonzero(rng.random(n) < rare).tolist():
+        names[i] = next(unseen)
+    return names
+
+
+def fresh(prefix: str) -> Iterator[str]:
+    i = 0
+    while True:
+        yield prefix.format(i)
+        i = i + 1
+
+
+def stamps(block: np.ndarray) -> Tuple[List[str], List[str]]:
+    iso = np.datetime_as_string(block.astype('datetime64[ns]'), unit='ms')
+    days = ((block // DAY) % 7).tolist()
+    return ([t + 'Z' for t in iso.tolist()], [WEEKDAYS[d] for d in days])
+
+
+# 4624 logon events
+def logons(settings: Settings) -> Iterator[str]:
+    rng = np.random.default_rng(settings.seed)
+    users, hosts, tenants, _ = pools(settings)
+    unseen = fresh('rare.user{:07d}')
+    n = 0
+    for block in times(settings, rng):
+        size = len(block)
+        ts, days = stamps(block)
+        user = draw(rng, users, size, settings.rare, unseen)
+        host = rng.choice(len(hosts), size).tolist()
+        tenant = rng.choice(len(tenants), size).tolist()
+        for i in range(size):
+            computer = json.dumps(hosts[host[i]].split('.')[0])
+            yield ('{"_index":"td-ml-hids-4624-2021","_type":"_doc","_id":"%020x","_score":1,"_source":{"process":{"name":"C:\\\\\\\\Windows\\\\\\\\System32\\\\\\\\services.exe"},'
+                   '"event":{"module":"ml-hids","code":"4624","action":"An account was successfully logged on."},"input":{},"key":%s,"count":1,"day":"%s",'
+                   '"user":{"target":{"name":%s}},"agent":{"name":%s,"os_full":"Microsoft Windows 10 Enterprise"},"@timestamp":"%s","tenant":"%s",'
+                   '"data":{"win":{"eventdata":{"logonType":"5"},"system":{"computer":%s}}},"hour":"%s"}}\n') % (
+                n, json.dumps(tenants[tenant[i]] + '_' + user[i] + '_' + ts[i]), days[i], json.dumps(user[i]), computer, ts[i], tenants[tenant[i]], computer, ts[i][11:13])
+            n = n + 1
+
+
+# 4688 process creation events
+def processes(settings: Settings) -> Iterator[str]:
+    rng = np.random.default_rng(settings.seed)
+    users, hosts, tenants, paths = pools(settings)
+    unseen = fresh('C:\\\\Users\\\\Public\\\\rare{:07d}\\\\dropped.exe')
+    n = 0
+    for block in times(settings, rng):
+        size = len(block)
+        ts, days = stamps(block)
+        process = draw(rng, paths, size, settings.rare, unseen)
+        parent = [PARENTS[i] for i in rng.choice(len(PARENTS), size, p=weights(len(PARENTS)))]
+        user = draw(rng, users, size, 0.0, unseen)
+        host = rng.choice(len(hosts), size).tolist()
+        tenant = rng.choice(len(tenants), size).tolist()
+        for i in range(size):
+            yield ('{"_index":"td-ml-hids-4688-2021","_type":"_doc","_id":"%020x","_score":0,"_source":{"count":1,"day":"%s","user":{"target":{"name":%s}},'
+                   '"agent":{},"process":{},"key":%s,"@version":"1","data":{"win":{"eventdata":{"parentProcessName":%s,"newProcessName":%s},'
+                   '"system":{"computer":%s}}},"hour":"%s","input":{},"tags":["BL"],"tenant":"%s",'
+                   '"event":{"action":"A new process has been created.","module":"ml-hids","code":"4688"},"@timestamp":"%s"}}\n') % (
+                n, days[i], json.dumps(user[i]), json.dumps(tenants[tenant[i]] + '_' + user[i] + '_' + ts[i]), json.dumps(parent[i]), json.dumps(process[i]),
+                json.dumps(hosts[host[i]]), ts[i][11:13], tenants[tenant[i]], ts[i])
+            n = n + 1
+
+
+KINDS = {'4624': logons, '4688': processes}
+
+
+def generate(kind: str, settings: Settings) -> Iterator[str]:
+    return KINDS[kind](settings)
+
+
+def write(path: str, kind: str, settings: Settings) -> None:
+    with open(path, 'w') as output:
+        output.writelines(generate(kind, settings))
+
+
+def settings(args: argparse.Namespace, events: Optional[int] = None) -> Settings:
+    return Settings(events if events is not None else args.events, args.users, args.hosts, args.tenants, args.paths, args.days, args.burstiness, args.rare, args.seed, args.start)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = Settings()
+    parser.add_argument('--users', type=int, default=defaults.users, metavar='N', help='Distinct users, besides rare ones')
+    parser.add_argument('--hosts', type=int, default=defaults.hosts, metavar='N', help='Distinct computers')
+    parser.add_argument('--tenants', type=int, default=defaults.tenants, metavar='N', help='Distinct tenants')
+    parser.add_argument('--paths', type=int, default=defaults.paths, metavar='N', help='Distinct process paths, besides rare ones')
+    parser.add_argument('--days', type=float, default=defaults.days, help='Days the events are spread over')
+    parser.add_argument('--burstiness', type=float, default=defaults.burstiness, metavar='FRACTION', help='Fraction of events arriving in bursts')
+    parser.add_argument('--rare', type=float, default=defaults.rare, metavar='FRACTION', help='Fraction of events with a user (4624) or process (4688) never seen before')
+    parser.add_argument('--seed', type=int, default=defaults.seed, help='Random seed')
+    parser.add_argument('--start', default=defaults.start, metavar='TIMESTAMP', help='Time of the start of the stream')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic 4624 or 4688 events')
+    parser.add_argument('--kind', choices=sorted(KINDS), required=True, help='Event code to generate')
+    parser.add_argument('--events', type=int, default=Settings().events, metavar='N', help='Number of events')
+    parser.add_argument('--output', required=True, help='File to write the events to')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    write(args.output, args.kind, settings(args))
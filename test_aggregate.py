@@ -0,0 +1,92 @@
+from collections import Counter
+from typing import Any, Dict, List, Tuple
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import aggregate
+
+COLUMNS = ['name', 'user.name', 'system.computer', 'tenant']
+
+rng = np.random.default_rng(1)
+events: List[Tuple[str, str, str, str]] = [
+    ('proc%d.exe' % rng.zipf(1.5), 'user%d' % rng.integers(8), 'host%d' % rng.integers(5), 'tenant%d' % rng.integers(3))
+    for _ in range(2000)
+]
+
+
+def aggregator_of(events: List[Tuple[str, str, str, str]]) -> aggregate.Aggregator:
+    aggregator = aggregate.Aggregator()
+    for name, user, computer, tenant in events:
+        aggregator.add(name, (user, computer, tenant))
+    return aggregator
+
+
+# The report as the historical scripts built it with pandas, by name
+def pandas_report(events: List[Tuple[str, str, str, str]]) -> Dict[str, Dict[str, Any]]:
+    df = pd.DataFrame(data=events, columns=COLUMNS)
+    report: Dict[str, Dict[str, Any]] = {}
+    for name, count in df['name'].value_counts().items():
+        report[name] = {'name': name, 'count': int(count)}
+    for column, distinct in aggregate.DIMENSIONS:
+        for name, n in df.groupby('name')[column].nunique().items():
+            report[name][distinct] = int(n)
+        for (name, value), n in df.groupby('name')[column].value_counts().items():
+            report[name].setdefault(column, Counter())[value] = int(n)
+    return report
+
+
+# A record with its value:count lists as Counters, which the pandas report
+# orders differently among equal counts
+def comparable(record: Dict[str, Any]) -> Dict[str, Any]:
+    result = dict(record)
+    for column, _ in aggregate.DIMENSIONS:
+        result[column] = Counter({entry.rsplit(':', 1)[0]: int(entry.rsplit(':', 1)[1]) for entry in record[column]})
+    return result
+
+
+def test_records():
+    records = aggregate.records(aggregator_of(events), ['name'])
+    assert({record['name']: comparable(record) for record in records} == pandas_report(events))
+
+    # Rarest first, most frequent values first
+    counts = [record['count'] for record in records]
+    assert(counts == sorted(counts))
+    for record in records:
+        for column, _ in aggregate.DIMENSIONS:
+            n = [int(entry.rsplit(':', 1)[1]) for entry in record[column]]
+            assert(n == sorted(n, reverse=True))
+
+
+def test_pairs():
+    aggregator = aggregate.Aggregator()
+    for name, user, computer, tenant in events:
+        aggregator.add((name, 'parent.exe'), (user, computer, tenant))
+    records = aggregate.records(aggregator, ['process', 'parent'])
+    assert({(record['process'], record['parent']): record['count'] for record in records} == {(name, 'parent.exe'): count for name, count in Counter(e[0] for e in events).items()})
+
+
+def test_combine():
+    parts = [(1000, 1, aggregator_of(events[:1000])), (1000, 2, aggregator_of(events[1000:]))]
+    total, skipped, merged = aggregate.combine(parts)
+    assert((total, skipped) == (2000, 3))
+    assert(merged.combinations == aggregator_of(events).combinations)
+    assert(list(merged.counts()) == list(aggregator_of(events).counts()))
+
+
+def test_snapshots():
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, 'day%d.state' % day) for day in range(2)]
+        aggregate.save(paths[0], (1000, 0, aggregator_of(events[:1000])), 'names')
+        aggregate.accumulate(paths[1], (1000, 0, aggregator_of(events[1000:])), 'names')
+        report, (total, skipped, merged) = aggregate.merge(paths)
+        assert(report == 'names')
+        assert(total == 2000)
+        assert(merged.combinations == aggregator_of(events).combinations)
+
+        aggregate.save(paths[1], (1, 0, aggregate.Aggregator()), 'users')
+        try:
+            aggregate.merge(paths)
+            assert(False)
+        except ValueError:
+            pass
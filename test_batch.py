@@ -0,0 +1,49 @@
+from typing import List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import batch
+import rare_users
+
+HOUR = 3600 * 10 ** 9
+WINDOW = pd.Timedelta(hours=10)
+
+rng = np.random.default_rng(1)
+# Events in order but for jitter within the lateness allowance, over a few
+# windows, with keys both rare and common
+times: np.ndarray = np.sort(rng.integers(0, 50 * HOUR, 5000)) + rng.integers(0, HOUR // 2, 5000)
+keys: List[str] = ['user%d' % rng.zipf(1.3) for _ in range(5000)]
+
+
+def sequential(model: rare_users.Model, times: np.ndarray, keys: List[str]) -> List[bool]:
+    return [model.check((int(t), key)) for t, key in zip(times.tolist(), keys)]
+
+
+def state(model: rare_users.Model) -> List[Tuple[str, int]]:
+    return [(key, model.seen[key]) for key in model.seen]
+
+
+def test_rare():
+    for size in [1, 7, 64, 1000]:
+        one = rare_users.Model(WINDOW)
+        many = rare_users.Model(WINDOW)
+        for start in range(0, len(keys), size):
+            expected = sequential(one, times[start:start + size], keys[start:start + size])
+            result: Optional[np.ndarray] = batch.rare(many.seen, many.size, keys[start:start + size], times[start:start + size])
+            assert(result is not None)
+            assert(result.tolist() == expected)
+            assert(state(many) == state(one))
+            assert(many.seen.watermark == one.seen.watermark)
+    assert(batch.rare(many.seen, many.size, [], times[:0]).tolist() == [])
+
+
+def test_one_by_one():
+    model = rare_users.Model(WINDOW, max_keys=100)
+    assert(batch.rare(model.seen, model.size, keys[:10], times[:10]) is None)
+
+    # Late beyond the allowance, events are checked one by one
+    model = rare_users.Model(WINDOW)
+    sequential(model, times[:1000], keys[:1000])
+    late = times[1000:1010].copy()
+    assert(batch.rare(model.seen, model.size, keys[1000:1010], late) is not None)
+    late[5] = model.seen.watermark - model.seen.lateness - 1
+    assert(batch.rare(model.seen, model.size, keys[1010:1020], late) is None)
@@ -0,0 +1,64 @@
+from collections import Counter
+from typing import List
+import json
+import os
+import tempfile
+import cache
+import synth
+import timestamps
+
+lines: List[str] = list(synth.processes(synth.Settings(events=500, seed=1)))
+
+
+def write(path: str, lines: List[str], mode: str = 'w') -> None:
+    with open(path, mode) as output:
+        output.writelines(lines)
+
+
+def test_columns():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        write(path, lines + ['not json\n', '{"_source": {}}\n'])
+        with open(path) as input:
+            c = cache.load(os.path.join(directory, 'events.npz'), input)
+        assert(c.lines == len(lines) + 2)
+
+        sources = [json.loads(line)['_source'] for line in lines]
+        assert(c.timestamps().tolist() == [timestamps.parse(source['@timestamp']) for source in sources] + [cache.NAT] * 2)
+        users = c.values('user')
+        assert([users[code] for code in c.codes('user')[:len(lines)].tolist()] == [source['user']['target']['name'] for source in sources])
+        assert(c.codes('user')[len(lines):].tolist() == [cache.MISSING] * 2)
+
+        rows = dict(c.rows(['process', 'parent']))
+        pairs = Counter((s['data']['win']['eventdata']['newProcessName'], s['data']['win']['eventdata']['parentProcessName']) for s in sources)
+        assert(rows == pairs)
+        assert(list(rows) == list(pairs))
+
+
+def test_rebuild():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        archive = os.path.join(directory, 'events.npz')
+        write(path, lines[:100])
+        with open(path) as input:
+            assert(cache.load(archive, input).lines == 100)
+
+        # Unchanged, the cache is used as is
+        built = os.stat(archive).st_mtime_ns
+        with open(path) as input:
+            assert(cache.load(archive, input).lines == 100)
+        assert(os.stat(archive).st_mtime_ns == built)
+
+        # Appended to, and rewritten
+        write(path, lines[100:200], 'a')
+        with open(path) as input:
+            assert(cache.load(archive, input).lines == 200)
+        write(path, lines[200:] + lines[:200])
+        os.utime(path, ns=(0, 0))
+        with open(path) as input:
+            c = cache.load(archive, input)
+        assert(c.lines == len(lines))
+        assert(c.timestamps()[0] == timestamps.parse(json.loads(lines[200])['_source']['@timestamp']))
+
+        # Without the export, whatever cache there is is used
+        assert(cache.load(archive).lines == len(lines))
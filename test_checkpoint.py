@@ -0,0 +1,108 @@
+from typing import Any, List, Tuple
+import json
+import os
+import tempfile
+import pandas as pd
+import engine
+import logon_times
+import rare_users
+import synth
+import timestamps
+
+lines: List[str] = list(synth.logons(synth.Settings(events=2000, users=20, days=7, seed=1)))
+
+
+# Alert sink keeping what it is handed
+class Alerts:
+
+    def __init__(self) -> None:
+        self.alerts: List[Tuple[str, str, Any]] = []
+
+    def emit(self, detector: str, message: str, kv: Any) -> None:
+        self.alerts.append((detector, message, kv))
+
+    def close(self) -> None:
+        pass
+
+
+def write(path: str, lines: List[str], mode: str = 'w') -> None:
+    with open(path, mode) as output:
+        output.writelines(lines)
+
+
+def users(state: str, path: str, window: str = '24h') -> engine.Engine:
+    with open(path) as input:
+        return engine.run(input, [rare_users.Detector(pd.Timedelta(0), pd.to_timedelta(window))], state=state)
+
+
+def test_resume():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        state = os.path.join(directory, 'state')
+        write(path, lines[:1000])
+        assert(users(state, path).events == 1000)
+        write(path, lines[1000:], 'a')
+        assert(users(state, path).events == len(lines))
+
+
+def test_replaced():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        state = os.path.join(directory, 'state')
+        write(path, lines[:1000])
+        assert(users(state, path).events == 1000)
+
+        # Rewritten in place with other events, longer than the offset
+        write(path, lines[1000:])
+        assert(users(state, path).events == 1000 + len(lines) - 1000)
+
+        # Rotated, a new file at the same path
+        os.unlink(path)
+        write(path, lines)
+        assert(users(state, path).events == 2 * len(lines))
+
+
+def test_settings():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        state = os.path.join(directory, 'state')
+        write(path, lines[:1000])
+        assert(users(state, path).events == 1000)
+
+        # Restarted with another window, the old model is not carried on
+        try:
+            users(state, path, '48h')
+            assert(False)
+        except ValueError as e:
+            assert('rare_users' in str(e))
+        assert(users(state, path).events == 1000)
+
+
+# A user logging on once an hour, and then fifty times in the last hour
+def burst() -> List[str]:
+    template = json.loads(lines[-1])
+    last = timestamps.parse(template['_source']['@timestamp'])
+    hours = [last - h * logon_times.HOUR for h in reversed(range(1, 100))] + [last] * 50
+    result = []
+    for timestamp in hours:
+        template['_source']['@timestamp'] = timestamps.isoformat(timestamp)
+        template['_source']['user']['target']['name'] = 'burst.user'
+        result.append(json.dumps(template) + '\n')
+    return result
+
+
+def test_hourly_finished():
+    def run(state: str, path: str) -> List[str]:
+        alerts = Alerts()
+        with open(path) as input:
+            engine.run(input, [logon_times.Detector(pd.to_timedelta('120h'), hourly=True)], state=state, alerts=alerts)
+        return [kv['user'] for _, message, kv in alerts.alerts if message == 'anomalous logon for user']
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        state = os.path.join(directory, 'state')
+        write(path, lines + burst())
+        assert(run(state, path)[-1:] == ['burst.user'])
+
+        # The last hour was scored at the end of the first run
+        assert(run(state, path) == [])
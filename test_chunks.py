@@ -0,0 +1,60 @@
+from typing import Iterable, List
+import os
+import tempfile
+import chunks
+
+contents: List[bytes] = [
+    b'',
+    b'\n',
+    b'a\nbb\nccc\n',
+    b'a\nbb\nccc',
+    b'one very long line' * 100 + b'\nshort\n\n\nx',
+    b''.join(b'%d\n' % n for n in range(1000)),
+]
+
+
+def test_ranges():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        for content in contents:
+            with open(path, 'wb') as output:
+                output.write(content)
+            expected = content.splitlines(keepends=True)
+            for parts in [1, 2, 3, 7, 64, 10000]:
+                ranges = chunks.ranges(path, parts)
+                assert(ranges == [] if not content else ranges[0][0] == 0 and ranges[-1][1] == len(content))
+                for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                    assert(end == start and content[end - 1:end] == b'\n')
+                assert([line for start, end in ranges for line in chunks.lines(path, start, end)] == expected)
+
+                # From the offset past some line
+                if len(expected) > 2:
+                    offset = len(b''.join(expected[:2]))
+                    ranges = chunks.ranges(path, parts, offset)
+                    assert([line for start, end in ranges for line in chunks.lines(path, start, end)] == expected[2:])
+            assert(chunks.ranges(path, 4, len(content)) == [])
+
+
+def collect(lines: Iterable[bytes]) -> List[bytes]:
+    return list(lines)
+
+
+def test_imap():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        content = contents[-1]
+        with open(path, 'wb') as output:
+            output.write(content)
+        results = list(chunks.imap(collect, path, 3))
+        assert(len(results) == 3)
+        assert([line for result in results for line in result] == content.splitlines(keepends=True))
+        results = list(chunks.imap(collect, path, 2, start=content.index(b'\n500\n') + 1))
+        assert([line for result in results for line in result] == content.splitlines(keepends=True)[500:])
+
+
+def test_path_of():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        with open(path, 'w') as output:
+            assert(chunks.path_of(output) == path)
+    assert(chunks.path_of(['a line']) is None)
@@ -0,0 +1,60 @@
+from typing import Any, List, Tuple, Union
+import json
+import engine
+
+
+# Detector failing on negative n, the way a detector fails on a malformed
+# timestamp
+class Failing:
+    name = 'failing'
+    paths = ('n',)
+
+    def __init__(self, batch: bool = False) -> None:
+        self.seen: List[int] = []
+        if batch:
+            self.observe_batch = self.check_batch
+
+    def observe(self, values: Tuple[Any, ...], input: Union[str, bytes]) -> List[engine.Record]:
+        n, = values
+        if n < 0:
+            raise ValueError('negative n')
+        self.seen.append(n)
+        return [('seen', {'n': n})] if n % 10 == 0 else []
+
+    # Validates the whole batch before observing any of it
+    def check_batch(self, values: List[Tuple[Any, ...]], inputs: List[Union[str, bytes]]) -> List[engine.Record]:
+        if any(n < 0 for n, in values):
+            raise ValueError('negative n')
+        return engine.observe_each(self, values, inputs)
+
+    def finish(self) -> List[engine.Record]:
+        return []
+
+
+# Alert sink keeping what it is handed
+class Alerts:
+
+    def __init__(self) -> None:
+        self.alerts: List[Tuple[str, str, Any]] = []
+
+    def emit(self, detector: str, message: str, kv: Any) -> None:
+        self.alerts.append((detector, message, kv))
+
+    def close(self) -> None:
+        pass
+
+
+lines: List[str] = [json.dumps({'n': n}) for n in [0, 1, -1, 2, 10, -2, 3, 20]] + ['not json']
+
+
+def test_dispatch():
+    for batch_size in [1, 3, 100]:
+        for batch in [False, True]:
+            detector = Failing(batch)
+            alerts = Alerts()
+            e = engine.run(lines, [detector], batch_size=batch_size, alerts=alerts)
+            assert(detector.seen == [0, 1, 2, 10, 3, 20])
+            assert([kv['n'] for _, _, kv in alerts.alerts] == [0, 10, 20])
+            assert(e.events == len(lines))
+            assert(e.skipped == 1)
+            assert(e.failed == {'failing': 2})
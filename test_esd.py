@@ -0,0 +1,67 @@
+from typing import List, Optional
+from adtk.detector import GeneralizedESDTestAD
+import numpy as np
+import pandas as pd
+import esd
+
+
+def series(values: List[float]) -> pd.Series:
+    return pd.Series(values, index=pd.date_range('2021-05-13', periods=len(values), freq='h'), dtype=np.float64)
+
+
+def adtk(values: List[float]) -> List[bool]:
+    return GeneralizedESDTestAD().fit_detect(series(values)).tolist()
+
+
+def detect(values: List[float], max_outliers: Optional[int] = None) -> List[bool]:
+    row = np.asarray([values], dtype=np.float64)
+    return esd.detect(esd.fit(row, max_outliers=max_outliers), row[0]).tolist()
+
+
+rng = np.random.default_rng(1)
+
+cases: List[List[float]] = [
+    [3.0] * 48,
+    [3.0] * 47 + [40.0],
+    [3.0, 4.0, 3.0, 5.0, 4.0] * 10 + [30.0],
+    [0.0] * 20 + [1.0] + [0.0] * 20,
+    list(rng.poisson(5, 100).astype(float)),
+    list(rng.poisson(5, 100).astype(float)) + [30.0, 45.0, 60.0],
+    list(rng.normal(10, 2, 200)) + [25.0, 30.0, 28.0, 35.0, -10.0],
+    [1.0, 1.0, 1.0, 2.0, 1.0, 1.0, 50.0, 1.0, 2.0, 1.0, 100.0, 1.0],
+]
+
+
+def test_adtk():
+    for values in cases:
+        assert(detect(values) == adtk(values))
+
+
+def test_rows():
+    # Rows of different lengths, padded with NaN, fit together as one by one
+    width = max(len(values) for values in cases)
+    rows = np.full((len(cases), width), np.nan)
+    for i, values in enumerate(cases):
+        rows[i, :len(values)] = values
+    normal = esd.fit(rows)
+    for i, values in enumerate(cases):
+        row = np.asarray([values], dtype=np.float64)
+        alone = esd.fit(row)
+        assert(np.allclose([part[i] for part in normal], [part[0] for part in alone]))
+        assert(esd.detect(tuple(part[i] for part in normal), row[0]).tolist() == adtk(values))
+
+
+def test_max_outliers():
+    values = list(np.random.default_rng(2).normal(10, 1, 100)) + [15.0, 16.0, 17.0, 18.0, 19.0] * 2
+    assert(sum(adtk(values)) == 10)
+    assert(detect(values, max_outliers=10) == adtk(values))
+    assert(detect(values, max_outliers=20) == adtk(values))
+
+    # At most max_outliers values are left out of the normal values, the
+    # outliers left in raise the deviation and hide some of the others
+    for max_outliers in [1, 4]:
+        _, _, count = esd.fit(np.asarray([values]), max_outliers=max_outliers)
+        assert(count.tolist() == [len(values) - max_outliers])
+        flagged = detect(values, max_outliers=max_outliers)
+        assert(0 < sum(flagged) < 10)
+        assert(all(a or not f for a, f in zip(adtk(values), flagged)))
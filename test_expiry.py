@@ -0,0 +1,52 @@
+import expiry
+
+HOUR = 3600 * 10 ** 9
+
+
+def test_window():
+    seen = expiry.ExpiringDict(10 * HOUR, lateness=0)
+    seen['a'] = 0
+    seen['b'] = 5 * HOUR
+    seen['c'] = 10 * HOUR
+    assert(list(seen) == ['a', 'b', 'c'])
+
+    # Keys are kept as long as they were seen within the window
+    seen['d'] = 12 * HOUR
+    assert(list(seen) == ['b', 'c', 'd'])
+    assert(seen.evicted == 1)
+    seen['b'] = 13 * HOUR
+    seen['e'] = 21 * HOUR
+    assert(list(seen) == ['d', 'b', 'e'])
+    assert(seen['b'] == 13 * HOUR)
+    assert(seen.get('a') is None)
+
+
+def test_lateness():
+    seen = expiry.ExpiringDict(10 * HOUR, lateness=2 * HOUR)
+    seen['a'] = 0
+    seen['b'] = 11 * HOUR
+    assert('a' in seen)
+    seen['c'] = 12 * HOUR
+    assert('a' in seen)
+    seen['d'] = 12 * HOUR + 1
+    assert('a' not in seen)
+
+    # A late event doesn't move the watermark back
+    seen['e'] = 3 * HOUR
+    assert(seen.watermark == 12 * HOUR + 1)
+    assert(list(seen) == ['b', 'c', 'd', 'e'])
+
+
+def test_max_keys():
+    seen = expiry.ExpiringDict(10 * HOUR, max_keys=3)
+    for i, key in enumerate('abc'):
+        seen[key] = i
+    seen['a'] = 3
+    seen['d'] = 4
+    assert(list(seen) == ['c', 'a', 'd'])
+    assert(seen.evicted == 1)
+    seen['e'] = 5
+    seen['f'] = 6
+    assert(list(seen) == ['d', 'e', 'f'])
+    assert(len(seen) == 3)
+    assert(seen.evicted == 3)
@@ -0,0 +1,66 @@
+from typing import Any, List
+import json
+import fields
+import synth
+
+
+PATHS = (fields.TIMESTAMP, fields.USER, fields.PROCESS, fields.PARENT, fields.COMPUTER, fields.TENANT)
+
+logons: List[str] = list(synth.logons(synth.Settings(events=200, seed=1)))
+processes: List[str] = list(synth.processes(synth.Settings(events=200, seed=1)))
+
+odd: List[str] = [
+    # Empty user.target, the only "name" key is agent.name
+    '{"_source":{"user":{"target":{}},"agent":{"name":"DEV-SURAJ"},"process":{},"@timestamp":"2021-05-13T01:51:02.672Z"}}',
+    # Keys of the path under another object
+    '{"_source":{"user":{},"agent":{"target":{"name":"DEV-SURAJ"}},"tenant":"td"}}',
+    '{"other":{"_source":{"tenant":"td"}},"_source":{"@timestamp":"2021-05-13T01:51:02.672Z"}}',
+    '{"_source":{"user":{"target":{"x":{"name":"SYSTEM"}}},"tenant":"td"}}',
+    '{"_source":{"data":{"win":{"system":{"eventdata":{"newProcessName":"a.exe"}}}}}}',
+    # Not an object on the way
+    '{"_source":{"user":{"target":"name"},"tenant":["td"]}}',
+    '{"_source":[{"tenant":"td"}]}',
+    # Braces and quotes in strings
+    '{"_source":{"key":"td_%{[user][target][name]}","user":{"target":{"name":"SYSTEM"}},"tenant":"td"}}',
+    '{"_source":{"user":{"a":"{"},"target":{"name":"SYSTEM"},"tenant":"}"}}',
+    '{"_source":{"user":{"target":{"name":"\\"name\\":"}},"x":"\\"tenant\\":\\"td\\""}}',
+    # Whitespace and deeply nested members
+    ' { "_source" : { "user" : { "target" : { "name" : "SYSTEM" } } , "tenant":"td" } } ',
+    '{"_source":{"a":{"b":{"c":{"d":{"e":{"f":{}}}}}},"tenant":"td","data":{"win":{"eventdata":{"newProcessName":"a.exe"}}}}}',
+]
+
+
+# Fields of a line as json.loads and indexing would give them
+def expected(line: str) -> List[Any]:
+    document = json.loads(line)
+    result: List[Any] = []
+    for path in PATHS:
+        try:
+            result.append(fields.walk(document, tuple(path.split('.'))))
+        except (KeyError, TypeError) as e:
+            result.append(type(e))
+    return result
+
+
+def decoded(line: str) -> List[Any]:
+    projected = fields.Decoder(*PATHS).project(line)
+    return [projected.get(path, KeyError) for path in PATHS]
+
+
+def test_project():
+    for line in logons + processes + odd:
+        assert(decoded(line) == [KeyError if e is TypeError else e for e in expected(line)])
+    decoder = fields.Decoder(fields.USER)
+    assert(decoder.project(odd[0]) == {})
+    assert(decoder.project(odd[7]) == {fields.USER: 'SYSTEM'})
+
+
+def test_decode():
+    for paths, lines in [((fields.TENANT,), logons), ((fields.TIMESTAMP, fields.USER), logons), (PATHS, processes)]:
+        decoder = fields.Decoder(*paths)
+        for line in lines:
+            document = json.loads(line)
+            values = tuple(fields.walk(document, tuple(path.split('.'))) for path in paths)
+            assert(decoder.decode(line) == values)
+            assert(decoder.decode(line.encode('utf-8')) == values)
+
@@ -1,46 +1,51 @@
 from typing import List
+import json
 import logon_times as main
 import pandas as pd
+import synth
 
-lines: List[str] = []
-for line in open('data/users.txt', 'r'):
-    lines.append(line)
+lines: List[str] = list(synth.logons(synth.Settings(events=2000, users=20, days=7, seed=1)))
 
 
 def test_event():
     line = lines[0]
-    timestamp, user = main.event(line)
-    assert(timestamp == pd.to_datetime('2021-05-17T10:33:17.698Z'))
-    assert(user) == 'SYSTEM'
+    (timestamp, user), raw = main.event(line)
+    source = json.loads(line)['_source']
+    assert(timestamp == pd.to_datetime(source['@timestamp']).value)
+    assert(user == source['user']['target']['name'])
+    assert(raw == line)
 
 
 def test_window():
     window = main.Window(pd.to_timedelta('24h'))
-    assert(len(window.events) == 0)
+    assert(len(window.data) == 0)
 
 
 def test_window_add():
     window = main.Window(pd.to_timedelta('24h'))
     for i in range(10):
-        event = main.event(lines[i])
+        event, _ = main.event(lines[i])
         window.add(event)
-        assert(window.events[i] == event)
+        timestamp, user = event
+        assert(window.data[user].count(main.hour_of(timestamp)) > 0)
+        assert(sum(int(ring.counts.sum()) for ring in window.data.values()) == i + 1)
 
 
 def test_window_prune():
-    first = main.event(lines[0])
-    last = main.event(lines[len(lines)-1])
-    window_size = (last[0] - first[0])/2
+    first, _ = main.event(lines[0])
+    last, _ = main.event(lines[len(lines)-1])
+    window_size = pd.Timedelta((last[0] - first[0]) // 2)
     window = main.Window(window_size)
     window.add(first)
     window.add(last)
     assert(window.prune() == 1)
-    assert(window.events[0][0] == last[0])
+    assert(sum(int(ring.counts.sum()) for ring in window.data.values()) == 1)
+    assert(window.data[last[1]].count(main.hour_of(last[0])) == 1)
 
 
 def test_saturated():
-    first = main.event(lines[0])
-    last = main.event(lines[len(lines)-1])
+    first, _ = main.event(lines[0])
+    last, _ = main.event(lines[len(lines)-1])
     window = main.Window(pd.to_timedelta('30d'))
     window.add(first)
     window.add(last)
@@ -54,20 +59,44 @@ def test_saturated():
 def test_check_basic():
     window = main.Window(pd.to_timedelta('1h'))
     for line in lines[:1000]:
-        window.add(main.event(line))
+        window.add(main.event(line)[0])
     assert(window.prune() > 0)
-    check = main.event(lines[1001])
+    check, _ = main.event(lines[1001])
     assert(len(window.check(check)) == 0)
 
 
 def test_check():
     window = main.Window(pd.to_timedelta('5d'))
     for line in lines:
-        window.add(main.event(line))
+        window.add(main.event(line)[0])
     assert(window.prune() > 0)
-    ts, _ = main.event(lines[len(lines)-1])
-    anomalies = window.check((ts, 'victoria.zorin@rhipe.com'))
+
+    # A user logging on once an hour, and then fifty times in the last hour
+    ts, _ = main.event(lines[len(lines)-1])[0]
+    hours = [ts - h * main.HOUR for h in range(1, 100)]
+    for timestamp in reversed(hours):
+        window.add((timestamp, 'burst.user'))
+    for i in range(50):
+        window.add((ts, 'burst.user'))
+    anomalies = window.check((ts, 'burst.user'))
     assert(len(anomalies) > 0)
 
+
+def test_check_burst_within_hour():
+    # The first logons of the hour look normal, the burst is caught as the
+    # hour's count crosses the bound of the cached model, without a refit
+    window = main.Window(pd.to_timedelta('5d'), refit_events=1000)
+    ts, _ = main.event(lines[len(lines)-1])[0]
+    for h in reversed(range(1, 100)):
+        window.add((ts - h * main.HOUR, 'burst.user'))
+    flagged = []
+    for i in range(50):
+        window.add((ts, 'burst.user'))
+        flagged.append(len(window.check((ts, 'burst.user'))) > 0)
+    assert(not flagged[0])
+    assert(flagged[-1])
+    assert(window.fits['burst.user'].events == 50)
+
+
 def test_main():
-    main.main(lines, pd.to_timedelta('1d'))
\ No newline at end of file
+    main.main(lines, pd.to_timedelta('1d'))
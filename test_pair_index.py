@@ -0,0 +1,49 @@
+from typing import List, Tuple
+import json
+import os
+import pickle
+import tempfile
+import pair_index
+import synth
+
+lines: List[str] = list(synth.processes(synth.Settings(events=2000, seed=1)))
+
+
+def pair_of(line: str) -> Tuple[str, str]:
+    eventdata = json.loads(line)['_source']['data']['win']['eventdata']
+    return (eventdata['newProcessName'], eventdata['parentProcessName'])
+
+
+training = {pair_of(line) for line in lines[:1000]}
+others = [pair_of(line) for line in lines[1000:]] + [('a.exe', 'b.exe')]
+
+
+def test_index():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.json')
+        with open(path, 'w') as output:
+            output.writelines(lines[:1000] + ['not json\n'])
+        with open(path) as input:
+            index = pair_index.build([input])
+        with open(path) as input:
+            assert(pair_index.build([input], workers=2).keys.tolist() == index.keys.tolist())
+        assert(len(index) == len(training))
+
+        pairs = list(training) + others
+        assert([pair in index for pair in pairs] == [pair in training for pair in pairs])
+        assert(index.contains(pairs).tolist() == [pair in training for pair in pairs])
+
+        # Saved, it is memory-mapped, and pickled by path
+        saved = os.path.join(directory, 'pairs.npy')
+        pair_index.save(saved, index)
+        loaded = pickle.loads(pickle.dumps(pair_index.load(saved)))
+        assert(loaded.path == saved)
+        assert(loaded.contains(pairs).tolist() == index.contains(pairs).tolist())
+
+        # The filter never misses a pair of the index
+        bloom = pair_index.PairFilter(index)
+        assert(all(bloom.contains(list(training))))
+
+    empty = pair_index.build([])
+    assert(empty.contains(others).tolist() == [False] * len(others))
+    assert(others[0] not in empty)
@@ -0,0 +1,128 @@
+from pathlib import Path
+from typing import List
+import json
+import os
+import tempfile
+import pandas as pd
+import poc
+import synth
+
+COLUMNS = ['new_process', 'parent_process', 'user', 'timestamp']
+
+
+def export(directory: str, lines: List[str], name: str = '4688') -> Path:
+    path = Path(directory) / f'{name}.json'
+    with path.open('w') as output:
+        output.writelines(lines)
+    return path
+
+
+def test_read_events():
+    with tempfile.TemporaryDirectory() as directory:
+        json_file = export(directory, synth.processes(synth.Settings(events=500, seed=1)))
+        csv_file = poc.parse_to_csv(json_file)
+        expected = poc.read_events(csv_file, COLUMNS)
+        everything = poc.read_events(csv_file)
+        parents = poc.rare_parents(csv_file, tolerance=50)
+        assert(list(expected.columns) == COLUMNS)
+        assert(str(expected['timestamp'].dtype) == 'datetime64[ns, UTC]')
+
+        # The cache gives the same frames, and every column without columns
+        cache_file = poc.parse_to_csv(json_file, columnar=True)
+        assert(poc.cached_events(csv_file) is not None)
+        pd.testing.assert_frame_equal(poc.read_events(csv_file, COLUMNS), expected)
+        pd.testing.assert_frame_equal(poc.read_events(cache_file, COLUMNS), expected)
+        pd.testing.assert_frame_equal(poc.read_events(csv_file), everything)
+        assert(list(everything.columns) == poc.FLAT_COLUMNS)
+        pd.testing.assert_frame_equal(poc.rare_parents(csv_file, tolerance=50), parents)
+
+        # A regenerated export and csv are not read from the stale cache
+        export(directory, synth.processes(synth.Settings(events=300, seed=2)))
+        poc.parse_to_csv(json_file)
+        assert(poc.cached_events(csv_file) is None)
+        assert(len(poc.read_events(csv_file, COLUMNS)) == 300)
+
+        # Without the export, nor when the csv is newer than the cache
+        os.remove(json_file)
+        os.utime(cache_file, ns=(0, 0))
+        assert(poc.cached_events(csv_file) is None)
+        os.utime(cache_file)
+        assert(poc.cached_events(csv_file) is not None)
+
+
+# Synthetic events with fields a csv has to quote: commas, quotes and line breaks
+def samples() -> List[str]:
+    logon = json.loads(next(synth.logons(synth.Settings(events=1, seed=3))))
+    logon['_source']['user']['target']['name'] = 'o"brien, j'
+    logon['_source']['agent']['os_full'] = 'Microsoft Windows 10, "Enterprise"\nEdition'
+    process = json.loads(next(synth.processes(synth.Settings(events=1, seed=3))))
+    process['_source']['data']['win']['eventdata']['newProcessName'] = 'C:\\Program Files\\a,"b".exe'
+    del process['_source']['data']['win']['eventdata']['parentProcessName']
+    return [json.dumps(logon) + '\n', json.dumps(process) + '\n']
+
+
+def rows(path: Path) -> List[List[object]]:
+    df = pd.read_csv(path, dtype=object)
+    assert(list(df.columns) == poc.FLAT_COLUMNS)
+    return [[None if pd.isna(value) else value for value in row] for row in df.values.tolist()]
+
+
+def expected_rows(lines: List[str]) -> List[List[object]]:
+    return [[None if value is None else str(value) for value in poc.flat_row(json.loads(line))] for line in lines]
+
+
+def test_parse_to_csv():
+    lines = samples()
+    logon, process = [poc.flat_row(json.loads(line)) for line in lines]
+    assert(len(logon) == len(process) == len(poc.FLAT_COLUMNS))
+    assert(logon[poc.FLAT_COLUMNS.index('event_code')] == '4624' and logon[poc.FLAT_COLUMNS.index('user')] == 'o"brien, j')
+    assert(process[poc.FLAT_COLUMNS.index('event_code')] == '4688')
+    assert(process[poc.FLAT_COLUMNS.index('parent_process')] is None)
+    assert(poc.flat_row({}) == [None] * len(poc.FLAT_COLUMNS))
+
+    with tempfile.TemporaryDirectory() as directory:
+        more = list(synth.logons(synth.Settings(events=200, seed=4))) + list(synth.processes(synth.Settings(events=200, seed=4)))
+        json_file = export(directory, lines + more)
+        for workers in [1, 3]:
+            csv_file = poc.parse_to_csv(json_file, workers=workers)
+            assert(csv_file == Path(directory) / 'flat_4688.csv')
+            assert(rows(csv_file) == expected_rows(lines + more))
+
+
+def test_convert_all():
+    lines = samples()
+    with tempfile.TemporaryDirectory() as directory:
+        export(directory, lines[:1] + list(synth.logons(synth.Settings(events=100, seed=5))), '4624')
+        export(directory, lines[1:] + list(synth.processes(synth.Settings(events=100, seed=5))), '4688')
+        paths = poc.convert_all(directory, workers=2)
+        assert(paths == [Path(directory) / 'flat_4624.csv', Path(directory) / 'flat_4688.csv'])
+        for path in paths:
+            with (Path(directory) / (path.stem[len('flat_'):] + '.json')).open() as input:
+                assert(rows(path) == expected_rows(list(input)))
+
+
+# The loop detect_all_timeseries_anomalies had before building every series in one groupby
+def per_individual(csv_file: Path, type: str) -> pd.DataFrame:
+    df = poc.read_events(csv_file, [type, 'timestamp'])
+    df[type] = df[type].str.replace("\\", "")
+    counts = []
+    for individual in df[type].unique():
+        selected = df[df[type] == individual].copy()
+        selected['time'] = pd.to_datetime(selected.timestamp).dt.round("h")
+        s = poc.validate_series(selected.groupby('time').timestamp.count())
+        counts.append((individual, sum(poc.GeneralizedESDTestAD().fit_detect(s))))
+    return pd.DataFrame(counts, columns=[type, 'anomalies_detected'])
+
+
+def test_detect_all_timeseries_anomalies():
+    with tempfile.TemporaryDirectory() as directory:
+        lines = synth.processes(synth.Settings(events=3000, users=8, paths=12, days=4, seed=6))
+        csv_file = poc.parse_to_csv(export(directory, lines))
+        anomalies = 0
+        for type in ['new_process', 'parent_process', 'user']:
+            expected = per_individual(csv_file, type)
+            assert(len(expected) > 1)
+            anomalies = anomalies + expected['anomalies_detected'].sum()
+            for workers in [1, 2]:
+                pd.testing.assert_frame_equal(poc.detect_all_timeseries_anomalies(csv_file, type=type, workers=workers), expected)
+        assert(anomalies > 0)
@@ -0,0 +1,55 @@
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+import rare_parents
+import sketch
+
+HOUR = 3600 * 10 ** 9
+
+rng = np.random.default_rng(1)
+events: List[Tuple[int, str, str]] = [
+    (i * 10 ** 9, 'proc%d.exe' % rng.zipf(1.5), 'parent%d.exe' % rng.zipf(2.0)) for i in range(5000)
+]
+
+
+def test_counts():
+    counts = rare_parents.Counts()
+    result = [counts.add(*event) for event in events]
+
+    # Shares of the launches so far, as the pandas groupby would have it
+    df = pd.DataFrame(data=events, columns=['time', 'process', 'parent'])
+    launches = df.groupby('process').cumcount() + 1
+    pairs = df.groupby(['process', 'parent']).cumcount() + 1
+    assert(np.allclose([percentage for percentage, _ in result], 100.0 * pairs / launches))
+    assert([n for _, n in result] == launches.tolist())
+
+
+def test_decay():
+    counts = rare_parents.Counts(pd.Timedelta(hours=1))
+    counts.add(0, 'a.exe', 'x.exe')
+    counts.add(0, 'a.exe', 'x.exe')
+    assert(np.allclose(counts.add(HOUR // 2, 'a.exe', 'y.exe'), (100.0 / (1 + 2 * 2 ** -0.5), 1 + 2 * 2 ** -0.5)))
+
+    # A launch counts half as much after every half-life, and the counts are
+    # rescaled to the later origin
+    percentage, launches = counts.add(3 * HOUR, 'a.exe', 'x.exe')
+    assert(counts.origin == 3 * HOUR)
+    assert(np.isclose(launches, 1 + 2 * 2 ** -3 + 2 ** -2.5))
+    assert(np.isclose(percentage, 100.0 * (1 + 2 * 2 ** -3) / launches))
+
+
+def test_rescale():
+    counts = rare_parents.Counts(pd.Timedelta(hours=1))
+    for _ in range(4):
+        counts.add(0, 'a.exe', 'x.exe')
+    counts.add(0, 'b.exe', 'x.exe')
+    counts.add(HOUR, 'c.exe', 'x.exe')
+    a, b = sketch.hash64('a.exe'), sketch.hash64('b.exe')
+    assert(np.isclose(counts.children[a] / counts.children[b], 4.0))
+    assert(np.isclose(counts.children[a], 2.0))
+
+    # Counts worth less than FLOOR launches are dropped
+    counts.add(7 * HOUR, 'c.exe', 'x.exe')
+    assert(a in counts.children and b not in counts.children)
+    assert(counts.pairs.keys() == {rare_parents.pair_key('a.exe', 'x.exe'), rare_parents.pair_key('c.exe', 'x.exe')})
+    assert(np.isclose(counts.children[a], 4 * 2 ** -7))
@@ -0,0 +1,30 @@
+from collections import Counter
+from typing import List
+import io
+import json
+import rare_process_pairs_historical
+import synth
+
+lines: List[str] = list(synth.processes(synth.Settings(events=2000, seed=1)))
+
+
+def test_pairs():
+    records = rare_process_pairs_historical.main(io.StringIO(''.join(lines)), None, None)['process_pair_rarity']
+
+    # One record per pair, with the dir/exe of its paths
+    pairs: Counter = Counter()
+    for line in lines:
+        eventdata = json.loads(line)['_source']['data']['win']['eventdata']
+        pairs[tuple(eventdata[key].replace('\\\\', '\\') for key in ['parentProcessName', 'newProcessName'])] += 1
+    assert(len(records) == len(pairs))
+    assert({(record['parent'], record['child']): record['pair_freq'] for record in records} == pairs)
+    for record in records:
+        for side in ['parent', 'child']:
+            directory, exe = record[side].rsplit('\\', 1)
+            assert((record[side + '.dir'], record[side + '.exe']) == (directory, exe))
+        assert(sum(int(entry.rsplit(':', 1)[1]) for entry in record['user.name']) == record['pair_freq'])
+
+
+def test_split_path():
+    assert(rare_process_pairs_historical.split_path('C:\\Windows\\System32\\cmd.exe') == ('C:\\Windows\\System32', 'cmd.exe'))
+    assert(rare_process_pairs_historical.split_path('cmd.exe') == ('', 'cmd.exe'))
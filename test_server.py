@@ -0,0 +1,147 @@
+from typing import Any, List, Tuple, Union
+import asyncio
+import json
+import os
+import tempfile
+import pandas as pd
+import engine
+import rare_users
+import server
+import synth
+
+
+# Detector recording what it is fed, and how full the queue was
+class Stub:
+    name = 'stub'
+    paths = ('producer', 'n')
+
+    def __init__(self) -> None:
+        self.events: List[Tuple[Any, ...]] = []
+        self.queued: List[int] = []
+        self.server: Any = None
+
+    def observe(self, values: Tuple[Any, ...], input: Union[str, bytes]) -> List[engine.Record]:
+        self.events.append(values)
+        if self.server is not None:
+            self.queued.append(self.server.queue.qsize())
+        return []
+
+    def finish(self) -> List[engine.Record]:
+        return []
+
+
+def line(producer: int, n: int) -> bytes:
+    return (json.dumps({'producer': producer, 'n': n}) + '\n').encode('utf-8')
+
+
+# Producer writing lines to the server and hanging up
+async def produce(connect: Any, lines: List[bytes]) -> None:
+    reader, writer = await connect()
+    for l in lines:
+        writer.write(l)
+        await writer.drain()
+    writer.close()
+    await writer.wait_closed()
+
+
+async def received(s: server.Server, events: int) -> None:
+    while s.engine.events < events:
+        await asyncio.sleep(0.01)
+
+
+def test_producers():
+    async def run() -> Stub:
+        stub = Stub()
+        s = server.Server(engine.Engine([stub]))
+        listening = await s.listen('127.0.0.1', 0)
+        port = listening.sockets[0].getsockname()[1]
+        connect = lambda: asyncio.open_connection('127.0.0.1', port)
+        await asyncio.gather(*[produce(connect, [line(p, n) for n in range(100)]) for p in range(3)])
+        await asyncio.wait_for(received(s, 300), 10)
+        await s.close()
+        return stub
+
+    stub = asyncio.run(run())
+    assert(len(stub.events) == 300)
+    for p in range(3):
+        assert([n for producer, n in stub.events if producer == p] == list(range(100)))
+
+
+def test_backpressure():
+    async def run() -> Stub:
+        stub = Stub()
+        s = server.Server(engine.Engine([stub]), queue_size=4)
+        stub.server = s
+        listening = await s.listen('127.0.0.1', 0)
+        port = listening.sockets[0].getsockname()[1]
+        connect = lambda: asyncio.open_connection('127.0.0.1', port)
+        await asyncio.gather(*[produce(connect, [line(p, n) for n in range(500)]) for p in range(4)])
+        await asyncio.wait_for(received(s, 2000), 10)
+        await s.close()
+        return stub
+
+    stub = asyncio.run(run())
+    assert(len(stub.events) == 2000)
+    assert(max(stub.queued) <= 4)
+
+
+def test_unix_socket_batches():
+    async def run(path: str) -> Tuple[Stub, server.Server]:
+        stub = Stub()
+        s = server.Server(engine.Engine([stub]), batch_size=16)
+        await s.listen(path=path)
+        connect = lambda: asyncio.open_unix_connection(path)
+        await produce(connect, [line(0, n) for n in range(50)] + [b'not json\n'])
+        await asyncio.wait_for(received(s, 51), 10)
+        await s.close()
+        return (stub, s)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'events.sock')
+        stub, s = asyncio.run(run(path))
+        assert(not os.path.exists(path))
+    assert([n for _, n in stub.events] == list(range(50)))
+    assert(s.engine.skipped == 1)
+
+
+def test_long_line():
+    async def run() -> Stub:
+        stub = Stub()
+        s = server.Server(engine.Engine([stub]), max_line=64)
+        listening = await s.listen('127.0.0.1', 0)
+        port = listening.sockets[0].getsockname()[1]
+        connect = lambda: asyncio.open_connection('127.0.0.1', port)
+        try:
+            await produce(connect, [line(0, 0), b'{"producer": 1, "n": "' + b'x' * 100 + b'"}\n', line(0, 1)])
+        except ConnectionError:
+            pass
+        await asyncio.wait_for(received(s, 1), 10)
+        await asyncio.sleep(0.1)
+        await s.close()
+        return stub
+
+    stub = asyncio.run(run())
+    assert(stub.events == [(0, 0)])
+
+
+def test_malformed_event():
+    logons = [l.encode('utf-8') for l in synth.logons(synth.Settings(events=200, seed=1))]
+    malformed = b'{"_source":{"@timestamp":"garbage","user":{"target":{"name":"SYSTEM"}}}}\n'
+
+    async def run(batch_size: int) -> server.Server:
+        detector = rare_users.Detector(pd.Timedelta(0), pd.to_timedelta('1d'))
+        s = server.Server(engine.Engine([detector]), queue_size=4, batch_size=batch_size)
+        listening = await s.listen('127.0.0.1', 0)
+        port = listening.sockets[0].getsockname()[1]
+        connect = lambda: asyncio.open_connection('127.0.0.1', port)
+        await produce(connect, [malformed] + logons)
+        await asyncio.wait_for(received(s, len(logons) + 1), 10)
+        await asyncio.wait_for(s.close(), 10)
+        return s
+
+    for batch_size in [1, 16]:
+        s = asyncio.run(run(batch_size))
+        assert(s.engine.events == len(logons) + 1)
+        assert(s.engine.skipped == 0)
+        assert(s.engine.failed == {'rare_users': 1})
+        assert(len(s.engine.detectors[0].model.seen) > 0)
@@ -0,0 +1,82 @@
+from typing import Any, Dict, List, Optional, Tuple, Union
+import json
+import os
+import time
+import pandas as pd
+import engine
+import fields
+import rare_users
+import shard
+import sink
+import synth
+
+lines: List[str] = list(synth.logons(synth.Settings(events=3000, seed=1)))
+
+
+def tenant_of(line: str) -> Optional[str]:
+    return json.loads(line)['_source'].get('tenant')
+
+
+# Events without a tenant are checked together
+untenanted = json.loads(lines[-1])
+del untenanted['_source']['tenant']
+lines.append(json.dumps(untenanted) + '\n')
+
+
+def detector() -> rare_users.Detector:
+    return rare_users.Detector(pd.Timedelta(0), pd.Timedelta(hours=6))
+
+
+def alerts_of(collector: sink.Collector) -> List[Tuple[Any, ...]]:
+    return sorted((detector, message, kv['logon_time'], kv['user']) for detector, message, kv in collector.take())
+
+
+def test_tenants():
+    # Each tenant checked on its own
+    by_tenant: Dict[Optional[str], List[str]] = {}
+    for line in lines:
+        by_tenant.setdefault(tenant_of(line), []).append(line)
+    expected = sink.Collector()
+    for tenant_lines in by_tenant.values():
+        engine.run(tenant_lines, [detector()], alerts=expected)
+    expected_alerts = alerts_of(expected)
+    assert(len(by_tenant) > 2)
+    assert(expected_alerts)
+
+    # The alerts don't depend on the workers or the batch size
+    for workers in [1, 3]:
+        for batch_size in [1, 16]:
+            collector = sink.Collector()
+            runner = shard.run(lines, [detector()], workers, batch_size=batch_size, alerts=collector)
+            assert(alerts_of(collector) == expected_alerts)
+            assert((runner.events, runner.skipped, runner.failed, runner.keys) == (len(lines), 0, {}, len(by_tenant)))
+
+
+def test_shard_of():
+    assert(shard.shard_of(None, 4) == 0)
+    assert({shard.shard_of('tenant%d' % i, 4) for i in range(100)} == {0, 1, 2, 3})
+    assert(shard.shard_of('tenant1', 4) == shard.shard_of('tenant1', 4))
+
+
+# Detector whose worker process dies outright, without a traceback
+class Dying:
+    name = 'dying'
+    paths = (fields.TENANT,)
+
+    def observe(self, values: Tuple[Any, ...], input: Union[str, bytes]) -> List[engine.Record]:
+        os._exit(3)
+
+    def finish(self) -> List[engine.Record]:
+        return []
+
+
+def test_dead_worker():
+    # Whether the worker dies with its queue full or with room to spare
+    for input in [lines[:10], lines * (shard.CHUNK * (shard.DEPTH + 2) // len(lines) + 1)]:
+        start = time.monotonic()
+        try:
+            shard.run(input, [Dying()], 1, alerts=sink.Collector())
+            assert(False)
+        except RuntimeError as e:
+            assert('exited with code 3' in str(e))
+        assert(time.monotonic() - start < 30)
@@ -0,0 +1,85 @@
+from typing import List
+import io
+import json
+import time
+import engine
+import sink
+import stats
+
+
+# Output failing on every write, with something other than an OSError
+class Broken(io.BytesIO):
+
+    def write(self, data: bytes) -> int:
+        raise RuntimeError('broken output')
+
+
+def test_write():
+    output = io.BytesIO()
+    s = sink.Sink(output, queue_size=4, interval=0.01, close_output=False)
+    for n in range(10):
+        s.emit('stub', 'alert', {'n': n, 'full_event': sink.Raw('{"n": %d}' % n)})
+    s.close()
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert([record['n'] for record in records] == list(range(10)))
+    assert(records[0] == {'event': 'alert', 'detector': 'stub', 'n': 0, 'full_event': {'n': 0}})
+    assert(s.written == 10)
+
+
+def test_raw_fields():
+    output = io.BytesIO()
+    s = sink.Sink(output, raw_fields=['_source.tenant'], close_output=False)
+    s.emit('stub', 'alert', {'full_event': sink.Raw(b'{"_source": {"tenant": "td", "user": "SYSTEM"}}')})
+    s.close()
+    assert(json.loads(output.getvalue())['full_event'] == {'_source.tenant': 'td'})
+
+
+def test_unformattable_alert():
+    output = io.BytesIO()
+    s = sink.Sink(output, queue_size=4, interval=0.01, close_output=False)
+    raws: List[str] = ['{"n": 0}', 'not json', '{"n": 2}']
+    for n, raw in enumerate(raws):
+        s.emit('stub', 'alert', {'n': n, 'full_event': sink.Raw(raw)})
+    s.close()
+    assert([json.loads(line)['n'] for line in output.getvalue().splitlines()] == [0, 2])
+
+
+def test_broken_output():
+    # More alerts than the queue holds, emit would block if the writer died
+    s = sink.Sink(Broken(), queue_size=4, interval=0.01)
+    for n in range(100):
+        s.emit('stub', 'alert', {'n': n})
+    s.close()
+    assert(s.failed)
+    assert(s.written == 0)
+    assert(s.dropped == 100)
+
+
+def test_reopen():
+    outputs = [io.BytesIO()]
+
+    def reopen() -> io.BytesIO:
+        return outputs[-1]
+
+    # The first batch fails, the next ones go to the reopened output
+    s = sink.Sink(Broken(), interval=0.01, close_output=False, reopen=reopen)
+    s.emit('stub', 'alert', {'n': 0})
+    deadline = time.monotonic() + 10
+    while not s.failed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert(s.failed)
+    for n in range(1, 6):
+        s.emit('stub', 'alert', {'n': n})
+    s.close()
+    assert([json.loads(line)['n'] for line in outputs[0].getvalue().splitlines()] == [1, 2, 3, 4, 5])
+    assert((s.written, s.dropped, s.failed) == (5, 1, False))
+
+
+def test_dropped_stats():
+    s = stats.Stats(None)
+    e = engine.Engine([], sink.Sink(Broken(), interval=0.01))
+    e.alerts.emit('stub', 'alert', {})
+    e.alerts.close()
+    s.report(e)
+    assert(s.record()['alerts_dropped'] == 1)
+    assert('detector_alerts_dropped_total 1\n' in s.prometheus())
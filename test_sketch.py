@@ -0,0 +1,62 @@
+from collections import Counter, deque
+from typing import Deque, Dict, List, Tuple
+import numpy as np
+import sketch
+
+HOUR = 3600 * 10 ** 9
+
+rng = np.random.default_rng(1)
+keys: List[int] = [sketch.hash64('key%d' % i) for i in range(20000)]
+
+
+def test_bloom_filter():
+    bloom = sketch.BloomFilter(10000, 0.01)
+    for key in keys[:10000]:
+        bloom.add(key)
+    assert(all(key in bloom for key in keys[:10000]))
+    false_positives = sum(key in bloom for key in keys[10000:])
+    assert(false_positives < 10000 * 0.02)
+
+    # Adding arrays of keys sets the same bits
+    updated = sketch.BloomFilter(10000, 0.01)
+    updated.update(np.array(keys[:5000], dtype=np.uint64))
+    updated.update(np.array(keys[5000:10000], dtype=np.uint64))
+    assert(updated.bits == bloom.bits)
+
+
+def test_count_min():
+    counts = Counter('key%d' % rng.zipf(1.3) for _ in range(50000))
+    count_min = sketch.CountMin(1000, 0.01)
+    for key, n in counts.items():
+        for _ in range(n):
+            count_min.add(sketch.hash64(key))
+    assert(all(count_min.count(sketch.hash64(key)) >= n for key, n in counts.items()))
+    assert(count_min.count(sketch.hash64('never')) <= max(counts.values()))
+
+
+# Verdicts of a dict of every sighting in the window, as the exact models
+def exact(events: List[Tuple[int, str]], size: int, min_count: int) -> List[bool]:
+    window: Deque[Tuple[int, str]] = deque()
+    counts: Dict[str, int] = Counter()
+    result = []
+    for timestamp, key in events:
+        while window and window[0][0] < timestamp - size:
+            counts[window.popleft()[1]] -= 1
+        result.append(counts[key] < min_count)
+        window.append((timestamp, key))
+        counts[key] += 1
+    return result
+
+
+def test_windowed():
+    times = np.sort(rng.integers(0, 100 * HOUR, 20000)).tolist()
+    events = [(t, 'user%d' % rng.zipf(1.5)) for t in times]
+    for min_count in [1, 3]:
+        windowed = sketch.Windowed(10 * HOUR, sketch.Approx(0.001, 10000, min_count))
+        approx = [windowed.rare(key, timestamp) for timestamp, key in events]
+        expected = exact(events, 10 * HOUR, min_count)
+
+        # A common key is never reported as rare, a rare one rarely missed
+        assert(all(e or not a for a, e in zip(approx, expected)))
+        assert(sum(approx) > 0.9 * sum(expected))
+        assert(len(windowed.sketches) <= sketch.PARTITIONS + 2)
@@ -0,0 +1,47 @@
+from typing import List
+import os
+import tempfile
+import pandas as pd
+import engine
+import rare_users
+import sink
+import stats
+import synth
+
+# A line that can't be decoded, and an event the detector fails on
+lines: List[str] = list(synth.logons(synth.Settings(events=2000, seed=1))) + ['not json\n', '{"_source":{"@timestamp":"garbage","user":{"target":{"name":"SYSTEM"}}}}\n']
+
+
+def test_run():
+    with tempfile.TemporaryDirectory() as directory:
+        metrics = os.path.join(directory, 'detector.prom')
+        s = stats.Stats(None, metrics)
+        alerts = sink.Collector()
+        detector = rare_users.Detector(pd.Timedelta(0), pd.Timedelta(hours=6))
+        engine.run(lines, [detector], alerts=alerts, stats=s)
+
+        record = s.record()
+        assert(record['events'] == len(lines))
+        assert(record['parse_failures'] == 1)
+        assert(record['detector_failures'] == {'rare_users': 1})
+        assert(record['alerts'] == {'rare_users': len(alerts.take())})
+        assert(record['keys'] == {'rare_users': len(detector.model.seen)})
+        assert(set(record['seconds']) == {'input', 'parse', 'emit'})
+        assert(set(record['detect_seconds']) == {'rare_users'})
+
+        # Written at the end of the run in the Prometheus text format
+        with open(metrics) as input:
+            text = input.read()
+        assert(text == s.prometheus())
+        assert('detector_events_total ' + str(len(lines)) + '\n' in text)
+        assert('detector_alerts_total{detector="rare_users"} ' + str(record['alerts']['rare_users']) + '\n' in text)
+        assert('# TYPE detector_keys gauge\n' in text)
+        assert('detector_parse_failures_total 1\n' in text)
+        assert('detector_failures_total{detector="rare_users"} 1\n' in text)
+        assert(not os.path.exists(metrics + '.partial'))
+
+
+def test_timed():
+    s = stats.Stats()
+    assert(list(s.timed('input', iter(range(5)))) == list(range(5)))
+    assert(s.stages['input'] > 0)
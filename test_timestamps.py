@@ -0,0 +1,77 @@
+from typing import List
+import warnings
+import numpy as np
+import pandas as pd
+import timestamps
+
+valid: List[str] = [
+    '2021-05-13T01:51:02.672Z',
+    '2021-05-13T01:51:02Z',
+    '2021-05-13T01:51:02.6Z',
+    '2021-05-13T01:51:02.67Z',
+    '2021-05-13T01:51:02.672123Z',
+    '2021-05-13T01:51:02.672123456Z',
+    '1969-12-31T23:59:59.999Z',
+    '2020-02-29T00:00:00.000Z',
+    '2021-12-31T23:59:59.999999999Z',
+    # Offsets, and no offset at all, which is taken as UTC
+    '2021-05-13T01:51:02.672+00:00',
+    '2021-05-13T03:51:02.672+02:00',
+    '2021-05-12T20:21:02.672-05:30',
+    '2021-05-13T01:51:02.672',
+    '2021-05-13T01:51:02',
+]
+
+malformed: List[str] = [
+    '',
+    'garbage',
+    '2021-05-13T01:51:02.abcZ',
+    '2021-13-13T01:51:02.672Z',
+    '2021-02-30T01:51:02.672Z',
+    '2021-05-13T25:51:02.672Z',
+    '2021-05-13T01:61:02.672Z',
+    '2021-05-13T01:51:62.672Z',
+    '2021-05-13T0a:51:02.672Z',
+    '2021-05-13T01:51:02.-672Z',
+    '2021-05-13T0é:51:02.672Z',
+]
+
+
+def expected(value: str) -> int:
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.value
+
+
+def test_parse():
+    for value in valid:
+        assert(timestamps.parse(value) == expected(value))
+    assert(timestamps.parse(valid[0]) == timestamps.parse(valid[10]))
+
+
+def test_malformed():
+    for value in malformed:
+        for parse in [timestamps.parse, lambda value: timestamps.parse_many([valid[0], value])]:
+            try:
+                parse(value)
+                assert(False), value
+            except ValueError:
+                pass
+
+
+def test_parse_many():
+    parsed = timestamps.parse_many(valid)
+    assert(parsed.dtype == np.dtype('datetime64[ns]'))
+    assert(parsed.view(np.int64).tolist() == [expected(value) for value in valid])
+    zulu = [value for value in valid if value.endswith('Z')]
+    assert(timestamps.parse_many(zulu).view(np.int64).tolist() == [expected(value) for value in zulu])
+    assert(len(timestamps.parse_many([])) == 0)
+
+
+def test_isoformat():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for value in valid:
+            timestamp = pd.Timestamp(expected(value), tz='UTC')
+            assert(timestamps.isoformat(expected(value)) == timestamp.to_pydatetime().isoformat())
@@ -0,0 +1,34 @@
+import io
+import json
+import whitelist
+
+# As in the README samples, paths arrive with their backslashes doubled
+readme = r'{"newProcessName":"C:\\\\Windows\\\\System32\\\\svchost.exe","parentProcessName":"C:\\\\Windows\\\\System32\\\\"}'
+
+
+def test_normalize():
+    assert(whitelist.normalize('svchost.exe') == 'svchost.exe')
+    assert(whitelist.normalize('  svchost.exe \r\n') == 'svchost.exe')
+    assert(whitelist.normalize('C:\\Windows\\System32') == 'C:\\Windows\\System32')
+    assert(whitelist.normalize('C:\\\\Windows\\\\System32') == 'C:\\Windows\\System32')
+    assert(whitelist.normalize('C:\\Windows\\System32\\') == 'C:\\Windows\\System32')
+    assert(whitelist.normalize('C:\\\\Windows\\\\System32\\\\\n') == 'C:\\Windows\\System32')
+    assert(whitelist.normalize('') == '')
+
+    event = json.loads(readme)
+    assert(event['newProcessName'] == 'C:\\\\Windows\\\\System32\\\\svchost.exe')
+    assert(whitelist.normalize(event['newProcessName']) == 'C:\\Windows\\System32\\svchost.exe')
+    assert(whitelist.normalize(event['parentProcessName']) == 'C:\\Windows\\System32')
+
+
+def test_load():
+    assert(whitelist.load(None) is None)
+    assert(whitelist.load(io.StringIO('')) == frozenset())
+
+    # Written by hand or copied out of the events, with blank lines between
+    entries = whitelist.load(io.StringIO('C:\\Windows\\System32\n\n  \nC:\\\\Program Files\\\\Git\\\\\r\n svchost.exe \n'))
+    assert(entries == frozenset(['C:\\Windows\\System32', 'C:\\Program Files\\Git', 'svchost.exe']))
+
+    event = json.loads(readme)
+    assert(whitelist.normalize(event['parentProcessName']) in entries)
+    assert(whitelist.normalize(event['newProcessName']) not in entries)
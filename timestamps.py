@@ -0,0 +1,92 @@
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Iterable, List
+import numpy as np
+import pandas as pd
+
+
+'''
+Timestamps are carried as int64 nanoseconds since the epoch (UTC).
+
+Event `@timestamp` values come in a fixed ISO-8601 form, e.g.
+2021-05-13T01:51:02.672Z, which is parsed here by slicing rather than
+through pd.to_datetime. Anything else falls back to pandas.
+'''
+
+
+SECOND = 10 ** 9
+HOUR = 3600 * SECOND
+DAY = 24 * HOUR
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+# Days since the epoch for a YYYY-MM-DD date, events arrive in runs of the
+# same day so this is almost always a cache hit.
+@lru_cache(maxsize=1024)
+def days(value: str) -> int:
+    return date(int(value[0:4]), int(value[5:7]), int(value[8:10])).toordinal() - EPOCH_ORDINAL
+
+
+# Seconds into the day for a HH:MM:SS time, which int() alone would let
+# through out of range or with a sign or space.
+@lru_cache(maxsize=4096)
+def clock(value: str) -> int:
+    hours, minutes, seconds = value[0:2], value[3:5], value[6:8]
+    if not (hours + minutes + seconds).isdigit() or hours >= '24' or minutes >= '60' or seconds >= '60':
+        raise ValueError(value)
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+# Parse an ISO-8601 timestamp into epoch nanoseconds
+def parse(value: str) -> int:
+    try:
+        if value[-1] == 'Z' and value[10] == 'T' and value[13] == ':' and value[16] == ':' and value[19] in '.Z':
+            seconds = days(value[:10]) * 86400 + clock(value[11:19])
+            fraction = value[20:-1]
+            if fraction and not fraction.isdigit():
+                raise ValueError(value)
+            return seconds * SECOND + (int(fraction[:9].ljust(9, '0')) if fraction else 0)
+    except (IndexError, ValueError):
+        pass
+    timestamp = pd.Timestamp(value)
+    if timestamp is pd.NaT:
+        raise ValueError(value)
+    return timestamp.value
+
+
+# Whether every HH:MM:SS is in range, numpy itself rolls 25:00:00 over into
+# the next day rather than refusing it.
+def clocks_valid(values: List[str]) -> bool:
+    if not values:
+        return True
+    digits = np.array(values, dtype='U8').view(np.uint32).reshape(-1, 8)[:, [0, 1, 3, 4, 6, 7]].astype(np.int64) - ord('0')
+    if ((digits < 0) | (digits > 9)).any():
+        return False
+    fields = digits[:, 0::2] * 10 + digits[:, 1::2]
+    return bool((fields < [24, 60, 60]).all())
+
+
+# Parse many ISO-8601 timestamps into a datetime64[ns] array
+def parse_many(values: Iterable[str]) -> np.ndarray:
+    values = list(values)
+    if all(value.endswith('Z') for value in values):
+        try:
+            if not clocks_valid([value[11:19] for value in values]):
+                raise ValueError(values)
+            return np.array([value[:-1] for value in values], dtype='datetime64[ns]')
+        except ValueError:
+            pass
+    return np.array([parse(value) for value in values], dtype=np.int64).view('datetime64[ns]')
+
+
+def floor(value: int, unit: int) -> int:
+    return value - value % unit
+
+
+# Format epoch nanoseconds the way Timestamp.to_pydatetime().isoformat() does
+# for a UTC timestamp.
+def isoformat(value: int) -> str:
+    seconds, nanoseconds = divmod(value, SECOND)
+    return (EPOCH + timedelta(seconds=seconds, microseconds=nanoseconds // 1000)).isoformat()
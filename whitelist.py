@@ -0,0 +1,20 @@
+from io import TextIOWrapper
+from typing import FrozenSet, Optional
+
+
+'''
+Whitelists for the historical reports: text files with one entry per line,
+loaded once into a set so each event is matched with a single lookup.
+'''
+
+
+# Normalize an entry or event value for matching: surrounding whitespace is
+# dropped, doubled backslashes collapsed and a trailing backslash removed.
+def normalize(value: str) -> str:
+    return value.strip().replace('\\\\', '\\').rstrip('\\')
+
+
+def load(input: Optional[TextIOWrapper]) -> Optional[FrozenSet[str]]:
+    if input is None:
+        return None
+    return frozenset(normalize(line) for line in input if line.strip())